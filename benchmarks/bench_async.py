@@ -0,0 +1,195 @@
+"""
+Load test the booking endpoints under uvicorn (async views) against the
+synchronous DRF views under gunicorn.
+
+Each server gets the same number of worker processes and a fresh copy of
+a seeded SQLite database. A pool of keep-alive connections then books a
+ticket and confirms its payment as fast as the server allows, and the
+request rate and latency percentiles are reported per server.
+
+Usage:
+    pip install uvicorn gunicorn
+    python benchmarks/bench_async.py [--requests 2000] [--concurrency 64] [--workers 2]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.bench_settings'
+
+USERNAME, PASSWORD = 'bench', 'bench'
+AUTH = 'Basic ' + base64.b64encode(f'{USERNAME}:{PASSWORD}'.encode()).decode()
+
+SERVERS = {
+    'wsgi': ('/ticket/', '/ticket/payment-verify/{}/'),
+    'asgi': ('/async/ticket/', '/async/ticket/payment-verify/{}/'),
+}
+
+
+def seed(path):
+    """
+    Create and seed the benchmark database at `path`; return the museum id.
+    """
+    os.environ['BENCH_DB'] = str(path)
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db import connection
+    from django.contrib.auth.models import User
+    from darshan_doot.models import Museum
+
+    call_command('migrate', verbosity=0)
+    User.objects.create_superuser(username=USERNAME, password=PASSWORD)
+    museum = Museum.objects.create(
+        name='Benchmark Museum', location='New Delhi', indian_adult_fee=20, indian_child_fee=10, camera_fee=0,
+        international_citizen_fee=500, timings='10:00 AM – 5:00 PM', closed_on='NA'
+    )
+    # Closing the last connection checkpoints the WAL into the file we copy
+    connection.close()
+    return museum.pk
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, port, workers, database):
+    env = dict(os.environ, BENCH_DB=str(database), PYTHONPATH=str(ROOT))
+    if kind == 'asgi':
+        command = [
+            sys.executable, '-m', 'uvicorn', 'darshan_doot.asgi:application', '--port', str(port),
+            '--workers', str(workers), '--no-access-log', '--log-level', 'warning',
+        ]
+    else:
+        command = [
+            sys.executable, '-m', 'gunicorn', 'darshan_doot.wsgi:application', '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers), '--log-level', 'warning',
+        ]
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{kind} server did not start')
+
+
+class Connection:
+    """
+    A minimal HTTP/1.1 keep-alive client, reconnecting when the server
+    closes the connection (gunicorn's sync workers close after every
+    response).
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, path, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        data = json.dumps(body).encode()
+        self.writer.write(
+            f'POST {path} HTTP/1.1\r\nHost: localhost\r\nAuthorization: {AUTH}\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n'.encode() + data
+        )
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            headers[name.strip().lower()] = value.strip()
+        payload = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection', '').lower() == 'close':
+            self.writer.close()
+            self.writer = None
+        return status, payload
+
+
+async def load(port, paths, museum_id, requests, concurrency):
+    create_path, pay_path = paths
+    booking = {
+        'user_phone': '9999999999', 'user_email': 'bench@example.com', 'adults': 1, 'children': 0,
+        'visiting_date': '2030-01-02', 'museum': museum_id, 'nationality': 'Indian',
+    }
+    timings = []
+    failures = 0
+    remaining = requests // 2
+
+    async def worker(number):
+        nonlocal failures, remaining
+        connection = Connection(port)
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            status, payload = await connection.request(create_path, booking)
+            timings.append(time.perf_counter() - started)
+            if status != 201:
+                failures += 1
+                continue
+            ticket_id = json.loads(payload)['ticket_id']
+            started = time.perf_counter()
+            status, _ = await connection.request(pay_path.format(ticket_id), {'transaction_id': f'txn_{ticket_id}'})
+            timings.append(time.perf_counter() - started)
+            failures += status != 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    return time.perf_counter() - started, sorted(timings), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        template = Path(tmp) / 'template.sqlite3'
+        museum_id = seed(template)
+        for kind in args.servers:
+            database = Path(tmp) / f'{kind}.sqlite3'
+            shutil.copy(template, database)
+            port = free_port()
+            server = start_server(kind, port, args.workers, database)
+            try:
+                elapsed, timings, failures = asyncio.run(
+                    load(port, SERVERS[kind], museum_id, args.requests, args.concurrency)
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+            def percentile(p):
+                return timings[min(len(timings) - 1, int(len(timings) * p))] * 1e3
+
+            print(
+                f'{kind}: {len(timings) / elapsed:.0f} req/s  p50: {percentile(0.50):.1f}ms  '
+                f'p99: {percentile(0.99):.1f}ms  failures: {failures}'
+            )
+
+
+if __name__ == '__main__':
+    main()
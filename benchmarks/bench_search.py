@@ -0,0 +1,101 @@
+"""
+Benchmark the museum search index over a synthetic catalogue.
+
+Usage:
+    python benchmarks/bench_search.py [--museums 50000] [--queries 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'darshan_doot.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from darshan_doot.search import SearchIndex  # noqa: E402
+
+KINDS = [
+    'Museum', 'Science Centre', 'Science City', 'Art Gallery', 'Haveli', 'Palace Museum', 'Fort', 'Planetarium',
+    'Archaeological Museum', 'Memorial', 'Sangrahalaya', 'Folk Art Museum', 'Railway Museum', 'Textile Museum',
+]
+PREFIXES = ['National', 'State', 'Regional', 'Government', 'City', 'Heritage', 'Tribal', 'Maritime', 'District', '']
+SYLLABLES = [
+    'ra', 'ja', 'pur', 'na', 'gar', 'bad', 'ko', 'lu', 'ck', 'now', 'ban', 'ga', 'lo', 're', 'mad', 'u', 'rai',
+    'ha', 'dra', 'shil', 'long', 'so', 'la', 'dehra', 'dun', 'am', 'rit', 'sar', 'bho', 'pal', 'pat', 'ti', 'ala',
+]
+
+
+def place_names(count, rng):
+    names = set()
+    while len(names) < count:
+        names.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize())
+    return sorted(names)
+
+
+def synthetic_catalogue(count, rng):
+    """
+    Yield (id, name, location) rows shaped like the real catalogue: a few
+    common words ("Museum", "Science Centre") over many distinct place names.
+    """
+    places = place_names(max(count // 10, 10), rng)
+    for museum_id in range(1, count + 1):
+        place = rng.choice(places)
+        name = ' '.join(filter(None, [rng.choice(PREFIXES), rng.choice(KINDS), rng.choice(places)]))
+        yield museum_id, name, f'{rng.randint(1, 500)} Main Road, {place}'
+
+
+def typo(text, rng):
+    chars = list(text)
+    index = rng.randrange(len(chars))
+    chars[index] = rng.choice('abcdefghijklmnopqrstuvwxyz')
+    return ''.join(chars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--museums', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    catalogue = list(synthetic_catalogue(args.museums, rng))
+    index = SearchIndex()
+    started = time.perf_counter()
+    for museum_id, name, location in catalogue:
+        index.add(museum_id, name, location)
+    build = time.perf_counter() - started
+
+    queries = []
+    for _ in range(args.queries):
+        museum_id, name, location = rng.choice(catalogue)
+        words = name.split() + location.split(', ')[-1:]
+        rng.shuffle(words)
+        queries.append((museum_id, typo(' '.join(words).lower(), rng)))
+
+    timings = []
+    found = 0
+    for museum_id, query in queries:
+        started = time.perf_counter()
+        results = index.search(query)
+        timings.append(time.perf_counter() - started)
+        found += any(doc_id == museum_id for doc_id, _ in results)
+    timings.sort()
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p))] * 1e6
+
+    print(f'museums: {args.museums}  words: {len(index.postings)}  build: {build:.2f}s')
+    print(f'queries: {len(timings)}  p50: {percentile(0.50):.0f}us  p95: {percentile(0.95):.0f}us  p99: {percentile(0.99):.0f}us')
+    print(f'target museum in top results: {found / len(queries):.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""
+Settings for the HTTP load benchmarks: the project settings with a
+throwaway SQLite database and a fast password hasher, so the numbers
+measure the request path rather than PBKDF2.
+"""
+
+import os
+
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+from darshan_doot.settings import *  # noqa: E402,F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['BENCH_DB'],
+        # WAL and IMMEDIATE transactions let concurrent workers queue for the
+        # write lock instead of failing with "database is locked".
+        'OPTIONS': {'timeout': 30, 'transaction_mode': 'IMMEDIATE', 'init_command': 'PRAGMA journal_mode=WAL;'},
+    }
+}
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+STRIPE_WEBHOOK_WORKER = 'command'
+TICKET_ARTIFACT_DIR = os.path.join(os.path.dirname(os.environ['BENCH_DB']), 'ticket_artifacts')
+DATABASE_REPLICAS = []
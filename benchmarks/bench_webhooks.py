@@ -0,0 +1,123 @@
+"""
+Load test the Stripe webhook endpoint with a burst of signed events, offline.
+
+A throwaway test database is created, filled with pending tickets, and hit
+with one event per ticket plus redeliveries and out-of-order refunds. The
+request path and the queue drain are timed separately.
+
+Usage:
+    SECRET_KEY=bench DEBUG=True python benchmarks/bench_webhooks.py [--events 10000] [--duplicates 0.1]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'darshan_doot.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.db.models import Count  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from darshan_doot.models import DailyCapacity, Museum, Ticket  # noqa: E402
+from darshan_doot.stripe_fake import make_event, signed_event  # noqa: E402
+from darshan_doot.webhooks import process_pending_events  # noqa: E402
+
+SECRET = 'whsec_benchmark'
+
+
+def seed(tickets):
+    museum = Museum.objects.create(
+        name='Benchmark Museum', location='New Delhi', indian_adult_fee=20, indian_child_fee=10, camera_fee=0,
+        international_citizen_fee=500, timings='10:00 AM – 5:00 PM', closed_on='Monday'
+    )
+    day = date(2030, 1, 1)
+    DailyCapacity.objects.create(museum=museum, visiting_date=day, capacity=tickets * 2, remaining=tickets)
+    Ticket.objects.bulk_create(
+        Ticket(
+            user_phone='9999999999', user_email='visitor@example.com', museum=museum, visiting_date=day,
+            payment_status='pending', adults=1, children=0, total_amount=20, nationality='Indian'
+        )
+        for _ in range(tickets)
+    )
+    return list(Ticket.objects.values_list('ticket_id', flat=True))
+
+
+def burst(ticket_ids, duplicates, rng):
+    """
+    Return the events Stripe might send for `ticket_ids`: one success each,
+    a few refunds stamped later but delivered first, and redeliveries.
+    """
+    now = int(time.time())
+    stream = [make_event('payment_intent.succeeded', ticket_id, created=now) for ticket_id in ticket_ids]
+    refunds = [
+        make_event('charge.refunded', ticket_id, created=now + 60)
+        for ticket_id in rng.sample(ticket_ids, len(ticket_ids) // 50)
+    ]
+    stream = refunds + stream
+    stream += rng.sample(stream, int(len(stream) * duplicates))
+    rng.shuffle(stream)
+    return stream
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--duplicates', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with override_settings(STRIPE_WEBHOOK_SECRET=SECRET, STRIPE_WEBHOOK_WORKER='command'):
+            ticket_ids = seed(int(args.events / (1 + args.duplicates)))
+            requests = [signed_event(event, SECRET) for event in burst(ticket_ids, args.duplicates, rng)]
+
+            client = Client()
+            url = reverse('stripe_webhook')
+            timings = []
+            started = time.perf_counter()
+            for body, signature in requests:
+                request_started = time.perf_counter()
+                response = client.post(url, body, content_type='application/json', HTTP_STRIPE_SIGNATURE=signature)
+                timings.append(time.perf_counter() - request_started)
+                assert response.status_code == 200, response.status_code
+            elapsed = time.perf_counter() - started
+
+            drain_started = time.perf_counter()
+            processed = 0
+            while True:
+                consumed = process_pending_events()
+                if not consumed:
+                    break
+                processed += consumed
+            drain = time.perf_counter() - drain_started
+    finally:
+        statuses = dict(Ticket.objects.values_list('payment_status').annotate(count=Count('pk')))
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    timings.sort()
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p))] * 1e3
+
+    print(f'events: {len(requests)}  tickets: {len(ticket_ids)}  throughput: {len(requests) / elapsed:.0f} req/s')
+    print(f'p50: {percentile(0.50):.2f}ms  p95: {percentile(0.95):.2f}ms  p99: {percentile(0.99):.2f}ms')
+    print(f'drained {processed} events in {drain:.2f}s  ticket statuses: {statuses}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 from django.contrib import admin
-from django.db.models import Sum
-from .models import Event, Museum, Ticket
+from django.db.models import Count, Q, Sum
+import uuid
+from .models import DailyCapacity, DailySales, Event, Museum, StripeEvent, Ticket, TicketArchive
+from .routers import replica_reads
+from .sales import sales_summary
 
 @admin.register(Museum)
 class MuseumAdmin(admin.ModelAdmin):
@@ -8,6 +11,47 @@ class MuseumAdmin(admin.ModelAdmin):
     search_fields = ('name', 'location')
     ordering = ('name',)
 
+@admin.register(DailyCapacity)
+class DailyCapacityAdmin(admin.ModelAdmin):
+    list_display = ('museum', 'visiting_date', 'capacity', 'remaining')
+    list_filter = ('museum',)
+    date_hierarchy = 'visiting_date'
+    ordering = ('visiting_date',)
+
+@admin.register(DailySales)
+class DailySalesAdmin(admin.ModelAdmin):
+    list_display = ('museum', 'visiting_date', 'payment_status', 'tickets', 'persons', 'revenue')
+    list_filter = ('payment_status', 'museum')
+    date_hierarchy = 'visiting_date'
+    ordering = ('-visiting_date',)
+
+    def has_add_permission(self, request):
+        return False  # Maintained from ticket changes; rebuild with `manage.py backfill_sales`
+
+    def changelist_view(self, request, extra_context=None):
+        # A read-only report, so it is served from a replica; rendered here
+        # because the template's queries would otherwise run after the block
+        with replica_reads():
+            response = super().changelist_view(request, extra_context=extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+# Changelist query parameters the sales rollups can answer, and the
+# DailySales lookups they map to
+SUMMARY_ROLLUP_FILTERS = {
+    'payment_status__exact': 'payment_status',
+    'museum__id__exact': 'museum_id',
+    'visiting_date__year': 'visiting_date__year',
+    'visiting_date__month': 'visiting_date__month',
+    'visiting_date__day': 'visiting_date__day',
+}
+# Paging and ordering don't change the totals
+SUMMARY_IGNORED_PARAMS = {'o', 'p', 'all'}
+
 @admin.register(Ticket)
 class TicketAdmin(admin.ModelAdmin):
     list_display = [
@@ -23,16 +67,25 @@ class TicketAdmin(admin.ModelAdmin):
     search_fields = ('user_phone', 'ticket_id', 'transaction_id')
     date_hierarchy = 'visiting_date'
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Match the search term exactly against the phone number, transaction id
+        and ticket id, so each search is an index lookup instead of a
+        LIKE '%term%' scan over every ticket.
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        query = Q(user_phone=term) | Q(transaction_id=term)
+        try:
+            query |= Q(ticket_id=uuid.UUID(term))
+        except ValueError:
+            pass
+        return queryset.filter(query), False
+
     def total_persons(self, obj):
         return obj.adults + obj.children
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        queryset = queryset.annotate(
-            _total_persons=Sum('adults') + Sum('children')
-        )
-        return queryset
-
     def changelist_view(self, request, extra_context=None):
         response = super().changelist_view(request, extra_context=extra_context)
         
@@ -41,15 +94,31 @@ class TicketAdmin(admin.ModelAdmin):
         except (AttributeError, KeyError):
             return response
 
-        metrics = {
-            'total_sales': qs.aggregate(total_sales=Sum('total_amount'))['total_sales'],
-            'total_tickets': qs.count(),
-            'total_persons': qs.aggregate(total_persons=Sum('adults') + Sum('children'))['total_persons'],
-        }
-        
-        response.context_data['summary'] = metrics
+        with replica_reads():
+            response.context_data['summary'] = self.sales_summary(request, qs)
         return response
 
+    def sales_summary(self, request, queryset):
+        """
+        Totals for the filtered changelist. Museum, status and date filters
+        map onto the daily sales rollups and cost one small query however
+        many tickets match; a search falls back to a single aggregate over
+        the (index-backed) search results.
+        """
+        filters = {}
+        for param, value in request.GET.items():
+            if param in SUMMARY_IGNORED_PARAMS:
+                continue
+            if param not in SUMMARY_ROLLUP_FILTERS:
+                totals = queryset.order_by().aggregate(
+                    total_sales=Sum('total_amount'),
+                    total_tickets=Count('pk'),
+                    total_persons=Sum('adults') + Sum('children'),
+                )
+                return {name: value or 0 for name, value in totals.items()}
+            filters[SUMMARY_ROLLUP_FILTERS[param]] = value
+        return sales_summary(**filters)
+
     def has_add_permission(self, request):
         return False  # Prevent adding tickets directly from admin
 
@@ -63,6 +132,26 @@ class TicketAdmin(admin.ModelAdmin):
         return obj.user.nationality if obj.user else None
     user_nationality.short_description = 'Nationality'
 
+@admin.register(TicketArchive)
+class TicketArchiveAdmin(admin.ModelAdmin):
+    list_display = ('ticket_id', 'user_phone', 'museum', 'visiting_date', 'payment_status', 'archived_at')
+    list_filter = ('payment_status', 'museum')
+    search_fields = ('=user_phone', '=transaction_id')
+    date_hierarchy = 'visiting_date'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
     list_display = ('name', 'date', 'description')  # Customize the display fields
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'ticket_id', 'stripe_created', 'processed_at')
+    list_filter = ('event_type',)
+    search_fields = ('=event_id', '=ticket_id')
+    ordering = ('-stripe_created',)
@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+
+
+class DarshanDootConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'darshan_doot'
+
+    def ready(self):
+        from django.core import checks
+        from django.db.backends.signals import connection_created
+        from . import signals  # noqa: F401
+        from .metrics import install_query_wrapper
+        from .throttling import check_rates
+
+        connection_created.connect(install_query_wrapper)
+        checks.register(check_rates)
@@ -0,0 +1,102 @@
+"""
+QR codes for paid tickets: one admitting the whole party and one per
+member, so a group can split up at the gate.
+
+Codes are rendered into the content-addressed cache in darshan_doot/qr.py
+(TICKET_ARTIFACT_DIR), which every web process shares. A confirmed payment
+queues its ticket's codes on a small background process pool; the
+`render_tickets` command pre-renders a whole day across every core; and a
+download that still finds a code missing renders just that one. After
+that, downloads and resends are file reads.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from django.conf import settings
+from .gate import member_code, sign_ticket
+from .qr import cache_key, cache_path, render_png, render_to_cache, store
+
+logger = logging.getLogger(__name__)
+
+RENDER_CHUNK_SIZE = 200
+
+
+def artifact_dir():
+    return str(settings.TICKET_ARTIFACT_DIR)
+
+
+def ticket_codes(ticket):
+    """
+    Return `(member, payload)` for each code of `ticket`, the group code
+    (member None) first.
+    """
+    token = sign_ticket(ticket)
+    party = ticket.adults + ticket.children
+    return [(None, token)] + [(member, member_code(token, member)) for member in range(1, party + 1)]
+
+
+def get_code(payload):
+    """
+    Return `(key, path)` of the cached PNG for `payload`, rendering it now if
+    it isn't cached yet.
+    """
+    key = cache_key(payload)
+    path = cache_path(artifact_dir(), key)
+    if not os.path.exists(path):
+        store(artifact_dir(), key, render_png(payload))
+    return key, path
+
+
+def _process_pool(workers):
+    # Spawned rather than forked: the web process has threads and open
+    # database connections that a fork would copy
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def prerender(tickets, workers=None, chunk_size=RENDER_CHUNK_SIZE):
+    """
+    Render every code of `tickets` that isn't cached yet, in chunks spread
+    over `workers` processes (all cores by default). Returns how many
+    images were rendered.
+    """
+    directory = artifact_dir()
+    payloads = [
+        payload
+        for ticket in tickets
+        for _, payload in ticket_codes(ticket)
+        if not os.path.exists(cache_path(directory, cache_key(payload)))
+    ]
+    chunks = [payloads[start:start + chunk_size] for start in range(0, len(payloads), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers <= 1:
+        return sum(render_to_cache(directory, chunk) for chunk in chunks)
+    with _process_pool(workers) as pool:
+        return sum(pool.map(partial(render_to_cache, directory), chunks))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error('Rendering ticket QR codes failed', exc_info=future.exception())
+
+
+def render_later(ticket):
+    """
+    Queue `ticket`'s codes on the background pool, so they're ready by the
+    time they are downloaded. Does nothing when TICKET_RENDER_WORKERS is 0.
+    """
+    global _pool
+    if not settings.TICKET_RENDER_WORKERS:
+        return
+    with _pool_lock:
+        if _pool is None:
+            _pool = _process_pool(settings.TICKET_RENDER_WORKERS)
+    future = _pool.submit(render_to_cache, artifact_dir(), [payload for _, payload in ticket_codes(ticket)])
+    future.add_done_callback(_log_failure)
@@ -0,0 +1,267 @@
+"""
+Async versions of the endpoints the chatbot hits hardest: booking, ticket
+and payment verification, and the payment page. Under ASGI a burst of
+requests waits on the database as coroutines instead of each holding a
+worker. Simple reads use Django's async ORM; work that must run in a
+transaction (seat reservation, payment transitions) runs on a sized thread
+pool, so a burst can't open more database connections than it has threads.
+Stripe calls get a pool of their own, so a slow Stripe holds up payments
+but never the bookings and verifications queued for the database.
+
+These are plain Django views, since Django REST framework views are
+synchronous; they follow the same request and response formats and the
+same authentication and model permissions as their DRF counterparts.
+"""
+
+import asyncio
+import base64
+import binascii
+import contextvars
+import functools
+import json
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aauthenticate
+from django.db import DEFAULT_DB_ALIAS, close_old_connections
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.utils.encoders import JSONEncoder
+from .bookings import (
+    BookingError, book_ticket, booking_response, check_open, confirm_payment, new_ticket, parse_booking,
+    payment_response, record_intent, request_intent,
+)
+from . import pages
+from .models import Museum, Ticket
+from .routers import read_alias, replica_reads
+from .throttling import booking_keys, check, verify_keys
+
+_executor = None
+_http_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASYNC_BLOCKING_THREADS, thread_name_prefix='darshan-doot-blocking',
+                )
+    return _executor
+
+
+def get_http_executor():
+    global _http_executor
+    if _http_executor is None:
+        with _executor_lock:
+            if _http_executor is None:
+                # As many threads as the gateway allows calls in flight
+                _http_executor = ThreadPoolExecutor(
+                    max_workers=settings.STRIPE_POOL_SIZE, thread_name_prefix='darshan-doot-http',
+                )
+    return _http_executor
+
+
+def _call_blocking(func, args, kwargs):
+    # Pool threads live outside the request cycle, so drop connections
+    # that have gone stale or outlived CONN_MAX_AGE before each job
+    close_old_connections()
+    return func(*args, **kwargs)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run blocking `func` on the bounded pool and await its result.
+    """
+    loop = asyncio.get_running_loop()
+    # Carry the request's context over, so database routing sees its writes
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(context.run, _call_blocking, func, args, kwargs)
+    )
+
+
+async def run_outbound(func, *args):
+    """
+    Run `func`, a blocking call to another service that makes no queries,
+    on its own bounded pool and await its result.
+    """
+    loop = asyncio.get_running_loop()
+    # The context carries the request's metrics, which count Stripe calls
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_http_executor(), functools.partial(context.run, func, *args))
+
+
+def json_response(data, status=200):
+    # DRF's encoder, so amounts and ids render as they do from the DRF views
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+class _CSRFCheck(CsrfViewMiddleware):
+    def _reject(self, request, reason):
+        return reason
+
+
+async def authenticate(request):
+    """
+    Authenticate like the DRF views: HTTP Basic, or the session with its
+    CSRF token. Returns the user or None.
+    """
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Basic '):
+        try:
+            username, _, password = base64.b64decode(header[6:]).decode().partition(':')
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+        return await aauthenticate(request, username=username, password=password)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return None
+    check = _CSRFCheck(lambda request: None)
+    check.process_request(request)
+    if check.process_view(request, None, (), {}) is not None:
+        return None
+    return user
+
+
+def requires_perm(perm):
+    """
+    Only let users holding `perm` through, as DjangoModelPermissions does
+    for writes.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            user = await authenticate(request)
+            if user is None or not await sync_to_async(user.has_perm)(perm):
+                return json_response(
+                    {'detail': 'You do not have permission to perform this action.'}, status=403,
+                )
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def throttled(keys):
+    """
+    Return a 429 response if the request is over any of its limits, else
+    None. The Redis-backed store is a network call, so it runs off the
+    event loop.
+    """
+    if settings.REDIS_URL:
+        wait = await sync_to_async(check, thread_sensitive=False)(keys)
+    else:
+        wait = check(keys)
+    if not wait:
+        return None
+    response = json_response(
+        {'detail': f'Request was throttled. Expected available in {math.ceil(wait)} seconds.'}, status=429,
+    )
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        raise BookingError('Request body must be JSON.')
+
+
+@csrf_exempt
+@require_POST
+@requires_perm('darshan_doot.add_ticket')
+async def create_ticket(request):
+    """
+    Async `TicketViewSet.create`.
+    """
+    try:
+        data = _json_body(request)
+    except BookingError as e:
+        return json_response({'error': e.message}, status=e.status_code)
+    refused = await throttled(booking_keys(request, data if isinstance(data, dict) else {}))
+    if refused:
+        return refused
+    try:
+        booking = parse_booking(data)
+    except BookingError as e:
+        return json_response({'error': e.message}, status=e.status_code)
+
+    museum = await Museum.objects.filter(id=booking['museum_id']).afirst()
+    if not museum:
+        return json_response({'error': 'Museum not found.'}, status=404)
+    try:
+        check_open(museum, booking['visiting_date'])
+        ticket = new_ticket(museum, booking)
+        await run_blocking(book_ticket, ticket)
+    except BookingError as e:
+        return json_response({'error': e.message}, status=e.status_code)
+    intent = await run_outbound(request_intent, ticket)
+    if intent is not None:
+        await run_blocking(record_intent, ticket, intent)
+    return json_response(booking_response(ticket, museum, intent), status=201)
+
+
+@csrf_exempt
+@require_POST
+@requires_perm('darshan_doot.add_ticket')
+async def verify_ticket(request, ticket_id):
+    """
+    Async `TicketViewSet.verify`.
+    """
+    refused = await throttled(verify_keys(request, ticket_id))
+    if refused:
+        return refused
+    try:
+        verification_code = _json_body(request).get('verification_code')
+    except (BookingError, AttributeError):
+        verification_code = None
+    # A missing code would match the NULL code of an unpaid ticket
+    if not verification_code or not isinstance(verification_code, str):
+        return json_response({'error': 'verification_code is required.'}, status=400)
+    if await Ticket.objects.filter(ticket_id=ticket_id, verification_code=verification_code).aexists():
+        return json_response({'status': 'success'})
+    return json_response({'status': 'not found'}, status=404)
+
+
+@csrf_exempt
+@require_POST
+@requires_perm('darshan_doot.add_ticket')
+async def payment_verify(request, ticket_id):
+    """
+    Async `TicketViewSet.payment_verify`.
+    """
+    try:
+        transaction_id = _json_body(request).get('transaction_id')
+    except (BookingError, AttributeError):
+        transaction_id = None
+    if not transaction_id:
+        return json_response({'error': 'Transaction ID is required.'}, status=400)
+    try:
+        ticket = await run_blocking(confirm_payment, ticket_id, transaction_id)
+    except BookingError as e:
+        return json_response({'error': e.message}, status=e.status_code)
+    if ticket is None:
+        return json_response({'status': 'not found'}, status=404)
+    return json_response(payment_response(ticket))
+
+
+@require_GET
+async def payment_page(request, ticket_id):
+    """
+    Async `PaymentView`.
+    """
+    with replica_reads():
+        alias = read_alias()
+        ticket = await pages.payment_query(ticket_id).using(alias).afirst()
+    if pages.needs_primary(alias, ticket and ticket.payment_status):
+        ticket = await pages.payment_query(ticket_id).using(DEFAULT_DB_ALIAS).afirst()
+    if ticket is None:
+        return json_response({'error': 'Ticket not found.'}, status=404)
+    return await sync_to_async(pages.payment_page)(request, ticket)
@@ -0,0 +1,272 @@
+import random
+import string
+import uuid
+from datetime import datetime
+from functools import partial
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.utils.http import urlencode
+from .artifacts import render_later
+from .capacity import reserve_seats
+from .closures import get_calendar
+from .gate import EPOCH, LAST_DAY, MAX_PARTY_MEMBERS, sign_ticket
+from .models import Ticket
+from .payments import PaymentGatewayError, get_gateway
+from .pricing import museum_fees, price_party
+from .states import PAID, PENDING, transition
+
+REQUIRED_FIELDS = ['user_phone', 'user_email', 'adults', 'children', 'visiting_date', 'museum', 'nationality']
+QUOTE_FIELDS = ['adults', 'children', 'museum', 'nationality']
+
+
+class BookingError(Exception):
+    """
+    A booking request that can't be accepted, with the HTTP status to report.
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def text_field(data, field):
+    """
+    Return `data[field]` if it is a string that fits the Ticket column of
+    the same name. Raises BookingError otherwise.
+    """
+    value = data[field]
+    max_length = Ticket._meta.get_field(field).max_length
+    if not isinstance(value, str) or len(value) > max_length:
+        raise BookingError(f'{field} must be text of at most {max_length} characters.')
+    return value
+
+
+def parse_party(data, required=REQUIRED_FIELDS):
+    """
+    Validate the party, museum and date of a booking or quote request and
+    return its cleaned fields. Raises BookingError describing the first
+    problem found.
+    """
+    if not isinstance(data, dict):
+        raise BookingError('Booking must be an object.')
+    for field in required:
+        if field not in data:
+            raise BookingError(f'Missing required field: {field}')
+
+    try:
+        adults = int(data['adults'])
+        children = int(data['children'])
+        cameras = int(data.get('cameras', 0))
+        students = int(data.get('students', 0))
+    except (TypeError, ValueError):
+        raise BookingError('adults, children, cameras and students must be whole numbers.')
+    if adults < 0 or children < 0 or adults + children == 0:
+        raise BookingError('A booking needs at least one visitor.')
+    if adults > MAX_PARTY_MEMBERS or children > MAX_PARTY_MEMBERS:
+        raise BookingError(f'A booking can have at most {MAX_PARTY_MEMBERS} adults and {MAX_PARTY_MEMBERS} children.')
+    if cameras < 0 or not 0 <= students <= adults + children:
+        raise BookingError('cameras and students must be between zero and the party size.')
+
+    try:
+        museum_id = int(data['museum'])
+    except (TypeError, ValueError):
+        raise BookingError('Museum not found.', status_code=404)
+
+    visiting_date = data.get('visiting_date')
+    if visiting_date is not None:
+        try:
+            visiting_date = datetime.strptime(visiting_date, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            raise BookingError('visiting_date must be in YYYY-MM-DD format.')
+        if not EPOCH <= visiting_date <= LAST_DAY:
+            raise BookingError(f'visiting_date must be between {EPOCH} and {LAST_DAY}.')
+
+    return {
+        'adults': adults,
+        'children': children,
+        'cameras': cameras,
+        'students': students,
+        'visiting_date': visiting_date,
+        'museum_id': museum_id,
+        'nationality': text_field(data, 'nationality'),
+    }
+
+
+def parse_booking(data):
+    """
+    Validate a booking request body and return its cleaned fields.
+    Raises BookingError describing the first problem found.
+    """
+    booking = parse_party(data)
+    if booking['visiting_date'] is None:
+        raise BookingError('visiting_date must be in YYYY-MM-DD format.')
+    booking['user_phone'] = text_field(data, 'user_phone')
+    booking['user_email'] = text_field(data, 'user_email')
+    return booking
+
+
+def check_open(museum, visiting_date):
+    if not get_calendar(museum).is_open(visiting_date):
+        raise BookingError(f'Museum is closed on {visiting_date.isoformat()}.')
+
+
+def ticket_total(museum, booking):
+    """
+    Price a parsed booking at `museum`.
+    """
+    return price_party(
+        museum_fees(museum), booking['nationality'], booking['adults'], booking['children'],
+        booking['cameras'], booking['students'],
+    )['total']
+
+
+def payment_url(ticket_id):
+    return f"/payment/{ticket_id}/"
+
+
+def new_ticket(museum, booking):
+    """
+    Build the unsaved ticket for a parsed booking. The ticket id is generated
+    here rather than by the database, so the payment URL is known up front
+    and the ticket is written in one INSERT.
+    """
+    ticket_id = uuid.uuid4()
+    return Ticket(
+        ticket_id=ticket_id,
+        user_phone=booking['user_phone'],
+        user_email=booking['user_email'],
+        museum=museum,
+        visiting_date=booking['visiting_date'],
+        adults=booking['adults'],
+        children=booking['children'],
+        total_amount=ticket_total(museum, booking),
+        payment_status=PENDING,
+        nationality=booking['nationality'],
+        stripe_payment_intent_id=payment_url(ticket_id),
+    )
+
+
+def book_ticket(ticket):
+    """
+    Hold the seats on the day's ledger row, then write the ticket.
+    Raises BookingError when the day is sold out.
+    """
+    with transaction.atomic():
+        if not reserve_seats(ticket.museum_id, ticket.visiting_date, ticket.adults + ticket.children):
+            raise BookingError('Museum is fully booked on this date.', status_code=409)
+        ticket.save()
+
+
+def request_intent(ticket):
+    """
+    Create the Stripe PaymentIntent for a booked ticket. Returns it, or None
+    when Stripe isn't configured or can't be reached. Makes no queries.
+    """
+    gateway = get_gateway()
+    if gateway is None:
+        return None
+    try:
+        return gateway.create_intent(ticket)
+    except PaymentGatewayError:
+        return None
+
+
+def record_intent(ticket, intent):
+    Ticket.objects.filter(ticket_id=ticket.ticket_id, payment_status=PENDING).update(
+        stripe_payment_intent_id=intent.id
+    )
+    ticket.stripe_payment_intent_id = intent.id
+
+
+def start_payment(ticket):
+    """
+    Create the Stripe PaymentIntent for a booked ticket and record its id on
+    the ticket. Returns the intent, or None when Stripe isn't configured or
+    can't be reached; the booking stands either way and the ticket keeps its
+    payment page URL.
+    """
+    intent = request_intent(ticket)
+    if intent is not None:
+        record_intent(ticket, intent)
+    return intent
+
+
+def confirm_payment(ticket_id, transaction_id):
+    """
+    Mark a pending ticket paid under `transaction_id` with a fresh
+    verification code and return it, or None if there is no such ticket.
+    A ticket the Stripe webhook already marked paid, which has no
+    transaction id or code yet, is completed the same way. Retrying a
+    confirmation that already went through returns the same ticket;
+    anything else on a ticket that isn't pending raises BookingError.
+    """
+    characters = string.ascii_uppercase + string.digits
+    verification_code = ''.join(random.choice(characters) for _ in range(6))
+    try:
+        with transaction.atomic():
+            applied = transition(
+                ticket_id, PAID, verification_code=verification_code, transaction_id=transaction_id
+            )
+            if not applied:
+                # Guarded on the missing transaction id, so only one
+                # confirmation can complete a ticket the webhook paid
+                applied = Ticket.objects.filter(
+                    ticket_id=ticket_id, payment_status=PAID, transaction_id__isnull=True
+                ).update(verification_code=verification_code, transaction_id=transaction_id) == 1
+    except IntegrityError:
+        raise BookingError('Transaction ID has already been used.', status_code=409)
+
+    ticket = Ticket.objects.filter(ticket_id=ticket_id).only(
+        'ticket_id', 'museum_id', 'visiting_date', 'adults', 'children', 'total_amount',
+        'payment_status', 'verification_code', 'transaction_id',
+    ).first()
+    if ticket is None:
+        return None
+    # A retry of a verification that already went through gets the same answer
+    if not applied and not (ticket.payment_status == PAID and ticket.transaction_id == transaction_id):
+        raise BookingError('Ticket is not awaiting payment.', status_code=409)
+    if applied:
+        transaction.on_commit(partial(render_later, ticket))
+    return ticket
+
+
+def payment_response(ticket):
+    # The links go to the visitor, so they carry the code that lets them in
+    query = urlencode({'code': ticket.verification_code})
+    return {
+        'ticket_id': ticket.ticket_id,
+        'verification_code': ticket.verification_code,
+        'payment_status': ticket.payment_status,
+        'amount': ticket.total_amount,
+        'adults': ticket.adults,
+        'children': ticket.children,
+        'gate_token': sign_ticket(ticket),
+        'qr_code': f"{reverse('ticket_qr', args=[ticket.ticket_id])}?{query}",
+        'member_qr_codes': [
+            f"{reverse('ticket_member_qr', args=[ticket.ticket_id, member])}?{query}"
+            for member in range(1, ticket.adults + ticket.children + 1)
+        ],
+    }
+
+
+def booking_response(ticket, museum, intent=None):
+    response = {
+        'ticket_id': ticket.ticket_id,
+        'user_phone': ticket.user_phone,
+        'user_email': ticket.user_email,
+        'adults': ticket.adults,
+        'children': ticket.children,
+        'visiting_date': ticket.visiting_date,
+        'museum_name': museum.name,
+        'total_amount': ticket.total_amount,
+        # The payment page clients send to visitors, under its original name;
+        # the ticket's column holds the PaymentIntent id once there is one
+        'stripe_payment_intent': payment_url(ticket.ticket_id),
+        'payment_url': payment_url(ticket.ticket_id),
+        'payment_intent_id': None,
+    }
+    if intent is not None:
+        response['payment_intent_id'] = intent.id
+        response['client_secret'] = intent.client_secret
+    return response
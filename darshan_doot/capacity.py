@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.db.models import F
+from .models import DailyCapacity
+
+
+def default_capacity():
+    return settings.MUSEUM_DAILY_CAPACITY
+
+
+def reserve_seats(museum_id, visiting_date, seats):
+    """
+    Atomically take `seats` from the museum's ledger row for `visiting_date`.
+    The decrement is a single conditional UPDATE ... WHERE remaining >= seats,
+    so concurrent bookings never oversell and no table lock is needed.
+    A missing ledger row is created on demand with the default capacity.
+    Returns True when the seats were reserved.
+    """
+    ledger = DailyCapacity.objects.filter(
+        museum_id=museum_id, visiting_date=visiting_date, remaining__gte=seats
+    )
+    if ledger.update(remaining=F('remaining') - seats):
+        return True
+
+    # Nothing updated: either the day is sold out or it was never seeded.
+    # A concurrent first booking may have seeded it since, so the UPDATE is
+    # tried again whether or not this call created the row.
+    capacity = default_capacity()
+    DailyCapacity.objects.get_or_create(
+        museum_id=museum_id,
+        visiting_date=visiting_date,
+        defaults={'capacity': capacity, 'remaining': capacity},
+    )
+    return bool(ledger.update(remaining=F('remaining') - seats))
+
+
+def release_seats(museum_id, visiting_date, seats):
+    """
+    Give `seats` back to the ledger, never exceeding the day's capacity.
+    """
+    return DailyCapacity.objects.filter(
+        museum_id=museum_id,
+        visiting_date=visiting_date,
+        remaining__lte=F('capacity') - seats,
+    ).update(remaining=F('remaining') + seats)
+
+
+def reserve_many(requests):
+    """
+    Reserve seats for a batch of `(key, museum_id, visiting_date, seats)`
+    requests and return the set of keys that got their seats.
+    Requests for the same museum and day are first reserved together with one
+    UPDATE; only when that day can't hold the whole group are they retried one
+    by one, in order, so as many as fit still go through.
+    """
+    groups = {}
+    for key, museum_id, visiting_date, seats in requests:
+        groups.setdefault((museum_id, visiting_date), []).append((key, seats))
+
+    reserved = set()
+    for (museum_id, visiting_date), members in groups.items():
+        if reserve_seats(museum_id, visiting_date, sum(seats for _, seats in members)):
+            reserved.update(key for key, _ in members)
+            continue
+        for key, seats in members:
+            if reserve_seats(museum_id, visiting_date, seats):
+                reserved.add(key)
+    return reserved
@@ -0,0 +1,105 @@
+import hashlib
+import time
+from django.core.cache import caches
+
+CATALOGUE_CACHE = 'catalogue'
+VERSION_KEY = 'catalogue:version'
+# Versions a process may be behind and still catch up from the change log
+CHANGE_LOG_LENGTH = 100
+
+
+def get_cache():
+    return caches[CATALOGUE_CACHE]
+
+
+def normalize(value):
+    """
+    Normalize a filter value so "  Lucknow" and "lucknow" share a cache entry.
+    """
+    return ' '.join((value or '').lower().split())
+
+
+def _version(cache):
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from a clock value rather than 1 so an evicted version key can
+        # never bring back entries written under an older version.
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def catalogue_version():
+    """
+    Return the current catalogue version, which moves whenever a museum
+    changes. With REDIS_URL set every process reads the same value, so data
+    derived from museum rows (calendars, the search index) is rebuilt in
+    every worker, not just the one that saved the change.
+    """
+    return _version(get_cache())
+
+
+# Filters matched case-insensitively; the rest (cursors) are kept verbatim
+TEXT_FILTERS = {'q', 'name', 'location'}
+
+
+def listing_key(version, **filters):
+    filter_key = '|'.join(
+        f'{field}={normalize(value) if field in TEXT_FILTERS else value}' for field, value in sorted(filters.items())
+    )
+    return f'catalogue:{version}:{hashlib.sha1(filter_key.encode()).hexdigest()}'
+
+
+def get_listing(version, **filters):
+    """
+    Return the cached `(etag, body)` pair for a museum listing under
+    catalogue `version`, or None.
+    """
+    return get_cache().get(listing_key(version, **filters))
+
+
+def set_listing(version, body, **filters):
+    """
+    Cache the pre-rendered JSON `body` of a museum listing and return the
+    `(etag, body)` pair that was stored. `version` is the catalogue version
+    read before the body was built: a museum saved meanwhile has moved the
+    version on, so a body that may have missed it is never read again.
+    """
+    entry = (f'"{hashlib.sha1(body).hexdigest()}"', body)
+    get_cache().set(listing_key(version, **filters), entry)
+    return entry
+
+
+def change_key(version):
+    return f'catalogue:changes:{version}'
+
+
+def invalidate_catalogue(museum_ids=None):
+    """
+    Drop every cached listing by moving to a new version; old entries are
+    never read again and age out of the cache on their own. `museum_ids`,
+    when known, are logged under the new version for `changed_since`.
+    """
+    cache = get_cache()
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        return
+    if museum_ids is not None:
+        cache.set(change_key(version), list(museum_ids))
+
+
+def changed_since(old, new):
+    """
+    Return the ids of the museums changed between catalogue versions `old`
+    and `new`, or None when the change log can't tell: a bulk load logs no
+    ids, and log entries can be evicted or too far back.
+    """
+    if not old < new <= old + CHANGE_LOG_LENGTH:
+        return None
+    keys = [change_key(version) for version in range(old + 1, new + 1)]
+    logged = get_cache().get_many(keys)
+    if len(logged) != len(keys):
+        return None
+    return {museum_id for museum_ids in logged.values() for museum_id in museum_ids}
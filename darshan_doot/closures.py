@@ -0,0 +1,185 @@
+import logging
+import re
+import threading
+from datetime import date, datetime, timedelta
+from django.db import DEFAULT_DB_ALIAS
+from .catalogue import catalogue_version
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+TIME_RANGE_RE = re.compile(
+    r'(\d{1,2}(?::\d{2})?\s*[AP]M)\s*(?:-|–|—|to)\s*(\d{1,2}(?::\d{2})?\s*[AP]M)',
+    re.IGNORECASE,
+)
+
+# Fixed-date national holidays as (month, day).
+NATIONAL_HOLIDAYS = [(1, 26), (8, 15), (10, 2)]
+
+# Festivals follow the lunar calendar, so their dates are listed per year.
+FESTIVAL_DATES = {
+    'holi': [date(2024, 3, 25), date(2025, 3, 14), date(2026, 3, 4), date(2027, 3, 22), date(2028, 3, 11)],
+    'diwali': [date(2024, 11, 1), date(2025, 10, 20), date(2026, 11, 8), date(2027, 10, 29), date(2028, 10, 17)],
+}
+# Festival closures after this year are unknown until the table is extended
+FESTIVAL_LAST_YEAR = min(max(dates).year for dates in FESTIVAL_DATES.values())
+_warned_years = set()
+
+
+def warn_unlisted_festivals(year):
+    if year not in _warned_years:
+        _warned_years.add(year)
+        logger.warning(
+            'No festival dates listed for %s; museums closed on festivals will show as open. '
+            'Extend FESTIVAL_DATES in darshan_doot/closures.py.', year,
+        )
+
+
+def closed_weekdays(closed_on):
+    """
+    Return the set of weekday numbers (Monday=0) a museum is closed on.
+    Understands free text such as "Monday", "Mondays and National Holidays"
+    or "Saturday, Sunday". Anything that is not a weekday name is ignored.
+    """
+    text = (closed_on or '').lower()
+    return {index for index, day in enumerate(WEEKDAYS) if day in text}
+
+
+def _parse_clock(value):
+    value = value.upper().replace(' ', '')
+    fmt = '%I:%M%p' if ':' in value else '%I%p'
+    return datetime.strptime(value, fmt).time()
+
+
+def opening_hours(timings):
+    """
+    Parse a timings string like "10:00 AM – 4:30 PM" into an
+    (opening, closing) pair of times. Returns None when it can't be parsed.
+    """
+    match = TIME_RANGE_RE.search(timings or '')
+    if not match:
+        return None
+    try:
+        return _parse_clock(match.group(1)), _parse_clock(match.group(2))
+    except ValueError:
+        return None
+
+
+class MuseumCalendar:
+    """
+    A museum's opening calendar compiled from its free-text `closed_on` and
+    `timings` columns: a weekday bitmask, a set of holiday dates and the
+    opening/closing times.
+    """
+
+    def __init__(
+        self, weekday_mask=0, holidays=frozenset(), national_holidays=False, opening=None, closing=None,
+        festivals=False,
+    ):
+        self.weekday_mask = weekday_mask
+        self.holidays = holidays
+        self.national_holidays = national_holidays
+        self.festivals = festivals
+        self.opening = opening
+        self.closing = closing
+
+    @classmethod
+    def compile(cls, closed_on, timings):
+        text = (closed_on or '').lower()
+        weekday_mask = 0
+        for index in closed_weekdays(text):
+            weekday_mask |= 1 << index
+        holidays = set()
+        festivals = False
+        for festival, dates in FESTIVAL_DATES.items():
+            if festival in text:
+                holidays.update(dates)
+                festivals = True
+        hours = opening_hours(timings) or (None, None)
+        return cls(
+            weekday_mask=weekday_mask,
+            holidays=frozenset(holidays),
+            national_holidays='national holiday' in text,
+            opening=hours[0],
+            closing=hours[1],
+            festivals=festivals,
+        )
+
+    def _check_festivals(self, last_day):
+        if self.festivals and last_day.year > FESTIVAL_LAST_YEAR:
+            warn_unlisted_festivals(last_day.year)
+
+    def is_holiday(self, day):
+        self._check_festivals(day)
+        if day in self.holidays:
+            return True
+        return self.national_holidays and (day.month, day.day) in NATIONAL_HOLIDAYS
+
+    def is_open(self, day):
+        return not (self.weekday_mask >> day.weekday()) & 1 and not self.is_holiday(day)
+
+    def open_days(self, start, end):
+        """
+        Return a list of booleans, one per date from `start` to `end` inclusive,
+        telling whether the museum is open. The weekday mask is expanded once
+        into a 7-day pattern and holidays are applied as sparse overrides, so
+        the whole window is answered in a single pass.
+        """
+        length = (end - start).days + 1
+        if length <= 0:
+            return []
+        week = [not (self.weekday_mask >> ((start.weekday() + offset) % 7)) & 1 for offset in range(7)]
+        result = (week * (length // 7 + 1))[:length]
+        for holiday in self.holidays_between(start, end):
+            result[(holiday - start).days] = False
+        return result
+
+    def holidays_between(self, start, end):
+        self._check_festivals(end)
+        found = {day for day in self.holidays if start <= day <= end}
+        if self.national_holidays:
+            for year in range(start.year, end.year + 1):
+                found.update(
+                    day for day in (date(year, month, dom) for month, dom in NATIONAL_HOLIDAYS)
+                    if start <= day <= end
+                )
+        return found
+
+    def dates_between(self, start, end):
+        """
+        Yield the dates from `start` to `end` inclusive on which the museum is open.
+        """
+        for offset, is_open in enumerate(self.open_days(start, end)):
+            if is_open:
+                yield start + timedelta(days=offset)
+
+
+_calendars = {}
+_calendars_version = None
+_calendars_lock = threading.Lock()
+
+
+def get_calendar(museum):
+    """
+    Return the compiled calendar for `museum`, compiling it on first use.
+    Calendars are cached per process under the catalogue version, so a
+    museum saved in any process drops them everywhere. A museum read from a
+    replica is compiled from the primary's row instead, since the replica
+    may not have the save that moved the version yet.
+    """
+    global _calendars_version
+    version = catalogue_version()
+    if version != _calendars_version:
+        with _calendars_lock:
+            _calendars.clear()
+            _calendars_version = version
+    calendar = _calendars.get(museum.pk)
+    if calendar is None:
+        if museum._state.db not in (None, DEFAULT_DB_ALIAS):
+            primary = type(museum).objects.using(DEFAULT_DB_ALIAS).only('closed_on', 'timings')
+            museum = primary.filter(pk=museum.pk).first() or museum
+        calendar = MuseumCalendar.compile(museum.closed_on, museum.timings)
+        with _calendars_lock:
+            _calendars[museum.pk] = calendar
+    return calendar
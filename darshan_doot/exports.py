@@ -0,0 +1,166 @@
+"""
+Streaming exports of tickets and daily sales for analytics.
+
+Rows are read in keyset batches ordered by (visiting_date, pk), each batch
+one indexed range query streamed with a server-side cursor where the
+database supports it, and encoded a line at a time. Nothing holds more
+than one batch, so a season of tickets exports in the same memory as a day.
+"""
+
+import csv
+import io
+import json
+import zlib
+from django.db.models import Q
+from .models import DailySales, Ticket, TicketArchive
+
+EXPORT_BATCH_SIZE = 5000
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+TICKET_EXPORT_COLUMNS = (
+    'ticket_id', 'museum_id', 'visiting_date', 'booking_date', 'payment_status', 'adults', 'children',
+    'total_amount', 'nationality', 'checked_in_at',
+)
+
+# dataset -> (model, exported columns)
+EXPORTS = {
+    'tickets': (Ticket, TICKET_EXPORT_COLUMNS),
+    'archived-tickets': (TicketArchive, TICKET_EXPORT_COLUMNS),
+    'sales': (DailySales, (
+        'museum_id', 'visiting_date', 'payment_status', 'tickets', 'persons', 'revenue',
+    )),
+}
+
+
+def export_queryset(dataset, museum_id=None, start=None, end=None, using=None):
+    """
+    The dataset's rows in keyset order, as `(visiting_date, pk, *columns)`.
+    The ticket tables have a (museum, visiting_date, pk) index, so one
+    museum's export is read in index order too, without a sort.
+    """
+    model, columns = EXPORTS[dataset]
+    queryset = model.objects.using(using)
+    if museum_id is not None:
+        queryset = queryset.filter(museum_id=museum_id)
+    if start is not None:
+        queryset = queryset.filter(visiting_date__gte=start)
+    if end is not None:
+        queryset = queryset.filter(visiting_date__lte=end)
+    return queryset.order_by('visiting_date', 'pk').values_list('visiting_date', 'pk', *columns)
+
+
+def export_rows(dataset, museum_id=None, start=None, end=None, batch_size=EXPORT_BATCH_SIZE, using=None):
+    """
+    Yield tuples of the dataset's columns for one museum (or all) between
+    `start` and `end` inclusive, ordered by visiting date. `using` pins the
+    reads to one database, since a streamed export is read after the view
+    has returned.
+    """
+    queryset = export_queryset(dataset, museum_id, start, end, using)
+
+    batch = queryset
+    while True:
+        last = None
+        count = 0
+        for row in batch[:batch_size].iterator(chunk_size=min(batch_size, 2000)):
+            last = row[:2]
+            count += 1
+            yield row[2:]
+        if count < batch_size:
+            return
+        day, pk = last
+        batch = queryset.filter(Q(visiting_date__gt=day) | Q(visiting_date=day, pk__gt=pk))
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def csv_lines(columns, rows):
+    """
+    Yield the CSV header and one encoded line per row.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_text(value) for value in row])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def ndjson_lines(columns, rows):
+    """
+    Yield one encoded JSON object per row.
+    """
+    for row in rows:
+        yield (json.dumps(dict(zip(columns, row)), default=_text) + '\n').encode()
+
+
+def buffered(chunks, size=64 * 1024):
+    """
+    Join small chunks into blocks of about `size` bytes, so a response
+    isn't written out one row at a time.
+    """
+    block = []
+    pending = 0
+    for chunk in chunks:
+        block.append(chunk)
+        pending += len(chunk)
+        if pending >= size:
+            yield b''.join(block)
+            block = []
+            pending = 0
+    if block:
+        yield b''.join(block)
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Return whether an Accept-Encoding header allows gzip: named, or covered
+    by '*', with a q-value above zero.
+    """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+def gzip_stream(chunks):
+    """
+    Gzip a stream of byte chunks incrementally; zlib only ever holds its
+    window, never the whole export.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(dataset, output='csv', compress=False, **filters):
+    """
+    Return an iterator of encoded export bytes for `dataset`.
+    """
+    _, columns = EXPORTS[dataset]
+    encode = csv_lines if output == 'csv' else ndjson_lines
+    stream = buffered(encode(columns, export_rows(dataset, **filters)))
+    return gzip_stream(stream) if compress else stream
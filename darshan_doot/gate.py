@@ -0,0 +1,204 @@
+"""
+Offline ticket verification for museum gates.
+
+A paid ticket carries a compact token: the ticket id, museum, visiting date
+and party size, signed with a per-museum key derived from SECRET_KEY. A gate
+device is provisioned with its museum's key only, checks the signature
+locally and looks the ticket up in a daily snapshot of valid ticket ids.
+Check-ins are queued on the device and synced back in batches.
+
+Token layout (base64url, no padding):
+    16 bytes ticket UUID | u32 museum id | u16 days since 2000-01-01 |
+    u8 adults | u8 children | 16 bytes truncated HMAC-SHA256
+
+A group's members can each carry their own code instead: the token with
+'~<member number>' appended, which admits that one member.
+
+Snapshot layout:
+    b'DDGS' | u8 version | u32 museum id | u16 day | u32 count |
+    count x 16-byte ticket UUIDs, sorted | 16 bytes truncated HMAC-SHA256
+"""
+
+import base64
+import hashlib
+import hmac
+import struct
+import uuid
+from datetime import date, timedelta
+from django.core.signing import BadSignature
+from django.utils.crypto import salted_hmac
+from .models import Ticket
+
+EPOCH = date(2000, 1, 1)
+MAC_SIZE = 16
+
+TOKEN_PAYLOAD = struct.Struct('>16sIHBB')
+# The largest party and the date range a token can carry; bookings.parse_party
+# rejects anything outside them, since tokens are only signed once paid
+MAX_PARTY_MEMBERS = 0xFF
+LAST_DAY = EPOCH + timedelta(days=0xFFFF)
+SNAPSHOT_MAGIC = b'DDGS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('>4sBIHI')
+
+
+def gate_key(museum_id):
+    """
+    Return the signing key for one museum's gates. Devices only ever hold
+    their own museum's key, never SECRET_KEY.
+    """
+    return salted_hmac('darshan_doot.gate', str(museum_id), algorithm='sha256').digest()
+
+
+def _mac(key, data):
+    return hmac.new(key, data, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def _day_number(day):
+    return (day - EPOCH).days
+
+
+def sign_ticket(ticket):
+    """
+    Return the signed gate token for `ticket`.
+    """
+    payload = TOKEN_PAYLOAD.pack(
+        ticket.ticket_id.bytes, ticket.museum_id, _day_number(ticket.visiting_date), ticket.adults, ticket.children
+    )
+    return base64.urlsafe_b64encode(payload + _mac(gate_key(ticket.museum_id), payload)).rstrip(b'=').decode()
+
+
+def member_code(token, member):
+    """
+    Return the gate code admitting member number `member` (from 1) of the
+    party on `token`.
+    """
+    return f'{token}~{member}'
+
+
+def split_code(code):
+    """
+    Split a gate code into its token and member number (None for the whole
+    party).
+    """
+    token, separator, member = code.partition('~')
+    if not separator:
+        return token, None
+    if not member.isdigit():
+        raise BadSignature('Malformed member number.')
+    return token, int(member)
+
+
+def read_token(token, key=None):
+    """
+    Verify a gate token and return its fields. `key` is the museum's gate key
+    on a device; on the server it is derived from the museum in the token.
+    Raises BadSignature for malformed or forged tokens.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (TypeError, ValueError):
+        raise BadSignature('Malformed gate token.')
+    if len(raw) != TOKEN_PAYLOAD.size + MAC_SIZE:
+        raise BadSignature('Malformed gate token.')
+    payload, mac = raw[:TOKEN_PAYLOAD.size], raw[TOKEN_PAYLOAD.size:]
+    ticket_id, museum_id, day, adults, children = TOKEN_PAYLOAD.unpack(payload)
+    if not hmac.compare_digest(mac, _mac(key or gate_key(museum_id), payload)):
+        raise BadSignature('Gate token signature does not match.')
+    return {
+        'ticket_id': uuid.UUID(bytes=ticket_id),
+        'museum_id': museum_id,
+        'visiting_date': EPOCH + timedelta(days=day),
+        'adults': adults,
+        'children': children,
+    }
+
+
+def build_snapshot(museum_id, visiting_date):
+    """
+    Return the binary snapshot of the tickets that may still enter
+    `museum_id` on `visiting_date`: paid and not yet checked in.
+    """
+    ticket_ids = sorted(
+        ticket_id.bytes
+        for ticket_id in Ticket.objects.filter(
+            museum_id=museum_id, visiting_date=visiting_date, payment_status='paid', checked_in_at__isnull=True
+        ).values_list('ticket_id', flat=True).iterator(chunk_size=5000)
+    )
+    data = SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, museum_id, _day_number(visiting_date), len(ticket_ids)
+    ) + b''.join(ticket_ids)
+    return data + _mac(gate_key(museum_id), data)
+
+
+class GateSnapshot:
+    """
+    A loaded snapshot, as a gate device would hold it: verifying a token is a
+    signature check and a set lookup, with no network involved.
+    """
+
+    def __init__(self, data, key):
+        if len(data) < SNAPSHOT_HEADER.size + MAC_SIZE:
+            raise BadSignature('Truncated gate snapshot.')
+        body, mac = data[:-MAC_SIZE], data[-MAC_SIZE:]
+        if not hmac.compare_digest(mac, _mac(key, body)):
+            raise BadSignature('Gate snapshot signature does not match.')
+        magic, version, museum_id, day, count = SNAPSHOT_HEADER.unpack_from(body)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise BadSignature('Unknown gate snapshot format.')
+        ids = body[SNAPSHOT_HEADER.size:]
+        if len(ids) != count * 16:
+            raise BadSignature('Truncated gate snapshot.')
+        self.key = key
+        self.museum_id = museum_id
+        self.visiting_date = EPOCH + timedelta(days=day)
+        self.ticket_ids = frozenset(ids[offset:offset + 16] for offset in range(0, len(ids), 16))
+        self.used = set()
+        self.members = {}
+
+    def __len__(self):
+        return len(self.ticket_ids)
+
+    def admit(self, code):
+        """
+        Return the code's fields if the holder may enter now, else None.
+        A ticket's group code admits the whole party once per device; member
+        codes admit one member each, and only while the group code is unused.
+        """
+        try:
+            token, member = split_code(code)
+            fields = read_token(token, key=self.key)
+        except BadSignature:
+            return None
+        ticket_id = fields['ticket_id'].bytes
+        if (
+            fields['museum_id'] != self.museum_id
+            or fields['visiting_date'] != self.visiting_date
+            or ticket_id not in self.ticket_ids
+            or ticket_id in self.used
+        ):
+            return None
+        if member is None:
+            if ticket_id in self.members:
+                return None
+            self.used.add(ticket_id)
+        else:
+            if not 1 <= member <= fields['adults'] + fields['children']:
+                return None
+            entered = self.members.setdefault(ticket_id, set())
+            if member in entered:
+                return None
+            entered.add(member)
+        fields['member'] = member
+        return fields
+
+
+def record_checkins(museum_id, ticket_ids, checked_in_at):
+    """
+    Mark a batch of tickets synced from a gate as used with one UPDATE.
+    Returns the number of tickets newly checked in; tickets already used
+    elsewhere are left untouched.
+    """
+    return Ticket.objects.filter(
+        museum_id=museum_id, ticket_id__in=ticket_ids, payment_status='paid', checked_in_at__isnull=True
+    ).update(checked_in_at=checked_in_at)
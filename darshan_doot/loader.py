@@ -0,0 +1,167 @@
+"""
+Bulk loader for the museum catalogue CSV (museum.csv and the nightly
+national list). Rows are matched to museums by their unique name, and only
+new or changed museums are written, in batched upserts, so reloading an
+unchanged file reads the table once and writes nothing.
+"""
+
+import csv
+from decimal import Decimal, InvalidOperation
+from django.db import connections, router, transaction
+from .catalogue import invalidate_catalogue
+from .closures import opening_hours
+from .models import Museum
+
+CSV_COLUMNS = (
+    'id', 'name', 'location', 'indian_adult_fee', 'indian_child_fee', 'free_for_students',
+    'camera_fee', 'international_citizen_fee', 'timings', 'closed_on',
+)
+FEE_FIELDS = ('indian_adult_fee', 'indian_child_fee', 'camera_fee', 'international_citizen_fee')
+MUSEUM_FIELDS = (
+    'name', 'location', 'indian_adult_fee', 'indian_child_fee', 'free_for_students',
+    'camera_fee', 'international_citizen_fee', 'timings', 'closed_on',
+)
+UPDATE_FIELDS = MUSEUM_FIELDS[1:]
+
+LOAD_BATCH_SIZE = 1000
+
+NEVER_CLOSED = 'NA'
+NEVER_CLOSED_VALUES = {'', 'na', 'n/a', 'none', 'nil', '-', 'open all days'}
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', ''}
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def _clean(value):
+    return ' '.join((value or '').split())
+
+
+def _fee(value, field):
+    try:
+        fee = Decimal(_clean(value) or '0')
+    except InvalidOperation:
+        raise InvalidRow(f'{field} is not a number: {value!r}')
+    if not fee.is_finite() or fee < 0:
+        raise InvalidRow(f'{field} must not be negative: {value!r}')
+    return fee.quantize(Decimal('0.01'))
+
+
+def _clock(value):
+    return value.strftime('%I:%M %p').lstrip('0')
+
+
+def normalize_row(row):
+    """
+    Validate one CSV row (a dict keyed by CSV_COLUMNS) and return the museum
+    fields in their canonical form: collapsed whitespace, two-decimal fees,
+    timings as "10:00 AM – 5:00 PM" and "NA" for museums never closed.
+    Raises InvalidRow with the reason otherwise.
+    """
+    name = _clean(row.get('name'))
+    if not name:
+        raise InvalidRow('name is required')
+    location = _clean(row.get('location'))
+    if not location:
+        raise InvalidRow('location is required')
+
+    fields = {'name': name, 'location': location}
+    for field in FEE_FIELDS:
+        fields[field] = _fee(row.get(field), field)
+
+    students = _clean(row.get('free_for_students')).lower()
+    if students not in TRUE_VALUES | FALSE_VALUES:
+        raise InvalidRow(f'free_for_students must be 0 or 1: {row.get("free_for_students")!r}')
+    fields['free_for_students'] = students in TRUE_VALUES
+
+    hours = opening_hours(row.get('timings'))
+    if hours is None:
+        raise InvalidRow(f'timings not understood: {row.get("timings")!r}')
+    if hours[1] <= hours[0]:
+        raise InvalidRow(f'timings close before they open: {row.get("timings")!r}')
+    fields['timings'] = f'{_clock(hours[0])} – {_clock(hours[1])}'
+
+    closed_on = _clean(row.get('closed_on'))
+    fields['closed_on'] = NEVER_CLOSED if closed_on.lower() in NEVER_CLOSED_VALUES else closed_on
+    return fields
+
+
+def read_csv(lines):
+    """
+    Yield `(line number, row dict)` from catalogue CSV `lines`. A header row
+    is optional; without one the columns are taken to be CSV_COLUMNS.
+    """
+    reader = csv.reader(lines)
+    columns = CSV_COLUMNS
+    for row in reader:
+        if reader.line_num == 1 and 'name' in (cell.strip().lower() for cell in row):
+            columns = tuple(cell.strip().lower() for cell in row)
+            continue
+        if not any(cell.strip() for cell in row):
+            continue
+        yield reader.line_num, dict(zip(columns, row))
+
+
+def load_museums(rows, batch_size=LOAD_BATCH_SIZE, dry_run=False):
+    """
+    Upsert museums from `(line number, row dict)` pairs. Returns a dict of
+    counts (created, updated, unchanged) and the list of `(line number,
+    reason)` for rows that were skipped as invalid.
+    The existing catalogue is read once and compared in memory; changed and
+    new museums are written with bulk_create(update_conflicts=True) in
+    batches inside one transaction. Caches are invalidated once at the end.
+    """
+    existing = {
+        values[0]: values
+        for values in Museum.objects.values_list(*MUSEUM_FIELDS).iterator(chunk_size=2000)
+    }
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+    errors = []
+    seen = set()
+
+    # MySQL upserts on any unique key and refuses a conflict target
+    connection = connections[router.db_for_write(Museum)]
+    unique_fields = ['name'] if connection.features.supports_update_conflicts_with_target else None
+
+    def flush(batch):
+        if batch and not dry_run:
+            Museum.objects.bulk_create(
+                batch, update_conflicts=True, unique_fields=unique_fields, update_fields=UPDATE_FIELDS,
+            )
+
+    with transaction.atomic():
+        batch = []
+        for line, row in rows:
+            try:
+                fields = normalize_row(row)
+            except InvalidRow as e:
+                errors.append((line, str(e)))
+                continue
+            name = fields['name']
+            if name in seen:
+                errors.append((line, f'duplicate museum name {name!r}'))
+                continue
+            seen.add(name)
+
+            values = tuple(fields[field] for field in MUSEUM_FIELDS)
+            current = existing.get(name)
+            if current == values:
+                counts['unchanged'] += 1
+                continue
+            if current is None:
+                counts['created'] += 1
+            else:
+                counts['updated'] += 1
+            batch.append(Museum(**fields))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        flush(batch)
+
+    if not dry_run and (counts['created'] or counts['updated']):
+        # bulk_create sends no signals; moving the shared version drops the
+        # listings, calendars and search index in every process
+        invalidate_catalogue()
+    return counts, errors
@@ -0,0 +1,297 @@
+"""
+The chatbot's booking journey as a load test, for `manage.py bench`.
+
+A journey is what one visitor does over WhatsApp: search for a museum,
+book a ticket (which creates its Stripe PaymentIntent), open the payment
+page, confirm the payment, have Stripe's webhook arrive, and get the
+ticket checked at the gate. Journeys are run concurrently against the
+in-process WSGI handler (one test client per thread) or ASGI handler (one
+async test client per task, using the async views where there are any),
+with StubStripe standing in for Stripe.
+
+Results are per step: requests per second, latency percentiles, failures,
+and the mean SQL queries per request as counted by darshan_doot/metrics.py.
+Saved as JSON, a run is a baseline that later runs are compared against.
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from .metrics import histogram_mean
+from .stripe_fake import make_event, signed_event
+from .webhooks import process_pending_events
+
+HANDLERS = ('wsgi', 'asgi')
+STEPS = ('search', 'book', 'payment_page', 'payment_verify', 'webhook', 'gate_verify')
+
+# URL name of each step per handler; the async views cover the busiest ones
+ROUTES = {
+    'wsgi': {
+        'search': 'museum-list', 'book': 'create_ticket', 'payment_page': 'payment',
+        'payment_verify': 'payment_verify', 'webhook': 'stripe_webhook', 'gate_verify': 'verify_ticket',
+    },
+    'asgi': {
+        'search': 'museum-list', 'book': 'async_create_ticket', 'payment_page': 'async_payment',
+        'payment_verify': 'async_payment_verify', 'webhook': 'stripe_webhook', 'gate_verify': 'async_verify_ticket',
+    },
+}
+
+PERCENTILES = (0.50, 0.95, 0.99)
+WEBHOOK_SECRET = 'whsec_bench'
+
+
+def bench_settings(stub, webhook_secret, artifact_dir):
+    """
+    Settings for a run: Stripe is `stub`, caches are in process, and
+    nothing that would make the numbers measure something else is on.
+    """
+    return override_settings(
+        DEBUG=False,
+        ALLOWED_HOSTS=['testserver'],
+        PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench'},
+            'catalogue': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-catalogue'},
+        },
+        DATABASE_REPLICAS=[],
+        STRIPE_SECRET_KEY='sk_test_bench',
+        STRIPE_API_BASE=stub.api_base,
+        STRIPE_WEBHOOK_SECRET=webhook_secret,
+        # Events are applied after the run and timed separately
+        STRIPE_WEBHOOK_WORKER='command',
+        # Every journey comes from one client IP
+        THROTTLE_RATES={},
+        MUSEUM_DAILY_CAPACITY=10 ** 9,
+        TICKET_ARTIFACT_DIR=artifact_dir,
+        TICKET_RENDER_WORKERS=0,
+    )
+
+
+def journey(routes, museums, webhook_secret, rng):
+    """
+    Yield one visitor's requests as `(step, method, path, options, expected
+    status)`; each yield is sent back the response, whose body feeds the
+    next request. Stops at the first unexpected status.
+    """
+    museum_id, name = rng.choice(museums)
+    response = yield 'search', 'get', reverse(routes['search']), {'data': {'q': name}}, 200
+    if response.status_code != 200:
+        return
+
+    booking = {
+        'user_phone': f'9{rng.randrange(10 ** 9):09d}', 'user_email': 'visitor@example.com',
+        'adults': rng.randint(1, 4), 'children': rng.randint(0, 2), 'museum': museum_id, 'nationality': 'Indian',
+        'visiting_date': (timezone.localdate() + timedelta(days=rng.randint(1, 60))).isoformat(),
+    }
+    response = yield 'book', 'post', reverse(routes['book']), {'data': booking, 'content_type': 'application/json'}, 201
+    if response.status_code != 201:
+        return
+    ticket_id = response.json()['ticket_id']
+
+    response = yield 'payment_page', 'get', reverse(routes['payment_page'], args=[ticket_id]), {}, 200
+    if response.status_code != 200:
+        return
+
+    response = yield 'payment_verify', 'post', reverse(routes['payment_verify'], args=[ticket_id]), {
+        'data': {'transaction_id': f'txn_{uuid.uuid4().hex}'}, 'content_type': 'application/json',
+    }, 200
+    if response.status_code != 200:
+        return
+    verification_code = response.json()['verification_code']
+
+    body, signature = signed_event(make_event('payment_intent.succeeded', ticket_id), webhook_secret)
+    response = yield 'webhook', 'post', reverse(routes['webhook']), {
+        'data': body, 'content_type': 'application/json', 'headers': {'Stripe-Signature': signature},
+    }, 200
+    if response.status_code != 200:
+        return
+
+    yield 'gate_verify', 'post', reverse(routes['gate_verify'], args=[ticket_id]), {
+        'data': {'verification_code': verification_code}, 'content_type': 'application/json',
+    }, 200
+
+
+class Recorder:
+    """
+    Latencies and failures per step, appended to from every worker.
+    """
+
+    def __init__(self):
+        self.timings = {step: [] for step in STEPS}
+        self.failures = {step: 0 for step in STEPS}
+        self.lock = threading.Lock()
+
+    def record(self, step, elapsed, ok):
+        self.timings[step].append(elapsed)
+        if not ok:
+            with self.lock:
+                self.failures[step] += 1
+
+
+def _drive(requests, send, recorder):
+    response = None
+    while True:
+        try:
+            step, method, path, options, expected = requests.send(response)
+        except StopIteration:
+            return
+        started = time.perf_counter()
+        response = send(method, path, options)
+        recorder.record(step, time.perf_counter() - started, response.status_code == expected)
+
+
+async def _adrive(requests, send, recorder):
+    response = None
+    while True:
+        try:
+            step, method, path, options, expected = requests.send(response)
+        except StopIteration:
+            return
+        started = time.perf_counter()
+        response = await send(method, path, options)
+        recorder.record(step, time.perf_counter() - started, response.status_code == expected)
+
+
+def _sender(client, headers):
+    # Headers go on every request: AsyncClient ignores client-wide ones
+    def send(method, path, options):
+        return getattr(client, method)(path, **{**options, 'headers': {**headers, **options.get('headers', {})}})
+    return send
+
+
+def run_wsgi(journeys, concurrency, make_journey, headers, recorder):
+    counter = itertools.count()
+
+    def worker(number):
+        send = _sender(Client(), headers)
+        rng = random.Random(number)
+        try:
+            # next() on a shared count is atomic, so journeys aren't run twice
+            while next(counter) < journeys:
+                _drive(make_journey(rng), send, recorder)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker, number) for number in range(concurrency)]:
+            future.result()
+
+
+def run_asgi(journeys, concurrency, make_journey, headers, recorder):
+    counter = itertools.count()
+
+    async def worker(number):
+        send = _sender(AsyncClient(), headers)
+        rng = random.Random(number)
+        while next(counter) < journeys:
+            await _adrive(make_journey(rng), send, recorder)
+
+    async def main():
+        await asyncio.gather(*(worker(number) for number in range(concurrency)))
+
+    asyncio.run(main())
+
+
+RUNNERS = {'wsgi': run_wsgi, 'asgi': run_asgi}
+
+
+def _percentile(timings, p):
+    return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+
+def run(handler, journeys, concurrency, museums, webhook_secret, headers):
+    """
+    Run `journeys` journeys, `concurrency` at a time, through `handler`,
+    then apply the webhook events they queued, and return the results.
+    Expects a fresh metrics registry, which it reads the per-step query
+    counts from.
+    """
+    routes = ROUTES[handler]
+    recorder = Recorder()
+    started = time.perf_counter()
+    RUNNERS[handler](
+        journeys, concurrency, lambda rng: journey(routes, museums, webhook_secret, rng), headers, recorder,
+    )
+    elapsed = time.perf_counter() - started
+
+    drain_started = time.perf_counter()
+    drained = 0
+    while consumed := process_pending_events():
+        drained += consumed
+    drain = {'events': drained, 'seconds': time.perf_counter() - drain_started}
+
+    steps = {}
+    for step in STEPS:
+        timings = sorted(recorder.timings[step])
+        if not timings:
+            continue
+        queries = histogram_mean('db_queries_per_request', (('route', routes[step]),))
+        steps[step] = {
+            'requests': len(timings),
+            'failures': recorder.failures[step],
+            'rps': len(timings) / elapsed,
+            **{f'p{round(p * 100)}_ms': _percentile(timings, p) * 1e3 for p in PERCENTILES},
+            'queries': round(queries, 2) if queries is not None else None,
+        }
+    total = sum(step['requests'] for step in steps.values())
+    return {
+        'handler': handler,
+        'concurrency': concurrency,
+        'journeys': journeys,
+        'completed': steps.get(STEPS[-1], {}).get('requests', 0) - recorder.failures[STEPS[-1]],
+        'seconds': elapsed,
+        'rps': total / elapsed,
+        'steps': steps,
+        'webhook_drain': drain,
+    }
+
+
+def run_key(result):
+    return f"{result['handler']}@{result['concurrency']}"
+
+
+def compare(baseline, results, tolerance):
+    """
+    Return a line for every step that regressed against `baseline` (a saved
+    run): throughput or p95 worse by more than `tolerance` (0.2 is 20%), or
+    more queries per request.
+    """
+    previous = {run_key(result): result for result in baseline['runs']}
+    regressions = []
+    for result in results:
+        before = previous.get(run_key(result))
+        if before is None:
+            continue
+        for step, now in result['steps'].items():
+            then = before['steps'].get(step)
+            if then is None:
+                continue
+            where = f"{run_key(result)} {step}"
+            if now['rps'] < then['rps'] * (1 - tolerance):
+                regressions.append(f"{where}: {now['rps']:.0f} req/s, was {then['rps']:.0f}")
+            if now['p95_ms'] > then['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{where}: p95 {now['p95_ms']:.1f}ms, was {then['p95_ms']:.1f}ms")
+            if None not in (now['queries'], then['queries']) and now['queries'] > then['queries'] + 0.5:
+                regressions.append(f"{where}: {now['queries']} queries per request, was {then['queries']}")
+    return regressions
+
+
+def save(path, results, commit=None):
+    with open(path, 'w') as handle:
+        json.dump({'commit': commit, 'created': time.time(), 'runs': results}, handle, indent=2)
+
+
+def load(path):
+    with open(path) as handle:
+        return json.load(handle)
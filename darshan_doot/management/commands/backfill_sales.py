@@ -0,0 +1,22 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from darshan_doot.sales import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily sales rollups from the ticket table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--museum', type=int, help="Only rebuild this museum id.")
+        parser.add_argument('--start', help="First visiting date to rebuild (YYYY-MM-DD).")
+        parser.add_argument('--end', help="Last visiting date to rebuild (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else None
+            end = date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError:
+            raise CommandError("Dates must be in YYYY-MM-DD format.")
+
+        written = rebuild_sales(museum_id=options['museum'], start=start, end=end)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} daily sales rows."))
@@ -0,0 +1,149 @@
+import base64
+import os
+import subprocess
+import tempfile
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from darshan_doot import loadtest
+from darshan_doot.catalogue import get_cache
+from darshan_doot.metrics import reset_metrics
+from darshan_doot.models import Museum
+from darshan_doot.payments import reset_gateway
+from darshan_doot.search import reset_index
+from darshan_doot.stripe_fake import StubStripe
+from darshan_doot.throttling import reset_throttles
+
+USERNAME, PASSWORD = 'bench', 'bench'
+BASELINE_DIR = settings.BASE_DIR / 'benchmarks' / 'baselines'
+
+# Concurrent writers on SQLite queue for the write lock instead of failing
+SQLITE_OPTIONS = {'timeout': 30, 'transaction_mode': 'IMMEDIATE', 'init_command': 'PRAGMA journal_mode=WAL;'}
+
+KINDS = ['Museum', 'Science Centre', 'Art Gallery', 'Palace Museum', 'Fort', 'Planetarium', 'Railway Museum']
+PLACES = [
+    'Delhi', 'Kolkata', 'Mumbai', 'Chennai', 'Lucknow', 'Jaipur', 'Bhopal', 'Patna', 'Shillong', 'Hyderabad',
+    'Bengaluru', 'Pune', 'Ahmedabad', 'Guwahati', 'Mysuru', 'Dehradun', 'Amritsar', 'Udaipur', 'Kochi', 'Agra',
+]
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the chatbot's booking journey (search, book, payment page, payment verify, Stripe webhook, "
+        "gate verify) against the in-process WSGI and ASGI handlers, on a throwaway database with a local fake "
+        "Stripe. Reports req/s, latency percentiles and queries per step."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--journeys', type=int, default=200, help="Journeys per run.")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16], help="Journeys in flight; one run each.")
+        parser.add_argument('--handler', nargs='+', choices=loadtest.HANDLERS, default=list(loadtest.HANDLERS))
+        parser.add_argument('--museums', type=int, default=100, help="Museums in the catalogue.")
+        parser.add_argument('--stripe-latency', type=float, default=0, help="Milliseconds the fake Stripe takes per call.")
+        parser.add_argument(
+            '--save', nargs='?', const='', default=None,
+            help="Save the results as a JSON baseline, by default to benchmarks/baselines/<commit>.json.",
+        )
+        parser.add_argument('--compare', help="A saved baseline to compare against; fails on regressions.")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help="How much slower a step may get before it counts as a regression (0.2 is 20%%).",
+        )
+
+    def handle(self, *args, **options):
+        baseline = loadtest.load(options['compare']) if options['compare'] else None
+        with tempfile.TemporaryDirectory() as tmp:
+            old_name = self.create_database(tmp)
+            try:
+                results = self.run_all(options, tmp)
+            finally:
+                connections['default'].creation.destroy_test_db(old_name, verbosity=0)
+
+        for result in results:
+            self.report(result)
+
+        if options['save'] is not None:
+            commit = current_commit()
+            path = options['save'] or os.path.join(BASELINE_DIR, f"{commit or int(time.time())}.json")
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            loadtest.save(path, results, commit)
+            self.stdout.write(f"Saved baseline to {path}")
+
+        if baseline is not None:
+            regressions = loadtest.compare(baseline, results, options['tolerance'])
+            if regressions:
+                raise CommandError(
+                    f"Regressed against {options['compare']} ({baseline.get('commit')}):\n" + '\n'.join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}."))
+
+    def create_database(self, tmp):
+        """
+        Create a throwaway test database, so real data is never touched, and
+        return the name to restore afterwards.
+        """
+        connection = connections['default']
+        if connection.vendor == 'sqlite':
+            # On a file rather than in memory, so threads can share it
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+            connection.settings_dict['OPTIONS'] = {**SQLITE_OPTIONS, **connection.settings_dict['OPTIONS']}
+        return connection.creation.create_test_db(verbosity=0)
+
+    def seed(self, count):
+        User.objects.create_superuser(username=USERNAME, password=PASSWORD)
+        names = [
+            f'{PLACES[number % len(PLACES)]} {KINDS[number // len(PLACES) % len(KINDS)]} {number + 1}'
+            for number in range(count)
+        ]
+        Museum.objects.bulk_create(
+            Museum(
+                name=name, location=name.split()[0], indian_adult_fee=20, indian_child_fee=10, camera_fee=0,
+                international_citizen_fee=500, timings='10:00 AM – 5:00 PM', closed_on='NA',
+            )
+            for name in names
+        )
+        return list(Museum.objects.values_list('id', 'name'))
+
+    def run_all(self, options, tmp):
+        headers = {'Authorization': 'Basic ' + base64.b64encode(f'{USERNAME}:{PASSWORD}'.encode()).decode()}
+        with StubStripe(latency=options['stripe_latency'] / 1e3) as stub, loadtest.bench_settings(
+            stub, loadtest.WEBHOOK_SECRET, os.path.join(tmp, 'ticket_artifacts'),
+        ):
+            museums = self.seed(options['museums'])
+            results = []
+            for handler in options['handler']:
+                for concurrency in options['concurrency']:
+                    for reset in (reset_metrics, reset_gateway, reset_index, reset_throttles, get_cache().clear):
+                        reset()
+                    self.stdout.write(f"Running {options['journeys']} journeys on {handler}, {concurrency} at a time...")
+                    results.append(loadtest.run(
+                        handler, options['journeys'], concurrency, museums, loadtest.WEBHOOK_SECRET, headers,
+                    ))
+            reset_gateway()
+        return results
+
+    def report(self, result):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\n{result['handler']}, concurrency {result['concurrency']}: {result['completed']}/{result['journeys']} "
+            f"journeys in {result['seconds']:.2f}s, {result['rps']:.0f} req/s"
+        ))
+        self.stdout.write(f"{'step':<16}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'failed':>8}")
+        for step, stats in result['steps'].items():
+            queries = '-' if stats['queries'] is None else f"{stats['queries']:.1f}"
+            self.stdout.write(
+                f"{step:<16}{stats['rps']:>8.0f}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+                f"{queries:>9}{stats['failures']:>8}"
+            )
+        drain = result['webhook_drain']
+        self.stdout.write(f"webhook worker applied {drain['events']} events in {drain['seconds']:.2f}s")
@@ -0,0 +1,36 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from darshan_doot.gate import build_snapshot, gate_key
+from darshan_doot.models import Museum
+
+
+class Command(BaseCommand):
+    help = "Write the signed snapshot of valid ticket ids a museum's gates need for a day."
+
+    def add_arguments(self, parser):
+        parser.add_argument('museum', type=int, help="Museum id.")
+        parser.add_argument('--date', help="Visiting date (YYYY-MM-DD), defaults to today.")
+        parser.add_argument('--output', help="File to write, defaults to gate-<museum>-<date>.bin.")
+        parser.add_argument(
+            '--print-key', action='store_true',
+            help="Print the museum's gate key (hex) for provisioning devices instead.",
+        )
+
+    def handle(self, *args, **options):
+        museum_id = options['museum']
+        if not Museum.objects.filter(pk=museum_id).exists():
+            raise CommandError(f"Museum {museum_id} does not exist.")
+        if options['print_key']:
+            self.stdout.write(gate_key(museum_id).hex())
+            return
+
+        try:
+            day = datetime.strptime(options['date'], '%Y-%m-%d').date() if options['date'] else timezone.localdate()
+        except ValueError:
+            raise CommandError("--date must be in YYYY-MM-DD format.")
+        output = options['output'] or f"gate-{museum_id}-{day.isoformat()}.bin"
+        data = build_snapshot(museum_id, day)
+        with open(output, 'wb') as snapshot:
+            snapshot.write(data)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(data)} bytes to {output}."))
@@ -0,0 +1,45 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from darshan_doot.exports import EXPORT_BATCH_SIZE, EXPORT_FORMATS, EXPORTS, export_stream
+
+
+class Command(BaseCommand):
+    help = "Stream tickets or daily sales to CSV or NDJSON without loading them into memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=sorted(EXPORTS), default='tickets')
+        parser.add_argument('--output-format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--museum', type=int, help="Only export this museum id.")
+        parser.add_argument('--start', help="First visiting date (YYYY-MM-DD).")
+        parser.add_argument('--end', help="Last visiting date (YYYY-MM-DD).")
+        parser.add_argument('--output', help="File to write, defaults to stdout.")
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output.")
+        parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.strptime(options['start'], '%Y-%m-%d').date() if options['start'] else None
+            end = datetime.strptime(options['end'], '%Y-%m-%d').date() if options['end'] else None
+        except ValueError:
+            raise CommandError("Dates must be in YYYY-MM-DD format.")
+
+        stream = export_stream(
+            options['dataset'], output=options['output_format'], compress=options['gzip'],
+            museum_id=options['museum'], start=start, end=end, batch_size=options['batch_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in stream:
+                    output.write(chunk)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}."))
+            return
+        # Write bytes straight through when stdout is a real stream
+        target = getattr(self.stdout._out, 'buffer', None)
+        if target is None and options['gzip']:
+            raise CommandError("Use --output to write gzipped exports.")
+        for chunk in stream:
+            if target is not None:
+                target.write(chunk)
+            else:
+                self.stdout.write(chunk.decode(), ending='')
+        self.stdout.flush()
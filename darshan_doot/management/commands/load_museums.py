@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from darshan_doot.loader import LOAD_BATCH_SIZE, load_museums, read_csv
+
+
+class Command(BaseCommand):
+    help = "Create or update museums from a catalogue CSV, writing only the rows that changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=str(settings.BASE_DIR / 'museum.csv'),
+            help="CSV file to load, defaults to museum.csv at the repository root.",
+        )
+        parser.add_argument('--batch-size', type=int, default=LOAD_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without writing.")
+        parser.add_argument('--strict', action='store_true', help="Fail without writing if any row is invalid.")
+
+    def handle(self, *args, **options):
+        try:
+            source = open(options['path'], newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['path']}: {e}")
+        with source:
+            rows = read_csv(source)
+            if options['strict']:
+                rows = list(rows)
+                counts, errors = load_museums(rows, dry_run=True)
+                if errors:
+                    self._report_errors(errors)
+                    raise CommandError(f"{len(errors)} invalid rows, nothing loaded.")
+            counts, errors = load_museums(rows, batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        self._report_errors(errors)
+        prefix = "Would load" if options['dry_run'] else "Loaded"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}: {counts['created']} created, {counts['updated']} updated, "
+            f"{counts['unchanged']} unchanged, {len(errors)} invalid."
+        ))
+
+    def _report_errors(self, errors):
+        for line, reason in errors:
+            self.stderr.write(f"line {line}: {reason}")
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from darshan_doot.webhooks import EVENT_BATCH_SIZE, process_pending_events
+
+
+class Command(BaseCommand):
+    help = "Apply stored Stripe webhook events to tickets, continuously or once."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--batch-size', type=int, default=EVENT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            consumed = process_pending_events(batch_size=options['batch_size'])
+            processed += consumed
+            if consumed:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} Stripe events."))
@@ -0,0 +1,46 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from darshan_doot.reaper import EXPIRE_BATCH_SIZE, REAPER_BATCH_SIZE, archive_past_visits, expire_pending
+
+logger = logging.getLogger('darshan_doot.reaper')
+
+
+class Command(BaseCommand):
+    help = (
+        "Expire unpaid pending tickets and archive tickets for past visits. With --interval it keeps running; "
+        "this is the only way the reaper runs, so schedule it or run it as its own process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help=f"Tickets per batch, by default {EXPIRE_BATCH_SIZE} when expiring and {REAPER_BATCH_SIZE} when archiving.",
+        )
+        parser.add_argument('--skip-expire', action='store_true', help="Don't expire pending tickets.")
+        parser.add_argument('--skip-archive', action='store_true', help="Don't archive past visits.")
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help="Keep running, reaping every this many seconds.",
+        )
+
+    def handle(self, *args, **options):
+        if options['interval'] is None:
+            self.reap(options)
+            return
+        while True:
+            try:
+                self.reap(options)
+            except Exception:
+                # A long-running reaper outlives a failed run, e.g. a database restart
+                logger.exception('Ticket reaper run failed')
+            finally:
+                close_old_connections()
+            time.sleep(options['interval'])
+
+    def reap(self, options):
+        batch_size = options['batch_size']
+        expired = 0 if options['skip_expire'] else expire_pending(batch_size=batch_size or EXPIRE_BATCH_SIZE)
+        archived = 0 if options['skip_archive'] else archive_past_visits(batch_size=batch_size or REAPER_BATCH_SIZE)
+        self.stdout.write(self.style.SUCCESS(f"Expired {expired} pending tickets, archived {archived} past visits."))
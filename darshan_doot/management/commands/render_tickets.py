@@ -0,0 +1,31 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from darshan_doot.artifacts import RENDER_CHUNK_SIZE, prerender
+from darshan_doot.models import Ticket
+
+
+class Command(BaseCommand):
+    help = "Pre-render the QR codes of a day's paid tickets across every core."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Visiting date (YYYY-MM-DD), defaults to today.")
+        parser.add_argument('--museum', type=int, help="Only this museum's tickets.")
+        parser.add_argument('--workers', type=int, default=None, help="Render processes, defaults to one per core.")
+        parser.add_argument('--chunk-size', type=int, default=RENDER_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            day = datetime.strptime(options['date'], '%Y-%m-%d').date() if options['date'] else timezone.localdate()
+        except ValueError:
+            raise CommandError("--date must be in YYYY-MM-DD format.")
+        tickets = Ticket.objects.filter(visiting_date=day, payment_status='paid').only(
+            'ticket_id', 'museum_id', 'visiting_date', 'adults', 'children'
+        )
+        if options['museum']:
+            tickets = tickets.filter(museum_id=options['museum'])
+        tickets = list(tickets.iterator(chunk_size=5000))
+        rendered = prerender(tickets, workers=options['workers'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered} QR codes for {len(tickets)} paid tickets on {day.isoformat()}."
+        ))
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from darshan_doot.closures import get_calendar
+from darshan_doot.models import DailyCapacity, Museum
+
+
+class Command(BaseCommand):
+    help = "Pre-seed the daily capacity ledger for a season of visiting dates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First visiting date (YYYY-MM-DD), defaults to today.")
+        parser.add_argument('--days', type=int, default=90, help="Number of days to seed.")
+        parser.add_argument('--museum', type=int, action='append', help="Museum id to seed, may be repeated.")
+        parser.add_argument('--capacity', type=int, default=None, help="Seats per day.")
+        parser.add_argument(
+            '--hourly-capacity', type=int, default=None,
+            help="Seats per opening hour; the day's capacity is derived from the museum timings.",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.strptime(options['start'], '%Y-%m-%d').date() if options['start'] else timezone.localdate()
+        except ValueError:
+            raise CommandError("--start must be in YYYY-MM-DD format.")
+        end = start + timedelta(days=options['days'] - 1)
+
+        museums = Museum.objects.only('id', 'timings', 'closed_on')
+        if options['museum']:
+            museums = museums.filter(id__in=options['museum'])
+
+        rows = []
+        for museum in museums.iterator():
+            calendar = get_calendar(museum)
+            capacity = self.capacity_for(calendar, options)
+            rows.extend(
+                DailyCapacity(museum_id=museum.id, visiting_date=day, capacity=capacity, remaining=capacity)
+                for day in calendar.dates_between(start, end)
+            )
+
+        # Existing rows keep their counters, so re-running mid-season is safe.
+        DailyCapacity.objects.bulk_create(rows, batch_size=options['batch_size'], ignore_conflicts=True)
+        self.stdout.write(self.style.SUCCESS(f"Seeded {len(rows)} capacity rows from {start} for {options['days']} days."))
+
+    def capacity_for(self, calendar, options):
+        if options['hourly_capacity'] is not None:
+            opening, closing = calendar.opening, calendar.closing
+            if opening and closing:
+                minutes = (closing.hour * 60 + closing.minute) - (opening.hour * 60 + opening.minute)
+                return max(minutes, 0) * options['hourly_capacity'] // 60
+        if options['capacity'] is not None:
+            return options['capacity']
+        return settings.MUSEUM_DAILY_CAPACITY
@@ -0,0 +1,344 @@
+"""
+Request metrics, served in Prometheus text format at /metrics.
+
+`MetricsMiddleware` records every request under its URL name: latency,
+response size, status, and the SQL queries it ran and how long they took
+(counted by a wrapper installed on each database connection). Stripe calls
+made by darshan_doot/payments.py are timed too.
+
+Each thread records into a dict of its own, so recording never takes a
+lock; a scrape adds the threads' dicts up. When a thread ends its dict is
+folded into a total for retired threads, so short-lived threads don't
+pile up. The numbers are per process, so
+with several workers each one is scraped, or summed, separately.
+
+Requests slower than METRICS_SLOW_REQUEST_SECONDS are sampled, at
+METRICS_TRACE_SAMPLE_RATE, into a ring buffer of recent traces with their
+slowest queries, served at /metrics/traces/.
+"""
+
+import bisect
+import contextvars
+import heapq
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils import timezone
+
+PREFIX = 'darshan_doot_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+# name: (type, help, buckets)
+METRICS = {
+    'http_requests_total': (COUNTER, 'Requests by URL name, method and status.', None),
+    'http_request_duration_seconds': (HISTOGRAM, 'Request latency by URL name.', LATENCY_BUCKETS),
+    'http_response_size_bytes': (HISTOGRAM, 'Response body size by URL name; streamed bodies are not counted.', SIZE_BUCKETS),
+    'db_queries_per_request': (HISTOGRAM, 'SQL queries run by one request, by URL name.', QUERY_BUCKETS),
+    'db_query_duration_seconds_total': (COUNTER, 'Time spent in SQL queries by URL name.', None),
+    'stripe_request_duration_seconds': (HISTOGRAM, 'Stripe API call latency by endpoint and outcome.', LATENCY_BUCKETS),
+    'stripe_refused_total': (COUNTER, 'Stripe calls refused before being made, by endpoint and reason.', None),
+}
+
+UNMATCHED = '<unmatched>'
+# Slowest queries kept with a request for its trace
+TRACE_QUERIES = 3
+
+
+def _merge(totals, shard):
+    for key, value in shard.items():
+        if isinstance(value, list):
+            total = totals.setdefault(key, [0] * len(value))
+            for index, count in enumerate(value):
+                total[index] += count
+        else:
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+class _Owner:
+    """
+    Held in a thread's local storage only, so it is dropped when the thread
+    ends, which retires the thread's shard.
+    """
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class Registry:
+    """
+    Counters and histograms keyed by metric name and label values. Each
+    thread writes to its own shard; the lock is only taken the first time a
+    thread records anything, and when the thread ends.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        # Live threads' shards by id, and what ended threads recorded
+        self.shards = {}
+        self.retired = {}
+        self.lock = threading.Lock()
+
+    def _shard(self):
+        owner = getattr(self.local, 'owner', None)
+        if owner is None:
+            owner = self.local.owner = _Owner({})
+            with self.lock:
+                self.shards[id(owner.shard)] = owner.shard
+            weakref.finalize(owner, self._retire, owner.shard)
+        return owner.shard
+
+    def _retire(self, shard):
+        # Added to the retired total, so totals never go backwards
+        with self.lock:
+            del self.shards[id(shard)]
+            _merge(self.retired, shard)
+
+    def inc(self, name, labels, amount=1):
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        shard = self._shard()
+        key = (name, labels)
+        buckets = METRICS[name][2]
+        counts = shard.get(key)
+        if counts is None:
+            # One slot per bucket, one for +Inf, then the sum
+            counts = shard[key] = [0] * (len(buckets) + 2)
+        counts[bisect.bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self):
+        """
+        Return `{(name, labels): value}` summed over every thread.
+        """
+        with self.lock:
+            shards = list(self.shards.values())
+            totals = _merge({}, self.retired)
+        for shard in shards:
+            # dict.copy() runs without releasing the GIL, so it is a
+            # consistent view even while the owning thread records
+            _merge(totals, shard.copy())
+        return totals
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(totals):
+    """
+    Format `Registry.collect()` output in the Prometheus text format.
+    """
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in totals.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {PREFIX}{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}{name} {kind}')
+        for labels, value in series:
+            if kind == COUNTER:
+                lines.append(f'{PREFIX}{name}{_labels(labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), value):
+                cumulative += count
+                lines.append(f'{PREFIX}{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{PREFIX}{name}_sum{_labels(labels)} {_number(value[-1])}')
+            lines.append(f'{PREFIX}{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    """
+    What one request did, gathered while it runs.
+    """
+    __slots__ = ('started', 'queries', 'query_time', 'slowest', 'stripe_calls', 'stripe_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.slowest = []
+        self.stripe_calls = 0
+        self.stripe_time = 0.0
+
+    def add_query(self, sql, elapsed):
+        self.queries += 1
+        self.query_time += elapsed
+        entry = (elapsed, self.queries, sql)
+        if len(self.slowest) < TRACE_QUERIES:
+            heapq.heappush(self.slowest, entry)
+        elif elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+
+registry = Registry()
+_stats = contextvars.ContextVar('darshan_doot_request_stats', default=None)
+_traces = None
+_traces_lock = threading.Lock()
+
+
+def get_traces():
+    global _traces
+    if _traces is None:
+        with _traces_lock:
+            if _traces is None:
+                _traces = deque(maxlen=settings.METRICS_TRACE_BUFFER)
+    return _traces
+
+
+def reset_metrics():
+    global registry, _traces
+    with _traces_lock:
+        registry = Registry()
+        _traces = None
+
+
+def scrape():
+    return render(registry.collect())
+
+
+def histogram_mean(name, labels):
+    """
+    Return the mean of what histogram `name` observed under `labels` in
+    this process, or None if it observed nothing.
+    """
+    counts = registry.collect().get((name, labels))
+    if not counts or not sum(counts[:-1]):
+        return None
+    return counts[-1] / sum(counts[:-1])
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper counting a request's queries and their time. Installed
+    on every connection by `install_query_wrapper`.
+    """
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    # connection_created fires on every reconnect of the same wrapper
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_stripe_call(endpoint, outcome, elapsed):
+    registry.observe('stripe_request_duration_seconds', (('endpoint', endpoint), ('outcome', outcome)), elapsed)
+    stats = _stats.get()
+    if stats is not None:
+        stats.stripe_calls += 1
+        stats.stripe_time += elapsed
+
+
+def record_stripe_refusal(endpoint, reason):
+    registry.inc('stripe_refused_total', (('endpoint', endpoint), ('reason', reason)))
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else UNMATCHED
+
+
+def response_size(response):
+    if response.streaming:
+        length = response.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+    return len(response.content)
+
+
+def record_request(request, response, stats):
+    elapsed = time.perf_counter() - stats.started
+    route = (('route', route_name(request)),)
+    registry.inc('http_requests_total', route + (('method', request.method), ('status', response.status_code)))
+    registry.observe('http_request_duration_seconds', route, elapsed)
+    registry.observe('db_queries_per_request', route, stats.queries)
+    registry.inc('db_query_duration_seconds_total', route, stats.query_time)
+    size = response_size(response)
+    if size is not None:
+        registry.observe('http_response_size_bytes', route, size)
+    if elapsed >= settings.METRICS_SLOW_REQUEST_SECONDS and random.random() < settings.METRICS_TRACE_SAMPLE_RATE:
+        get_traces().append({
+            'at': timezone.now().isoformat(),
+            'route': route[0][1],
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'seconds': round(elapsed, 6),
+            'bytes': size,
+            'queries': stats.queries,
+            'query_seconds': round(stats.query_time, 6),
+            # Statements only: parameters can hold visitors' details
+            'slowest_queries': [
+                {'sql': sql, 'seconds': round(seconds, 6)} for seconds, _, sql in sorted(stats.slowest, reverse=True)
+            ],
+            'stripe_calls': stats.stripe_calls,
+            'stripe_seconds': round(stats.stripe_time, 6),
+        })
+
+
+class MetricsMiddleware:
+    """
+    Measure each request; goes first in MIDDLEWARE so the time spent in
+    the other middleware counts as well.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _stats.reset(token)
+        record_request(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _stats.reset(token)
+        record_request(request, response, stats)
+        return response
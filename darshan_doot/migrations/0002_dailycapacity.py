@@ -0,0 +1,27 @@
+# Generated by Django 5.1 on 2026-10-18 08:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('darshan_doot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCapacity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('visiting_date', models.DateField()),
+                ('capacity', models.PositiveIntegerField()),
+                ('remaining', models.PositiveIntegerField()),
+                ('museum', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='capacities', to='darshan_doot.museum')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('museum', 'visiting_date'), name='unique_museum_daily_capacity')],
+            },
+        ),
+    ]
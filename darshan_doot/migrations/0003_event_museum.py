@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 08:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('darshan_doot', '0002_dailycapacity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='museum',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='events', to='darshan_doot.museum'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['museum', 'date'], name='event_museum_date_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.1 on 2026-10-18 08:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def clear_duplicate_transaction_ids(apps, schema_editor):
+    """
+    Make existing rows fit the unique transaction_id: blank ids become NULL,
+    and an id shared by several tickets stays only on the earliest booking.
+    """
+    Ticket = apps.get_model('darshan_doot', 'Ticket')
+    tickets = Ticket.objects.using(schema_editor.connection.alias)
+    tickets.filter(transaction_id='').update(transaction_id=None)
+    duplicates = (
+        tickets.exclude(transaction_id=None).values('transaction_id')
+        .annotate(count=Count('pk')).filter(count__gt=1).values_list('transaction_id', flat=True)
+    )
+    for transaction_id in list(duplicates):
+        shared = tickets.filter(transaction_id=transaction_id)
+        keep = shared.order_by('booking_date', 'pk').values_list('pk', flat=True)[0]
+        shared.exclude(pk=keep).update(transaction_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('darshan_doot', '0003_event_museum'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_duplicate_transaction_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ticket',
+            name='transaction_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['museum', 'visiting_date', 'payment_status'], name='ticket_museum_day_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['payment_status', 'visiting_date'], name='ticket_status_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['visiting_date'], name='ticket_visiting_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['user_phone'], name='ticket_user_phone_idx'),
+        ),
+        # Drop the single-column FK index only once the composite index that
+        # starts with museum exists; MySQL needs one to back the constraint.
+        migrations.AlterField(
+            model_name='ticket',
+            name='museum',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='darshan_doot.museum'),
+        ),
+    ]
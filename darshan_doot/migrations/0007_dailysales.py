@@ -0,0 +1,31 @@
+# Generated by Django 5.1 on 2026-10-18 08:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('darshan_doot', '0006_stripeevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('visiting_date', models.DateField()),
+                ('payment_status', models.CharField(max_length=20)),
+                ('tickets', models.IntegerField(default=0)),
+                ('persons', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('museum', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='darshan_doot.museum')),
+            ],
+            options={
+                'verbose_name_plural': 'daily sales',
+                'indexes': [models.Index(fields=['payment_status', 'visiting_date'], name='sales_status_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('museum', 'visiting_date', 'payment_status'), name='unique_daily_sales')],
+            },
+        ),
+    ]
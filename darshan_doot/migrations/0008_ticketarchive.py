@@ -0,0 +1,55 @@
+# Generated by Django 5.1 on 2026-10-18 08:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('darshan_doot', '0007_dailysales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketArchive',
+            fields=[
+                ('ticket_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('user_phone', models.CharField(max_length=15)),
+                ('user_email', models.EmailField(max_length=254)),
+                ('booking_date', models.DateTimeField()),
+                ('visiting_date', models.DateField()),
+                ('payment_status', models.CharField(max_length=20)),
+                ('adults', models.PositiveIntegerField()),
+                ('children', models.PositiveIntegerField()),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('verification_code', models.CharField(blank=True, max_length=20, null=True)),
+                ('transaction_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('stripe_payment_intent_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('nationality', models.CharField(max_length=100)),
+                ('checked_in_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['payment_status', 'booking_date'], name='ticket_status_booked_idx'),
+        ),
+        migrations.AddField(
+            model_name='ticketarchive',
+            name='museum',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_tickets', to='darshan_doot.museum'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketarchive',
+            index=models.Index(fields=['museum', 'visiting_date'], name='archive_museum_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketarchive',
+            index=models.Index(fields=['visiting_date'], name='archive_visiting_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketarchive',
+            index=models.Index(fields=['user_phone'], name='archive_user_phone_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1 on 2026-10-18 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('darshan_doot', '0009_ticket_status_changed_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['museum', 'visiting_date', 'ticket_id'], name='ticket_museum_export_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketarchive',
+            index=models.Index(fields=['museum', 'visiting_date', 'ticket_id'], name='archive_museum_export_idx'),
+        ),
+        # Only once its replacement exists: MySQL needs an index on the museum foreign key
+        migrations.RemoveIndex(
+            model_name='ticketarchive',
+            name='archive_museum_day_idx',
+        ),
+    ]
@@ -6,7 +6,7 @@ class Ticket(models.Model):
     ticket_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user_phone = models.CharField(max_length=15)  # User's phone number
     user_email = models.EmailField(validators=[EmailValidator()], max_length=254)  # User's email
-    museum = models.ForeignKey('Museum', on_delete=models.CASCADE)
+    museum = models.ForeignKey('Museum', on_delete=models.CASCADE, db_index=False)  # Covered by ticket_museum_day_status_idx
     booking_date = models.DateTimeField(auto_now_add=True)
     visiting_date = models.DateField()
     payment_status = models.CharField(max_length=20, default='pending')
@@ -14,9 +14,26 @@ class Ticket(models.Model):
     children = models.PositiveIntegerField()
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     verification_code = models.CharField(max_length=20, blank=True, null=True)
-    transaction_id = models.CharField(max_length=255, blank=True, null=True)
+    transaction_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
     stripe_payment_intent_id = models.CharField(max_length=255, blank=True, null=True)
     nationality = models.CharField(max_length=100) 
+    checked_in_at = models.DateTimeField(blank=True, null=True)  # Set when a gate admits the ticket
+    status_changed_at = models.DateTimeField(blank=True, null=True)  # Last payment_status change, None while unchanged
+
+    class Meta:
+        indexes = [
+            # Admin museum/status filters, date drill-down and per-day counts
+            models.Index(fields=['museum', 'visiting_date', 'payment_status'], name='ticket_museum_day_status_idx'),
+            # Admin status filter without a museum
+            models.Index(fields=['payment_status', 'visiting_date'], name='ticket_status_day_idx'),
+            # Admin date_hierarchy across all museums
+            models.Index(fields=['visiting_date'], name='ticket_visiting_date_idx'),
+            # One museum's export, in its keyset order
+            models.Index(fields=['museum', 'visiting_date', 'ticket_id'], name='ticket_museum_export_idx'),
+            models.Index(fields=['user_phone'], name='ticket_user_phone_idx'),
+            # Reaper: oldest pending tickets first
+            models.Index(fields=['payment_status', 'booking_date'], name='ticket_status_booked_idx'),
+        ]
 
 class Museum(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -33,7 +50,88 @@ class Museum(models.Model):
         return self.name
 
 class Event(models.Model):
+    # Nullable only so events created before museums owned them can migrate;
+    # those never show up under a museum.
+    museum = models.ForeignKey('Museum', on_delete=models.CASCADE, related_name='events', null=True)
     name = models.CharField(max_length=200)
     date = models.DateTimeField()
     description = models.TextField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['museum', 'date'], name='event_museum_date_idx'),
+        ]
+
+class DailyCapacity(models.Model):
+    museum = models.ForeignKey('Museum', on_delete=models.CASCADE, related_name='capacities')
+    visiting_date = models.DateField()
+    capacity = models.PositiveIntegerField()  # Seats on sale for the day
+    remaining = models.PositiveIntegerField()  # Seats still available, decremented on booking
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['museum', 'visiting_date'], name='unique_museum_daily_capacity'),
+        ]
+
+class StripeEvent(models.Model):
+    event_id = models.CharField(max_length=255, unique=True)  # Stripe's evt_... id, dedupes retries
+    event_type = models.CharField(max_length=100)
+    ticket_id = models.UUIDField(blank=True, null=True)  # From the payment's metadata
+    stripe_created = models.DateTimeField()  # When Stripe created the event, used to order them
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'stripe_created'], name='stripe_event_queue_idx'),
+        ]
+
+class DailySales(models.Model):
+    museum = models.ForeignKey('Museum', on_delete=models.CASCADE, related_name='daily_sales', db_index=False)  # Covered by unique_daily_sales
+    visiting_date = models.DateField()
+    payment_status = models.CharField(max_length=20)
+    tickets = models.IntegerField(default=0)
+    persons = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = 'daily sales'
+        constraints = [
+            models.UniqueConstraint(fields=['museum', 'visiting_date', 'payment_status'], name='unique_daily_sales'),
+        ]
+        indexes = [
+            # Admin totals filtered by status and date across all museums
+            models.Index(fields=['payment_status', 'visiting_date'], name='sales_status_day_idx'),
+        ]
+
+class TicketArchive(models.Model):
+    """
+    Tickets moved out of the hot Ticket table by the reaper: visits that are
+    over, and pending bookings that were never paid (stored as 'expired').
+    """
+    ticket_id = models.UUIDField(primary_key=True)
+    user_phone = models.CharField(max_length=15)
+    user_email = models.EmailField(max_length=254)
+    museum = models.ForeignKey('Museum', on_delete=models.CASCADE, related_name='archived_tickets', db_index=False)  # Covered by archive_museum_export_idx
+    booking_date = models.DateTimeField()
+    visiting_date = models.DateField()
+    payment_status = models.CharField(max_length=20)
+    adults = models.PositiveIntegerField()
+    children = models.PositiveIntegerField()
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    verification_code = models.CharField(max_length=20, blank=True, null=True)
+    transaction_id = models.CharField(max_length=255, blank=True, null=True)
+    stripe_payment_intent_id = models.CharField(max_length=255, blank=True, null=True)
+    nationality = models.CharField(max_length=100)
+    checked_in_at = models.DateTimeField(blank=True, null=True)
+    status_changed_at = models.DateTimeField(blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # One museum's export, in its keyset order
+            models.Index(fields=['museum', 'visiting_date', 'ticket_id'], name='archive_museum_export_idx'),
+            models.Index(fields=['visiting_date'], name='archive_visiting_date_idx'),
+            models.Index(fields=['user_phone'], name='archive_user_phone_idx'),
+        ]
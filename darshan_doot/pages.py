@@ -0,0 +1,128 @@
+"""
+The payment page, which visitors reload over and over while they wait for
+a payment to go through.
+
+A load is one query for the ticket and its museum name. Visitors open the
+page from a link the bot sent, so they never carry the primary pin cookie
+and may read a replica; one that doesn't have the ticket yet, or still
+shows it pending, is read again from the primary. The rendered page
+is cached per ticket and payment status, so a status change moves the page
+to a fresh cache entry and the stale one is never read again. Responses
+carry an ETag and Last-Modified from the same two values, so a reload with
+nothing new is a 304 without rendering anything.
+"""
+
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .models import Ticket
+from .routers import read_alias
+from .states import PENDING
+
+PAGE_TEMPLATE = 'payment_details.html'
+# Bump when the template changes, so cached pages and ETags are dropped
+PAGE_VERSION = 1
+# Every load revalidates, since a payment can land at any moment
+PAGE_CACHE_CONTROL = 'private, no-cache'
+
+PAGE_FIELDS = (
+    'ticket_id', 'booking_date', 'visiting_date', 'payment_status', 'status_changed_at', 'adults', 'children',
+    'total_amount', 'museum__name',
+)
+
+
+def payment_query(ticket_id):
+    return Ticket.objects.select_related('museum').only(*PAGE_FIELDS).filter(ticket_id=ticket_id)
+
+
+def needs_primary(alias, payment_status):
+    """
+    Whether a read from `alias` that found `payment_status` (None for no
+    ticket) may be behind the primary and should be made again there.
+    """
+    return alias != DEFAULT_DB_ALIAS and payment_status in (None, PENDING)
+
+
+def payment_ticket(ticket_id):
+    """
+    Return the ticket with what the payment page shows, or None.
+    """
+    alias = read_alias()
+    ticket = payment_query(ticket_id).using(alias).first()
+    if needs_primary(alias, ticket and ticket.payment_status):
+        ticket = payment_query(ticket_id).using(DEFAULT_DB_ALIAS).first()
+    return ticket
+
+
+def _validators(ticket_id, payment_status, changed_at):
+    tag = hashlib.sha1(f'{PAGE_VERSION}:{ticket_id}:{payment_status}'.encode()).hexdigest()
+    return f'"{tag}"', int(changed_at.timestamp())
+
+
+def _conditional(request, response_factory, etag, last_modified):
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = response_factory()
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = PAGE_CACHE_CONTROL
+    return response
+
+
+def page_key(ticket_id, payment_status):
+    return f'payment-page:{PAGE_VERSION}:{ticket_id}:{payment_status}'
+
+
+def payment_page(request, ticket):
+    """
+    Return the payment page response for a ticket from `payment_ticket`.
+    """
+    etag, last_modified = _validators(
+        ticket.ticket_id, ticket.payment_status, ticket.status_changed_at or ticket.booking_date
+    )
+
+    def render_page():
+        key = page_key(ticket.ticket_id, ticket.payment_status)
+        html = cache.get(key)
+        if html is None:
+            html = render_to_string(PAGE_TEMPLATE, {
+                'museum_name': ticket.museum.name,
+                'visiting_date': ticket.visiting_date,
+                'total_amount': ticket.total_amount,
+                'adults': ticket.adults,
+                'children': ticket.children,
+                'ticket_id': ticket.ticket_id,
+                'payment_status': ticket.payment_status,
+            })
+            cache.set(key, html, settings.PAYMENT_PAGE_CACHE_TIMEOUT)
+        return HttpResponse(html)
+
+    return _conditional(request, render_page, etag, last_modified)
+
+
+def status_response(request, ticket_id):
+    """
+    The payment status alone, for the page's script to poll: one query on
+    the primary key and a few bytes of JSON, or a 304 if nothing changed.
+    """
+    rows = Ticket.objects.filter(ticket_id=ticket_id).values_list(
+        'payment_status', 'status_changed_at', 'booking_date'
+    )
+    alias = read_alias()
+    row = rows.using(alias).first()
+    if needs_primary(alias, row and row[0]):
+        row = rows.using(DEFAULT_DB_ALIAS).first()
+    if row is None:
+        return JsonResponse({'error': 'Ticket not found.'}, status=404)
+    payment_status, changed_at, booked_at = row
+    etag, last_modified = _validators(ticket_id, payment_status, changed_at or booked_at)
+    return _conditional(
+        request,
+        lambda: JsonResponse({'ticket_id': str(ticket_id), 'payment_status': payment_status}),
+        etag, last_modified,
+    )
@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over the primary key, so each page is an index range
+    scan no matter how deep the client has paged.
+    """
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class EventKeysetPagination(KeysetPagination):
+    ordering = ('date', 'pk')
@@ -0,0 +1,196 @@
+"""
+Stripe PaymentIntents for bookings.
+
+Every ticket gets one PaymentIntent carrying its ticket id in the metadata,
+which is what the webhook worker matches events on. Intents are created
+with the ticket id as the idempotency key, so a retry, or a second call
+from the payment page, returns the same intent instead of a new charge.
+
+Calls go through one keep-alive connection pool per process, are bounded
+by a timeout and a cap on concurrent calls, and sit behind a circuit
+breaker: after a run of failures Stripe is left alone for a while and
+callers get PaymentGatewayUnavailable at once, instead of every booking
+worker waiting out its timeout against a Stripe that is down.
+"""
+
+import threading
+import time
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from stripe.api_requestor import APIRequestor
+from stripe.http_client import RequestsClient
+from stripe.util import convert_to_stripe_object
+from .metrics import record_stripe_call, record_stripe_refusal
+
+CURRENCY = 'inr'
+PAYMENT_INTENTS_URL = '/v1/payment_intents'
+
+# Errors that say Stripe (or the way to it) is unhealthy, as opposed to a
+# request Stripe understood and refused
+OUTAGE_ERRORS = (stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError)
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+class PaymentGatewayUnavailable(PaymentGatewayError):
+    """
+    Stripe is failing or too busy; the call was not attempted or timed out.
+    """
+
+
+class CircuitBreaker:
+    """
+    Closed while calls succeed. After `threshold` consecutive failures it
+    opens and refuses calls for `reset_after` seconds, then lets a single
+    trial call through: success closes it again, failure reopens it.
+    """
+
+    def __init__(self, threshold, reset_after, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or self.clock() - self.opened_at < self.reset_after:
+                return False
+            self.trial = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+            self.trial = False
+
+
+class PaymentGateway:
+    """
+    Creates PaymentIntents through a pooled, time-limited Stripe client.
+    """
+
+    def __init__(self, api_key, api_base, timeout, pool_size, breaker):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        # One session shared by all threads, so its pool is reused rather
+        # than opening a connection per thread or per call
+        self.requestor = APIRequestor(
+            key=api_key, api_base=api_base, client=RequestsClient(timeout=timeout, session=session),
+        )
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.timeout = timeout
+        self.breaker = breaker
+
+    def _post(self, url, params, idempotency_key, endpoint=None):
+        # Metrics are labelled by endpoint, never by a URL holding an id
+        endpoint = endpoint or url
+        if not self.breaker.allow():
+            record_stripe_refusal(endpoint, 'breaker_open')
+            raise PaymentGatewayUnavailable('Stripe is unavailable; try again shortly.')
+        # Waiting for a free connection counts against the timeout as well
+        if not self.slots.acquire(timeout=self.timeout):
+            self.breaker.record_failure()
+            record_stripe_refusal(endpoint, 'pool_full')
+            raise PaymentGatewayUnavailable('Too many Stripe calls in flight.')
+        started = time.perf_counter()
+        try:
+            response, api_key = self.requestor.request('post', url, params, {'Idempotency-Key': idempotency_key})
+        except OUTAGE_ERRORS as e:
+            record_stripe_call(endpoint, 'unavailable', time.perf_counter() - started)
+            self.breaker.record_failure()
+            raise PaymentGatewayUnavailable(str(e)) from e
+        except stripe.error.StripeError as e:
+            record_stripe_call(endpoint, 'error', time.perf_counter() - started)
+            self.breaker.record_success()
+            raise PaymentGatewayError(str(e)) from e
+        finally:
+            self.slots.release()
+        record_stripe_call(endpoint, 'ok', time.perf_counter() - started)
+        self.breaker.record_success()
+        return convert_to_stripe_object(response, api_key)
+
+    def create_intent(self, ticket):
+        """
+        Return the PaymentIntent for `ticket`, creating it on first call.
+        """
+        return self._post(
+            PAYMENT_INTENTS_URL,
+            {
+                'amount': round(ticket.total_amount * 100),
+                'currency': CURRENCY,
+                'metadata': {'ticket_id': str(ticket.ticket_id)},
+            },
+            idempotency_key=f'ticket-{ticket.ticket_id}',
+        )
+
+    def cancel_intent(self, intent_id):
+        """
+        Cancel a PaymentIntent so it can no longer be paid. An intent that
+        is already cancelled counts as done. Raises PaymentGatewayError when
+        Stripe refuses, e.g. because it has already succeeded.
+        """
+        try:
+            return self._post(
+                f'{PAYMENT_INTENTS_URL}/{intent_id}/cancel', {'cancellation_reason': 'abandoned'},
+                idempotency_key=f'cancel-{intent_id}', endpoint=f'{PAYMENT_INTENTS_URL}/:id/cancel',
+            )
+        except PaymentGatewayError as e:
+            # Stripe replays a retry's result only for a day; after that a
+            # second cancel is refused with the intent attached
+            intent = getattr(getattr(e.__cause__, 'error', None), 'payment_intent', None)
+            if intent is not None and intent.get('status') == 'canceled':
+                return intent
+            raise
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """
+    Return the process-wide gateway, or None when no Stripe key is set.
+    """
+    global _gateway
+    if not settings.STRIPE_SECRET_KEY:
+        return None
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = PaymentGateway(
+                    settings.STRIPE_SECRET_KEY,
+                    settings.STRIPE_API_BASE,
+                    settings.STRIPE_TIMEOUT,
+                    settings.STRIPE_POOL_SIZE,
+                    CircuitBreaker(settings.STRIPE_BREAKER_THRESHOLD, settings.STRIPE_BREAKER_RESET),
+                )
+    return _gateway
+
+
+def reset_gateway():
+    global _gateway
+    with _gateway_lock:
+        _gateway = None
@@ -0,0 +1,80 @@
+"""
+Ticket pricing. The fee columns of every museum a request refers to are
+loaded once into a FeeTable, and each party is then priced from the table
+without touching the database, so quoting a whole itinerary costs one
+query however many museums and parties it holds.
+
+Pricing rules:
+- Indian nationals pay `indian_adult_fee` / `indian_child_fee`; everyone
+  else pays `international_citizen_fee` per visitor.
+- At museums with `free_for_students`, students enter free. They are
+  counted against the adults in the party first, then the children.
+- `camera_fee` is charged once per camera.
+"""
+
+from collections import namedtuple
+from decimal import Decimal
+from .models import Museum
+
+FEE_COLUMNS = (
+    'indian_adult_fee', 'indian_child_fee', 'international_citizen_fee', 'camera_fee', 'free_for_students',
+)
+
+ZERO = Decimal('0.00')
+
+Fees = namedtuple('Fees', ['adult', 'child', 'international', 'camera', 'free_for_students'])
+
+
+def is_indian(nationality):
+    return nationality.lower() == 'indian'
+
+
+def museum_fees(museum):
+    return Fees(*(getattr(museum, column) for column in FEE_COLUMNS))
+
+
+def price_party(fees, nationality, adults, children, cameras=0, students=0):
+    """
+    Return the price breakdown of one party as a dict of Decimals: the
+    adult and child admission, the student discount, the camera charge and
+    the total.
+    """
+    if is_indian(nationality):
+        adult_fee, child_fee = fees.adult, fees.child
+    else:
+        adult_fee = child_fee = fees.international
+
+    discount = ZERO
+    if fees.free_for_students and students:
+        free_adults = min(students, adults)
+        free_children = min(students - free_adults, children)
+        discount = adult_fee * free_adults + child_fee * free_children
+
+    breakdown = {
+        'adults': adult_fee * adults,
+        'children': child_fee * children,
+        'student_discount': discount,
+        'camera': fees.camera * cameras,
+    }
+    breakdown['total'] = breakdown['adults'] + breakdown['children'] - discount + breakdown['camera']
+    return breakdown
+
+
+class FeeTable:
+    """
+    The fees, timings and names of a set of museums, keyed by id.
+    """
+
+    def __init__(self, museums):
+        self.museums = {museum.pk: museum for museum in museums}
+        self.fees = {museum.pk: museum_fees(museum) for museum in museums}
+
+    @classmethod
+    def load(cls, museum_ids):
+        return cls(Museum.objects.filter(pk__in=set(museum_ids)).only('id', 'name', 'timings', 'closed_on', *FEE_COLUMNS))
+
+    def __contains__(self, museum_id):
+        return museum_id in self.fees
+
+    def price(self, museum_id, nationality, adults, children, cameras=0, students=0):
+        return price_party(self.fees[museum_id], nationality, adults, children, cameras, students)
@@ -0,0 +1,65 @@
+"""
+QR code PNGs in a content-addressed cache on disk.
+
+An image is stored under the SHA-256 of what it encodes, so a code is
+rendered once however many times it is downloaded or resent, and the file
+name doubles as its ETag. This module doesn't touch Django, so it can be
+imported by the worker processes that render in bulk.
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+import qrcode
+from qrcode.constants import ERROR_CORRECT_M
+
+# Bump when the rendering below changes, so old images aren't served
+RENDER_VERSION = 1
+BOX_SIZE = 8
+BORDER = 2
+
+
+def cache_key(payload):
+    return hashlib.sha256(f'{RENDER_VERSION}:{payload}'.encode()).hexdigest()
+
+
+def cache_path(directory, key):
+    # Two-character fan-out keeps directories small at tens of thousands of files
+    return os.path.join(directory, key[:2], f'{key}.png')
+
+
+def render_png(payload):
+    code = qrcode.QRCode(error_correction=ERROR_CORRECT_M, box_size=BOX_SIZE, border=BORDER)
+    code.add_data(payload)
+    code.make(fit=True)
+    buffer = io.BytesIO()
+    code.make_image().save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def store(directory, key, data):
+    """
+    Write `data` to the cache atomically: readers see the whole file or none.
+    """
+    path = cache_path(directory, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as handle:
+        handle.write(data)
+    os.replace(tmp, path)
+    return path
+
+
+def render_to_cache(directory, payloads):
+    """
+    Render every payload not cached yet; returns how many were rendered.
+    This is the unit of work handed to each worker process.
+    """
+    rendered = 0
+    for payload in payloads:
+        key = cache_key(payload)
+        if not os.path.exists(cache_path(directory, key)):
+            store(directory, key, render_png(payload))
+            rendered += 1
+    return rendered
@@ -0,0 +1,143 @@
+"""
+Keeps the hot Ticket table down to the active booking window.
+
+- Pending tickets that were never paid for expire after
+  PENDING_TICKET_TTL_MINUTES: their Stripe PaymentIntent is cancelled, their
+  seats go back on sale, they drop out of the sales rollups and they are
+  archived with status 'expired'. A ticket whose intent can't be cancelled,
+  because it was paid meanwhile or Stripe is down, stays pending.
+- Tickets whose visit is more than TICKET_ARCHIVE_AFTER_DAYS in the past
+  are archived as they are; the sales rollups keep counting them.
+
+Both walk the table in bounded keyset batches over an index, locking each
+batch with SKIP LOCKED so a ticket being paid for right now is left alone,
+and copy then delete it in one short transaction. Expiry cancels each
+batch's intents while holding its locks, so two reapers never cancel the
+same intent, and uses smaller batches to keep those transactions short.
+Run by `manage.py
+reap_tickets`, from a scheduler or kept running with --interval; web and
+management processes never start it themselves.
+"""
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .capacity import release_seats
+from .models import Ticket, TicketArchive
+from .payments import PaymentGatewayError, PaymentGatewayUnavailable, get_gateway
+from .sales import forget_tickets
+from .states import PENDING
+
+REAPER_BATCH_SIZE = 1000
+# Smaller, as each batch's locks are held across its Stripe calls
+EXPIRE_BATCH_SIZE = 100
+EXPIRED = 'expired'
+# Tickets without an intent hold their payment page URL in the same column
+INTENT_PREFIX = 'pi_'
+
+TICKET_COLUMNS = [field.attname for field in Ticket._meta.concrete_fields]
+
+
+def _archive(tickets, payment_status=None):
+    archived = []
+    for ticket in tickets:
+        row = TicketArchive(**{column: getattr(ticket, column) for column in TICKET_COLUMNS})
+        if payment_status:
+            row.payment_status = payment_status
+        archived.append(row)
+    TicketArchive.objects.bulk_create(archived, ignore_conflicts=True)
+    Ticket.objects.filter(pk__in=[ticket.pk for ticket in tickets]).delete()
+
+
+def _batches(queryset, key, batch_size):
+    """
+    Yield locked batches of `queryset` ordered by (`key`, pk), each inside
+    its own transaction, resuming after the last row of the previous batch
+    so rows skipped as locked are not fetched again.
+    """
+    after = None
+    while True:
+        with transaction.atomic():
+            batch = queryset
+            if after is not None:
+                batch = batch.filter(Q(**{f'{key}__gt': after[0]}) | Q(**{key: after[0], 'pk__gt': after[1]}))
+            tickets = list(batch.select_for_update(skip_locked=True).order_by(key, 'pk')[:batch_size])
+            if not tickets:
+                return
+            yield tickets
+        after = (getattr(tickets[-1], key), tickets[-1].pk)
+        if len(tickets) < batch_size:
+            return
+
+
+def cancel_intents(tickets):
+    """
+    Cancel the PaymentIntents of `tickets` and return the ids of the tickets
+    whose intent is now cancelled. Stripe refuses to cancel an intent that
+    has been paid; the webhook settles those tickets instead. Stops at the
+    first outage, leaving the rest for the next run.
+    """
+    gateway = get_gateway()
+    cancelled = set()
+    if gateway is None:
+        return cancelled
+    for ticket_id, intent_id in tickets:
+        try:
+            gateway.cancel_intent(intent_id)
+        except PaymentGatewayUnavailable:
+            break
+        except PaymentGatewayError:
+            continue
+        cancelled.add(ticket_id)
+    return cancelled
+
+
+def has_intent(ticket):
+    return (ticket.stripe_payment_intent_id or '').startswith(INTENT_PREFIX)
+
+
+def expire_pending(now=None, batch_size=EXPIRE_BATCH_SIZE):
+    """
+    Expire pending tickets booked more than PENDING_TICKET_TTL_MINUTES ago
+    and return how many were expired.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(minutes=settings.PENDING_TICKET_TTL_MINUTES)
+    queryset = Ticket.objects.filter(payment_status=PENDING, booking_date__lt=cutoff)
+    today = timezone.localdate(now)
+    expired = 0
+    for tickets in _batches(queryset, 'booking_date', batch_size):
+        cancelled = cancel_intents(
+            (ticket.pk, ticket.stripe_payment_intent_id) for ticket in tickets if has_intent(ticket)
+        )
+        # A live intent can still be paid, so its ticket stays until it's cancelled
+        tickets = [ticket for ticket in tickets if not has_intent(ticket) or ticket.pk in cancelled]
+        if not tickets:
+            continue
+        released = {}
+        for ticket in tickets:
+            if ticket.visiting_date >= today:
+                key = (ticket.museum_id, ticket.visiting_date)
+                released[key] = released.get(key, 0) + ticket.adults + ticket.children
+        for (museum_id, visiting_date), seats in released.items():
+            release_seats(museum_id, visiting_date, seats)
+        forget_tickets(tickets)
+        _archive(tickets, payment_status=EXPIRED)
+        expired += len(tickets)
+    return expired
+
+
+def archive_past_visits(today=None, batch_size=REAPER_BATCH_SIZE):
+    """
+    Move tickets for visits older than TICKET_ARCHIVE_AFTER_DAYS into the
+    archive and return how many were moved.
+    """
+    today = today or timezone.localdate()
+    cutoff = today - timedelta(days=settings.TICKET_ARCHIVE_AFTER_DAYS)
+    archived = 0
+    for tickets in _batches(Ticket.objects.filter(visiting_date__lt=cutoff), 'visiting_date', batch_size):
+        _archive(tickets)
+        archived += len(tickets)
+    return archived
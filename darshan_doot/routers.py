@@ -0,0 +1,154 @@
+"""
+Read replicas.
+
+Reads go to the primary unless a view opts in: catalogue viewsets, the
+payment page and the admin reports are marked with `ReplicaReadMixin`,
+`replica_view` or `replica_reads`, and their queries go to a replica from
+DATABASE_REPLICAS.
+Everything else, and every write, uses the primary.
+
+Replicas lag behind, so a client that just wrote must not read from one:
+any write pins the rest of its request to the primary, and
+`PrimaryPinMiddleware` sets a short-lived cookie that keeps the client's
+next requests there too. The cookie only follows the client that wrote:
+a visitor opening the payment page from the link the bot sent them
+doesn't have it, so the payment views re-read a ticket the replica is
+missing or still shows pending from the primary (darshan_doot/pages.py).
+"""
+
+import contextvars
+import functools
+import random
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_COOKIE = 'db_primary'
+
+
+class RoutingState:
+    """
+    Per-request routing: `replica` is None while reads go to the primary,
+    '' once replica reads are on, then the replica picked for the request.
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.replica = None
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('darshan_doot_routing', default=None)
+
+
+def read_alias():
+    """
+    Return the database to read from: a replica while replica reads are on
+    and nothing pins the request to the primary, else the primary.
+    """
+    state = _state.get()
+    replicas = settings.DATABASE_REPLICAS
+    if state is None or state.pinned or state.replica is None or not replicas:
+        return DEFAULT_DB_ALIAS
+    if state.replica not in replicas:
+        # One replica per request, so its reads see a consistent snapshot
+        state.replica = random.choice(replicas)
+    return state.replica
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+@contextmanager
+def replica_reads():
+    """
+    Send this block's reads to a replica, unless the client is pinned to
+    the primary.
+    """
+    state = _state.get()
+    token = None
+    if state is None:
+        state = RoutingState()
+        token = _state.set(state)
+    previous, state.replica = state.replica, state.replica or ''
+    try:
+        yield
+    finally:
+        state.replica = previous
+        if token is not None:
+            _state.reset(token)
+
+
+def replica_view(view):
+    """
+    Decorate a function view so its GET and HEAD requests read from a replica.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return view(request, *args, **kwargs)
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaReadMixin:
+    """
+    For DRF views whose safe requests may read from a replica.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class PrimaryPinMiddleware:
+    """
+    Keep clients on the primary for REPLICA_PIN_SECONDS after they write.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _pin(self, response, state):
+        if state.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            return self._pin(self.get_response(request), state)
+        finally:
+            _state.reset(token)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            return self._pin(await self.get_response(request), state)
+        finally:
+            _state.reset(token)
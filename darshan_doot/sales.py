@@ -0,0 +1,157 @@
+"""
+Daily sales rollups: one row per (museum, visiting date, payment status)
+holding ticket, visitor and revenue totals, kept current as tickets are
+booked, change status or are deleted. The admin reads its summary from
+here, so its cost depends on the number of days shown, not tickets sold.
+
+There is no post_delete receiver: every code path that deletes Ticket rows
+must call `forget_tickets` on them in the same transaction.
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from .models import DailySales, Ticket, TicketArchive
+
+
+def _bump(museum_id, visiting_date, payment_status, tickets, persons, revenue):
+    return DailySales.objects.filter(
+        museum_id=museum_id, visiting_date=visiting_date, payment_status=payment_status
+    ).update(
+        tickets=F('tickets') + tickets,
+        persons=F('persons') + persons,
+        revenue=F('revenue') + revenue,
+    )
+
+
+def apply_sales(deltas):
+    """
+    Add `deltas`, a mapping of `(museum_id, visiting_date, payment_status)`
+    to `(tickets, persons, revenue)`, to the rollups with one UPDATE per
+    key. Missing rows are inserted together and updated again; a negative
+    delta never creates a row, so a museum being deleted can't be revived.
+    """
+    missing = []
+    for key, totals in deltas.items():
+        if not _bump(*key, *totals) and totals[0] > 0:
+            missing.append(key)
+    if missing:
+        DailySales.objects.bulk_create(
+            [
+                DailySales(museum_id=museum_id, visiting_date=visiting_date, payment_status=payment_status)
+                for museum_id, visiting_date, payment_status in missing
+            ],
+            ignore_conflicts=True,
+        )
+        for key in missing:
+            _bump(*key, *deltas[key])
+
+
+def ticket_deltas(rows, sign=1, payment_status=None):
+    """
+    Return the rollup deltas for `rows` of `(museum_id, visiting_date,
+    payment_status, adults, children, total_amount)`, counted under
+    `payment_status` when given instead of each row's own status.
+    """
+    deltas = {}
+    for museum_id, visiting_date, status, adults, children, total_amount in rows:
+        key = (museum_id, visiting_date, payment_status or status)
+        tickets, persons, revenue = deltas.get(key, (0, 0, 0))
+        deltas[key] = (tickets + sign, persons + sign * (adults + children), revenue + sign * total_amount)
+    return deltas
+
+
+def ticket_row(ticket):
+    return (
+        ticket.museum_id, ticket.visiting_date, ticket.payment_status,
+        ticket.adults, ticket.children, ticket.total_amount,
+    )
+
+
+def record_tickets(tickets, sign=1):
+    """
+    Count new tickets into the rollups, or take deleted ones out with
+    `sign=-1`.
+    """
+    apply_sales(ticket_deltas([ticket_row(ticket) for ticket in tickets], sign=sign))
+
+
+def forget_tickets(tickets):
+    """
+    Take tickets that are being deleted out of the rollups. Archiving past
+    visits is the one deletion that skips this, since the rollups keep
+    counting archived tickets.
+    """
+    record_tickets(tickets, sign=-1)
+
+
+def move_tickets(rows, target):
+    """
+    Move `rows` (as for `ticket_deltas`) from their current status to
+    `target` in the rollups.
+    """
+    deltas = ticket_deltas(rows, sign=-1)
+    for key, (tickets, persons, revenue) in ticket_deltas(rows, payment_status=target).items():
+        current = deltas.get(key, (0, 0, 0))
+        deltas[key] = (current[0] + tickets, current[1] + persons, current[2] + revenue)
+    apply_sales(deltas)
+
+
+def rebuild_sales(museum_id=None, start=None, end=None):
+    """
+    Recompute the rollups from the Ticket table and the archived past
+    visits, optionally for one museum and a date range, and return how
+    many rollup rows were written.
+    """
+    filters = {}
+    if museum_id is not None:
+        filters['museum_id'] = museum_id
+    if start is not None:
+        filters['visiting_date__gte'] = start
+    if end is not None:
+        filters['visiting_date__lte'] = end
+
+    with transaction.atomic():
+        # Every ticket write bumps its rollup row in its own transaction, so
+        # locking the rows (and, on MySQL, the gaps between them) first holds
+        # off writers until the rebuilt rows are in: a ticket written before
+        # the lock is in the aggregate below, one written after bumps the
+        # rebuilt row.
+        list(DailySales.objects.select_for_update().filter(**filters).values_list('pk', flat=True))
+        totals = {}
+        sources = (Ticket.objects.filter(**filters), TicketArchive.objects.filter(**filters).exclude(payment_status='expired'))
+        for source in sources:
+            rows = source.order_by().values('museum_id', 'visiting_date', 'payment_status').annotate(
+                ticket_count=Count('pk'), adult_count=Sum('adults'), child_count=Sum('children'), amount=Sum('total_amount'),
+            )
+            for row in rows.iterator():
+                key = (row['museum_id'], row['visiting_date'], row['payment_status'])
+                count, persons, revenue = totals.get(key, (0, 0, 0))
+                totals[key] = (
+                    count + row['ticket_count'],
+                    persons + row['adult_count'] + row['child_count'],
+                    revenue + row['amount'],
+                )
+
+        DailySales.objects.filter(**filters).delete()
+        created = DailySales.objects.bulk_create(
+            [
+                DailySales(
+                    museum_id=key[0], visiting_date=key[1], payment_status=key[2],
+                    tickets=count, persons=persons, revenue=revenue,
+                )
+                for key, (count, persons, revenue) in totals.items()
+            ],
+            batch_size=1000,
+        )
+    return len(created)
+
+
+def sales_summary(**filters):
+    """
+    Return total sales, tickets and persons over the rollups matching
+    `filters` (DailySales field lookups) in a single query.
+    """
+    totals = DailySales.objects.filter(**filters).aggregate(
+        total_sales=Sum('revenue'), total_tickets=Sum('tickets'), total_persons=Sum('persons'),
+    )
+    return {name: value or 0 for name, value in totals.items()}
@@ -0,0 +1,207 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from django.db import DEFAULT_DB_ALIAS
+from .catalogue import catalogue_version, changed_since
+from .models import Museum
+
+TOKEN_RE = re.compile(r'\w+')
+
+SEARCH_RESULT_LIMIT = 10
+# How close a misspelt word must be to a known word to stand in for it.
+TOKEN_MIN_SIMILARITY = 0.4
+TOKEN_VARIANTS = 3
+
+
+def tokenize(*fields):
+    return [token for field in fields for token in TOKEN_RE.findall((field or '').lower())]
+
+
+def trigrams(token):
+    """
+    Return the set of trigrams of a word, padded the way pg_trgm does it so
+    the start of a word weighs more than its middle.
+    """
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    An inverted index from words to document ids, plus a trigram index over
+    the vocabulary itself. Query words are looked up directly; words that
+    aren't in the vocabulary are replaced by their closest known spellings
+    through the trigram index, so typos and reordered words still match
+    without scanning the documents.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.postings = defaultdict(set)
+        self.vocabulary = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, doc_id, *fields):
+        tokens = tuple(tokenize(*fields))
+        with self.lock:
+            self._remove(doc_id)
+            self.documents[doc_id] = tokens
+            for token in set(tokens):
+                if token not in self.postings:
+                    for gram in trigrams(token):
+                        self.vocabulary[gram].add(token)
+                self.postings[token].add(doc_id)
+
+    def remove(self, doc_id):
+        with self.lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        for token in set(self.documents.pop(doc_id, ())):
+            posting = self.postings[token]
+            posting.discard(doc_id)
+            if posting:
+                continue
+            del self.postings[token]
+            for gram in trigrams(token):
+                words = self.vocabulary[gram]
+                words.discard(token)
+                if not words:
+                    del self.vocabulary[gram]
+
+    def similar_tokens(self, token, limit=TOKEN_VARIANTS):
+        """
+        Return up to `limit` known words spelt like `token`, closest first.
+        """
+        grams = trigrams(token)
+        hits = Counter()
+        for gram in grams:
+            hits.update(self.vocabulary.get(gram, ()))
+        # A word of n letters has n + 1 padded trigrams.
+        scored = [
+            (word, count / math.sqrt(len(grams) * (len(word) + 1)))
+            for word, count in hits.items()
+        ]
+        scored = [match for match in scored if match[1] >= TOKEN_MIN_SIMILARITY]
+        return [word for word, _ in heapq.nsmallest(limit, scored, key=lambda match: (-match[1], match[0]))]
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        """
+        Return up to `limit` `(doc_id, score)` pairs, best match first.
+        Documents are scored by the IDF weight of the query words they
+        contain, so a rare word like a city name counts for more than
+        "museum". Words are applied rarest first, and once `limit` documents
+        score more than any newcomer still could, common words only top up
+        existing scores instead of pulling in their whole posting list.
+        """
+        with self.lock:
+            total = len(self.documents)
+            matches = []
+            for token in dict.fromkeys(tokenize(query)):
+                variants = [token] if token in self.postings else self.similar_tokens(token)
+                if len(variants) == 1:
+                    docs = self.postings[variants[0]]
+                elif variants:
+                    docs = set().union(*(self.postings[variant] for variant in variants))
+                else:
+                    continue
+                matches.append((docs, math.log(1 + total / len(docs))))
+            if not matches:
+                return []
+
+            matches.sort(key=lambda match: len(match[0]))
+            remaining = sum(idf for _, idf in matches)
+            weight = remaining
+            scores = {}
+            for docs, idf in matches:
+                if len(scores) >= limit and heapq.nlargest(limit, scores.values())[-1] > remaining:
+                    for doc_id in scores:
+                        if doc_id in docs:
+                            scores[doc_id] += idf
+                else:
+                    for doc_id in docs:
+                        scores[doc_id] = scores.get(doc_id, 0) + idf
+                remaining -= idf
+
+            ranked = heapq.nsmallest(
+                limit, scores.items(),
+                key=lambda match: (-match[1], len(set(self.documents[match[0]])), match[0]),
+            )
+        return [(doc_id, score / weight) for doc_id, score in ranked]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def _build_index():
+    # Kept under the catalogue version, so read from the primary: a replica
+    # may not have the save that moved the version yet
+    index = SearchIndex()
+    rows = Museum.objects.using(DEFAULT_DB_ALIAS).values_list('id', 'name', 'location')
+    for museum_id, name, location in rows.iterator():
+        index.add(museum_id, name, location)
+    return index
+
+
+def _apply_changes(index, museum_ids):
+    rows = Museum.objects.using(DEFAULT_DB_ALIAS).filter(id__in=museum_ids).values_list('id', 'name', 'location')
+    for museum_id, name, location in rows:
+        index.add(museum_id, name, location)
+        museum_ids.discard(museum_id)
+    # The rest were deleted
+    for museum_id in museum_ids:
+        index.remove(museum_id)
+
+
+def get_index():
+    """
+    Return the process-wide museum index, building it from the database on
+    first use. The Museum model signals keep it current in the process that
+    saves a museum; when the catalogue version has moved, other processes
+    re-index just the museums in the change log, and rebuild only when the
+    log can't say what changed.
+    """
+    global _index, _index_version
+    version = catalogue_version()
+    if _index is None or _index_version != version:
+        with _index_lock:
+            if _index is None:
+                _index = _build_index()
+            elif _index_version != version:
+                changed = changed_since(_index_version, version)
+                if changed is None:
+                    _index = _build_index()
+                else:
+                    _apply_changes(_index, changed)
+            _index_version = version
+    return _index
+
+
+def index_museum(museum):
+    if _index is not None:
+        _index.add(museum.pk, museum.name, museum.location)
+
+
+def unindex_museum(museum_id):
+    if _index is not None:
+        _index.remove(museum_id)
+
+
+def reset_index():
+    global _index, _index_version
+    with _index_lock:
+        _index = _index_version = None
+
+
+def search_museums(query, limit=SEARCH_RESULT_LIMIT):
+    """
+    Return the ids of the museums best matching `query`, best match first.
+    """
+    return [museum_id for museum_id, _ in get_index().search(query, limit=limit)]
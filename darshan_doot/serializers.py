@@ -1,15 +1,41 @@
 from rest_framework import serializers
 from .models import Event, Museum, Ticket
 
-class MuseumSerializer(serializers.ModelSerializer):
+class SparseFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    A ModelSerializer that takes an optional `fields` argument naming the
+    subset of its fields to serialize.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def model_field_names(cls, fields):
+        """
+        Return the model columns backing `fields`, for use with `.only()`.
+        Raises ValueError naming any field the serializer doesn't have.
+        """
+        available = cls().fields
+        unknown = [name for name in fields if name not in available]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return [available[name].source for name in fields if available[name].source != '*']
+
+class MuseumSerializer(SparseFieldsModelSerializer):
     class Meta:
         model = Museum
         fields = '__all__'
 
-class EventSerializer(serializers.ModelSerializer):
+class EventSerializer(SparseFieldsModelSerializer):
     class Meta:
         model = Event
         fields = '__all__'
+        read_only_fields = ('museum',)
 
 class TicketSerializer(serializers.ModelSerializer):
     class Meta:
@@ -47,7 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'darshan_doot.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'darshan_doot.routers.PrimaryPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -87,6 +89,13 @@ if DEBUG:
             'NAME': BASE_DIR / 'db.sqlite3',
         }
     }
+    # A second SQLite file can stand in for a read replica locally
+    if os.getenv('SQLITE_REPLICA'):
+        DATABASES['replica1'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_REPLICA'),
+            'TEST': {'MIRROR': 'default'},
+        }
 else:
     DATABASES = {
         'default': {
@@ -98,6 +107,51 @@ else:
             'PORT': os.getenv('MYSQL_DATABASE_PORT', '3306'),
         }
     }
+    # Read replicas of the primary, same credentials, comma-separated hosts
+    replica_hosts = [host.strip() for host in os.getenv('MYSQL_REPLICA_HOSTS', '').split(',') if host.strip()]
+    for number, host in enumerate(replica_hosts, 1):
+        DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+
+# Keep connections open across requests instead of reconnecting every time,
+# and check them before reuse so a dropped one is replaced, not failed on
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = int(os.getenv('DATABASE_CONN_MAX_AGE', 60))
+    database['CONN_HEALTH_CHECKS'] = True
+
+# Views marked for it read from these (see darshan_doot/routers.py); a
+# client that writes reads from the primary for REPLICA_PIN_SECONDS after
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['darshan_doot.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The museum catalogue is cached in process unless REDIS_URL is set. Run
+# several workers with it set: its version is how a museum change reaches
+# every worker's listings, calendars and search index.
+
+REDIS_URL = os.getenv('REDIS_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogue': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogue',
+        'TIMEOUT': int(os.getenv('CATALOGUE_CACHE_TIMEOUT', 86400)),
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+if REDIS_URL:
+    CACHES['catalogue'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'darshan_doot',
+        'TIMEOUT': int(os.getenv('CATALOGUE_CACHE_TIMEOUT', 86400)),
+    }
 
 
 # Password validation
@@ -150,11 +204,59 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
+    'DEFAULT_PAGINATION_CLASS': 'darshan_doot.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+    # Proxies in front of the app that append to X-Forwarded-For; with none
+    # the client IP rate limits use is REMOTE_ADDR and the header is ignored
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
 }
 
 STRIPE_PUBLIC_KEY = os.getenv('STRIPE_PUBLIC_KEY')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+# PaymentIntent calls (see darshan_doot/payments.py): the API endpoint, a
+# per-call timeout in seconds, the connection pool size, which also caps
+# concurrent calls and sizes the async views' thread pool for Stripe calls,
+# and the failures in a row that trip the circuit breaker
+# and the seconds it then stays open
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_TIMEOUT = float(os.getenv('STRIPE_TIMEOUT', 5))
+STRIPE_POOL_SIZE = int(os.getenv('STRIPE_POOL_SIZE', 10))
+STRIPE_BREAKER_THRESHOLD = int(os.getenv('STRIPE_BREAKER_THRESHOLD', 5))
+STRIPE_BREAKER_RESET = float(os.getenv('STRIPE_BREAKER_RESET', 30))
+# 'thread' applies webhook events on a background thread in the web process;
+# 'command' leaves them to `manage.py process_stripe_events`.
+STRIPE_WEBHOOK_WORKER = os.getenv('STRIPE_WEBHOOK_WORKER', 'thread')
 
 # Custom settings
+# Threads the async views may use for transactional work, which also caps
+# the database connections they hold
+ASYNC_BLOCKING_THREADS = int(os.getenv('ASYNC_BLOCKING_THREADS', 8))
+# Bookings one phone number may make per day
 TICKET_BOOKING_LIMIT = int(os.getenv('TICKET_BOOKING_LIMIT', 6))
+# Token-bucket limits as 'N/period' (see darshan_doot/throttling.py)
+THROTTLE_RATES = {
+    'booking_phone': f'{TICKET_BOOKING_LIMIT}/day',
+    'booking_ip': os.getenv('BOOKING_IP_RATE', '120/min'),
+    'verify_ip': os.getenv('VERIFY_IP_RATE', '30/min'),
+    'verify_ticket': os.getenv('VERIFY_TICKET_RATE', '5/hour'),
+    'qr_ticket': os.getenv('QR_TICKET_RATE', '60/hour'),
+}
+MUSEUM_DAILY_CAPACITY = int(os.getenv('MUSEUM_DAILY_CAPACITY', 1000))
+BULK_TICKET_LIMIT = int(os.getenv('BULK_TICKET_LIMIT', 500))
+# Unpaid tickets are expired this long after booking, and tickets are
+# archived this many days after their visit (see darshan_doot/reaper.py).
+PENDING_TICKET_TTL_MINUTES = int(os.getenv('PENDING_TICKET_TTL_MINUTES', 30))
+TICKET_ARCHIVE_AFTER_DAYS = int(os.getenv('TICKET_ARCHIVE_AFTER_DAYS', 1))
+# Seconds a rendered payment page is cached for its ticket and status
+PAYMENT_PAGE_CACHE_TIMEOUT = int(os.getenv('PAYMENT_PAGE_CACHE_TIMEOUT', 3600))
+# Where rendered ticket QR codes are kept, and the background processes
+# that render them after payment (0 renders on first download instead)
+TICKET_ARTIFACT_DIR = os.getenv('TICKET_ARTIFACT_DIR') or BASE_DIR / 'ticket_artifacts'
+TICKET_RENDER_WORKERS = int(os.getenv('TICKET_RENDER_WORKERS', 2))
+# Requests slower than METRICS_SLOW_REQUEST_SECONDS are traced, a sampled
+# fraction of them, into a buffer of the last METRICS_TRACE_BUFFER traces
+# (see darshan_doot/metrics.py)
+METRICS_SLOW_REQUEST_SECONDS = float(os.getenv('METRICS_SLOW_REQUEST_SECONDS', 1))
+METRICS_TRACE_SAMPLE_RATE = float(os.getenv('METRICS_TRACE_SAMPLE_RATE', 0.25))
+METRICS_TRACE_BUFFER = int(os.getenv('METRICS_TRACE_BUFFER', 200))
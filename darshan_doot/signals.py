@@ -0,0 +1,40 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .catalogue import invalidate_catalogue
+from .models import Museum, Ticket
+from .sales import record_tickets
+from .search import index_museum, unindex_museum
+
+
+@receiver(post_save, sender=Museum)
+@receiver(post_delete, sender=Museum)
+def museum_changed(sender, instance, **kwargs):
+    """
+    Move the catalogue version, which drops cached listings and the
+    calendars every process compiled from museum rows, and log the museum
+    so other processes re-index just it.
+    """
+    invalidate_catalogue([instance.pk])
+
+
+@receiver(post_save, sender=Museum)
+def museum_saved(sender, instance, **kwargs):
+    index_museum(instance)
+
+
+@receiver(post_delete, sender=Museum)
+def museum_deleted(sender, instance, **kwargs):
+    unindex_museum(instance.pk)
+
+
+@receiver(post_save, sender=Ticket)
+def ticket_saved(sender, instance, created, **kwargs):
+    """
+    Count new tickets into the daily sales rollups. Status changes are
+    counted by the ticket state machine, which doesn't save whole rows, and
+    deletions by whoever deletes, through `sales.forget_tickets`: there is
+    deliberately no post_delete receiver, so the reaper can archive tickets
+    with plain bulk DELETEs.
+    """
+    if created:
+        record_tickets([instance])
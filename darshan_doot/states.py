@@ -0,0 +1,85 @@
+"""
+Ticket payment states and the transitions between them:
+
+    pending -> paid -> refunded
+    pending -> cancelled
+    pending -> refunded
+
+Tickets move with a conditional UPDATE of their status columns guarded on
+the current status, so when a webhook and payment_verify race on the same
+ticket exactly one of them applies and neither overwrites the other's
+columns. Status changes must go through here: the daily sales rollups are
+only kept current for transitions made with these functions.
+"""
+
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from .capacity import release_seats
+from .models import Ticket
+from .sales import move_tickets
+
+PENDING = 'pending'
+PAID = 'paid'
+CANCELLED = 'cancelled'
+REFUNDED = 'refunded'
+
+# Statuses a ticket may be in for each transition to apply
+ALLOWED_FROM = {
+    PAID: (PENDING,),
+    CANCELLED: (PENDING,),
+    REFUNDED: (PENDING, PAID),
+}
+# Transitions that hand the ticket's seats back to the daily ledger
+RELEASES_SEATS = {CANCELLED, REFUNDED}
+
+
+def can_transition(current, target):
+    return current in ALLOWED_FROM.get(target, ())
+
+
+def transition(ticket_id, target, **fields):
+    """
+    Move one ticket to `target`, writing `fields` in the same UPDATE.
+    Returns True when the transition applied, False when the ticket doesn't
+    exist or isn't in a status it can move from.
+    """
+    return transition_many([ticket_id], target, **fields) == 1
+
+
+def transition_many(ticket_ids, target, **fields):
+    """
+    Move every ticket in `ticket_ids` that is allowed to reach `target` and
+    return how many moved. Each status the tickets may come from is moved
+    with one guarded UPDATE stamped with its own status_changed_at, and the
+    rows carrying that stamp are read back afterwards, so the daily sales
+    rollups, and for cancellations and refunds the seat ledger, are adjusted
+    for exactly the tickets the UPDATE moved.
+    """
+    rows = []
+    with transaction.atomic(savepoint=False):
+        changed_at = timezone.now()
+        for source in ALLOWED_FROM[target]:
+            if Ticket.objects.filter(ticket_id__in=ticket_ids, payment_status=source).update(
+                payment_status=target, status_changed_at=changed_at, **fields
+            ):
+                rows.extend(
+                    (museum_id, visiting_date, source, adults, children, total_amount)
+                    for museum_id, visiting_date, adults, children, total_amount in Ticket.objects.filter(
+                        ticket_id__in=ticket_ids, payment_status=target, status_changed_at=changed_at
+                    ).values_list('museum_id', 'visiting_date', 'adults', 'children', 'total_amount')
+                )
+            # A distinct stamp per source keeps their read-backs apart
+            changed_at += timedelta(microseconds=1)
+        if not rows:
+            return 0
+
+        move_tickets(rows, target)
+        if target in RELEASES_SEATS:
+            released = {}
+            for museum_id, visiting_date, _, adults, children, _ in rows:
+                key = (museum_id, visiting_date)
+                released[key] = released.get(key, 0) + adults + children
+            for (museum_id, visiting_date), seats in released.items():
+                release_seats(museum_id, visiting_date, seats)
+    return len(rows)
@@ -0,0 +1,159 @@
+"""
+Offline stand-ins for Stripe, for tests and benchmarks: webhook events
+shaped like the ones Stripe sends, signed the way Stripe signs them, so
+they pass stripe.Webhook.construct_event without any network access; and
+StubStripe, a local server answering the PaymentIntent API.
+"""
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+def make_event(event_type, ticket_id, created=None, event_id=None):
+    """
+    Return a Stripe event dict for `ticket_id`. Payment intents and charges
+    both carry the ticket id in their metadata, as set at checkout.
+    """
+    object_type = 'charge' if event_type.startswith('charge.') else 'payment_intent'
+    prefix = 'ch' if object_type == 'charge' else 'pi'
+    return {
+        'id': event_id or f'evt_{uuid.uuid4().hex[:24]}',
+        'object': 'event',
+        'type': event_type,
+        'created': int(created if created is not None else time.time()),
+        'data': {
+            'object': {
+                'id': f'{prefix}_{uuid.uuid4().hex[:24]}',
+                'object': object_type,
+                'metadata': {'ticket_id': str(ticket_id)},
+            },
+        },
+    }
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """
+    Return the Stripe-Signature header for a raw webhook `payload`.
+    """
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    if isinstance(payload, bytes):
+        payload = payload.decode()
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+def signed_event(event, secret, timestamp=None):
+    """
+    Return `(body, signature header)` ready to POST to the webhook view.
+    """
+    body = json.dumps(event).encode()
+    return body, sign_payload(body, secret, timestamp)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        stub = self.server.stub
+        params = dict(parse_qsl(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()))
+        with stub.lock:
+            stub.requests += 1
+            stub.connections.add(self.client_address)
+        if stub.latency:
+            time.sleep(stub.latency)
+        if stub.fail_with:
+            return self._reply(stub.fail_with, {'error': {'type': 'api_error', 'message': 'Stub failure.'}})
+        if self.path.startswith('/v1/payment_intents/') and self.path.endswith('/cancel'):
+            return self._cancel(stub, self.path.split('/')[3])
+        if self.path != '/v1/payment_intents':
+            return self._reply(404, {'error': {'type': 'invalid_request_error', 'message': 'Unknown path.'}})
+
+        key = self.headers.get('Idempotency-Key') or uuid.uuid4().hex
+        with stub.lock:
+            intent = stub.intents.get(key)
+            if intent is None:
+                intent_id = f'pi_{uuid.uuid4().hex[:24]}'
+                intent = stub.intents[key] = {
+                    'id': intent_id,
+                    'object': 'payment_intent',
+                    'amount': int(params['amount']),
+                    'currency': params['currency'],
+                    'client_secret': f'{intent_id}_secret_{uuid.uuid4().hex[:24]}',
+                    'status': 'requires_payment_method',
+                    'metadata': {
+                        name[len('metadata['):-1]: value
+                        for name, value in params.items() if name.startswith('metadata[')
+                    },
+                }
+        self._reply(200, intent)
+
+
+    def _cancel(self, stub, intent_id):
+        with stub.lock:
+            intent = next((intent for intent in stub.intents.values() if intent['id'] == intent_id), None)
+            if intent is None:
+                return self._reply(404, {'error': {'type': 'invalid_request_error', 'message': 'No such intent.'}})
+            # Cancelling twice is refused too, as by Stripe once the first
+            # call's idempotency key has expired; the error carries the intent
+            if intent['status'] in ('succeeded', 'processing', 'canceled'):
+                return self._reply(400, {'error': {
+                    'type': 'invalid_request_error', 'code': 'payment_intent_unexpected_state',
+                    'message': f"This PaymentIntent's status is {intent['status']}.",
+                    'payment_intent': dict(intent),
+                }})
+            intent['status'] = 'canceled'
+        self._reply(200, intent)
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up mid-response; that's expected here
+        pass
+
+
+class StubStripe:
+    """
+    A local stand-in for api.stripe.com, serving PaymentIntent creation
+    with idempotency keys honoured, and cancellation. `latency` delays every response and
+    `fail_with` makes every call fail with that HTTP status, to exercise
+    timeouts and the circuit breaker. Use as a context manager; `api_base`
+    is the URL to point STRIPE_API_BASE at.
+    """
+
+    def __init__(self, latency=0, fail_with=None):
+        self.latency = latency
+        self.fail_with = fail_with
+        self.intents = {}
+        self.requests = 0
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.server = _StubServer(('127.0.0.1', 0), _StubHandler)
+        self.server.stub = self
+        self.api_base = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,10 +1,48 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, TransactionTestCase
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from .models import Event, Museum, Ticket
+from .models import DailyCapacity, DailySales, Event, Museum, StripeEvent, Ticket, TicketArchive
+from .capacity import reserve_seats
+from . import artifacts, closures, loadtest, pages
+from .artifacts import ticket_codes
+from .catalogue import get_cache, invalidate_catalogue
+from .closures import MuseumCalendar, get_calendar
+from .exports import accepts_gzip, export_queryset, export_rows
+from .gate import GateSnapshot, gate_key, member_code, read_token, sign_ticket
+from .loader import load_museums, read_csv
+from .metrics import Registry, render, reset_metrics
+from .payments import CircuitBreaker, PaymentGatewayUnavailable, get_gateway, reset_gateway
+from .reaper import expire_pending
+from .routers import replica_reads
+from .sales import rebuild_sales
+from .search import SearchIndex, reset_index, search_museums
+from .states import transition
+from .throttling import LocalBucketStore, check_rates, client_ip, parse_rate, reset_throttles
+from .views import MuseumViewSet
+from .stripe_fake import StubStripe, make_event, signed_event
+from .webhooks import WebhookWorker, process_pending_events
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.contrib import admin
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signing import BadSignature
+from django.db import OperationalError, connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.utils import timezone
+from django.utils.http import urlencode
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.conf import settings
+from datetime import date, time, timedelta
+from io import StringIO
+import base64
+import gzip
 import json
+import os
+import tempfile
+import threading
+import uuid
 from unittest.mock import patch
 
 class MuseumAPITests(APITestCase):
@@ -43,7 +81,7 @@ class MuseumAPITests(APITestCase):
         url = reverse('museum-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.json()['results']), 1)
 
     def test_get_museum_detail(self):
         url = reverse('museum-detail', kwargs={'pk': self.museum.pk})
@@ -168,4 +206,1785 @@ class PaymentAPITests(APITestCase):
         data = {"ticket_id": str(self.ticket.ticket_id), "transaction_id": "test_transaction_id"}
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['message'], "Payment confirmed successfully")
\ No newline at end of file
+        self.assertEqual(response.data['message'], "Payment confirmed successfully")
+
+class CapacityTests(APITestCase):
+    def setUp(self):
+        reset_throttles()
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="Janpath, New Delhi",
+            indian_adult_fee=20, indian_child_fee=0, camera_fee=0, international_citizen_fee=500,
+            timings="10:00 AM – 6:00 PM", closed_on="Mondays and National Holidays"
+        )
+        self.client.force_authenticate(User.objects.create_superuser(username='bot', password='12345'))
+        self.ticket_data = {
+            "user_phone": "9999999999",
+            "user_email": "visitor@example.com",
+            "adults": 2,
+            "children": 1,
+            "visiting_date": "2026-01-27",
+            "museum": self.museum.id,
+            "nationality": "Indian"
+        }
+
+    def test_booking_reserves_seats(self):
+        DailyCapacity.objects.create(museum=self.museum, visiting_date=date(2026, 1, 27), capacity=10, remaining=10)
+        response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(DailyCapacity.objects.get(museum=self.museum).remaining, 7)
+
+    def test_booking_is_a_single_insert(self):
+        DailyCapacity.objects.create(museum=self.museum, visiting_date=date(2026, 1, 27), capacity=10, remaining=10)
+        DailySales.objects.create(museum=self.museum, visiting_date=date(2026, 1, 27), payment_status='pending')
+        # museum lookup, savepoint, ledger UPDATE, ticket INSERT, sales rollup UPDATE, release savepoint
+        with self.assertNumQueries(6):
+            response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ticket = Ticket.objects.get()
+        self.assertEqual(ticket.stripe_payment_intent_id, f"/payment/{ticket.ticket_id}/")
+        self.assertEqual(response.data['stripe_payment_intent'], ticket.stripe_payment_intent_id)
+        self.assertEqual(response.data['payment_url'], ticket.stripe_payment_intent_id)
+        self.assertIsNone(response.data['payment_intent_id'])
+        self.assertEqual(response.data['total_amount'], 40)
+
+    def test_booking_rejected_when_sold_out(self):
+        DailyCapacity.objects.create(museum=self.museum, visiting_date=date(2026, 1, 27), capacity=10, remaining=2)
+        response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Ticket.objects.count(), 0)
+        self.assertEqual(DailyCapacity.objects.get(museum=self.museum).remaining, 2)
+
+    def test_unseeded_date_uses_default_capacity(self):
+        with self.settings(MUSEUM_DAILY_CAPACITY=50):
+            response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ledger = DailyCapacity.objects.get(museum=self.museum)
+        self.assertEqual((ledger.capacity, ledger.remaining), (50, 47))
+
+    def test_losing_the_race_to_seed_a_day_still_reserves(self):
+        get_or_create = DailyCapacity.objects.get_or_create
+
+        def seeded_first(**kwargs):
+            # Another first booking for the day creates the row in between
+            DailyCapacity.objects.create(museum=self.museum, visiting_date=date(2026, 1, 27), capacity=10, remaining=10)
+            return get_or_create(**kwargs)
+
+        with patch.object(DailyCapacity.objects, 'get_or_create', side_effect=seeded_first):
+            self.assertTrue(reserve_seats(self.museum.pk, date(2026, 1, 27), 3))
+        self.assertEqual(DailyCapacity.objects.get(museum=self.museum).remaining, 7)
+
+    def test_seed_capacity_skips_closed_days(self):
+        call_command('seed_capacity', start='2026-01-26', days=7, hourly_capacity=100, stdout=StringIO())
+        ledger = DailyCapacity.objects.filter(museum=self.museum).order_by('visiting_date')
+        self.assertEqual(ledger.count(), 6)  # 2026-01-26 is a Monday
+        self.assertEqual(ledger.first().visiting_date, date(2026, 1, 27))
+        self.assertEqual(ledger.first().capacity, 800)
+
+    def test_seed_capacity_starts_on_the_local_date(self):
+        # The same day the API calls today, whatever the server clock says
+        with patch('django.utils.timezone.localdate', return_value=date(2026, 1, 27)):
+            call_command('seed_capacity', days=1, capacity=10, stdout=StringIO())
+        self.assertEqual(DailyCapacity.objects.get().visiting_date, date(2026, 1, 27))
+
+    def test_seed_capacity_keeps_existing_counters(self):
+        DailyCapacity.objects.create(museum=self.museum, visiting_date=date(2026, 1, 27), capacity=10, remaining=3)
+        call_command('seed_capacity', start='2026-01-27', days=2, capacity=10, stdout=StringIO())
+        self.assertEqual(DailyCapacity.objects.get(visiting_date=date(2026, 1, 27)).remaining, 3)
+        self.assertEqual(DailyCapacity.objects.count(), 2)
+
+class ClosureCalendarTests(APITestCase):
+    def setUp(self):
+        reset_throttles()
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="Janpath, New Delhi",
+            indian_adult_fee=20, indian_child_fee=0, camera_fee=0, international_citizen_fee=500,
+            timings="10:00 AM – 6:00 PM", closed_on="Mondays and National Holidays"
+        )
+
+    def test_compile_free_text(self):
+        calendar = MuseumCalendar.compile("Saturday, Sunday", "9:30 AM – 5:30 PM")
+        self.assertEqual(calendar.weekday_mask, 0b1100000)
+        self.assertEqual((calendar.opening, calendar.closing), (time(9, 30), time(17, 30)))
+        self.assertFalse(calendar.is_open(date(2026, 1, 31)))
+        self.assertTrue(calendar.is_open(date(2026, 2, 2)))
+
+        festivals = MuseumCalendar.compile("Holi and Diwali", "9:30 AM – 6:30 PM")
+        self.assertFalse(festivals.is_open(date(2026, 3, 4)))
+        self.assertTrue(festivals.is_open(date(2026, 3, 5)))
+
+    def test_open_days_matches_is_open(self):
+        calendar = get_calendar(self.museum)
+        start = date(2026, 1, 1)
+        days = calendar.open_days(start, date(2026, 12, 31))
+        self.assertEqual(len(days), 365)
+        for offset, is_open in enumerate(days):
+            day = date.fromordinal(start.toordinal() + offset)
+            self.assertEqual(is_open, calendar.is_open(day), day)
+
+    def test_calendar_invalidated_on_save(self):
+        self.assertFalse(get_calendar(self.museum).is_open(date(2026, 1, 26)))
+        self.museum.closed_on = "NA"
+        self.museum.save()
+        self.assertTrue(get_calendar(self.museum).is_open(date(2026, 1, 26)))
+
+    def test_calendar_follows_shared_version(self):
+        self.assertFalse(get_calendar(self.museum).is_open(date(2026, 1, 26)))
+        # Saved by another process: no signal here, only the version moves
+        Museum.objects.filter(pk=self.museum.pk).update(closed_on="NA")
+        invalidate_catalogue()
+        self.museum.refresh_from_db()
+        self.assertTrue(get_calendar(self.museum).is_open(date(2026, 1, 26)))
+
+    def test_warns_past_festival_table(self):
+        calendar = MuseumCalendar.compile("Holi and Diwali", "9:30 AM – 6:30 PM")
+        year = closures.FESTIVAL_LAST_YEAR + 1
+        closures._warned_years.discard(year)
+        self.addCleanup(closures._warned_years.discard, year)
+        with self.assertLogs('darshan_doot.closures', 'WARNING') as logs:
+            calendar.is_open(date(year, 3, 1))
+            calendar.is_open(date(year, 3, 2))
+        self.assertEqual(len(logs.records), 1)
+        with self.assertNoLogs('darshan_doot.closures', 'WARNING'):
+            MuseumCalendar.compile("Mondays", "9:30 AM – 6:30 PM").is_open(date(year, 3, 1))
+
+    def test_booking_rejected_on_closed_day(self):
+        self.client.force_authenticate(User.objects.create_superuser(username='bot', password='12345'))
+        response = self.client.post(reverse('create_ticket'), {
+            "user_phone": "9999999999", "user_email": "visitor@example.com", "adults": 1, "children": 0,
+            "visiting_date": "2026-01-26", "museum": self.museum.id, "nationality": "Indian"
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_availability_window(self):
+        DailyCapacity.objects.create(museum=self.museum, visiting_date=date(2026, 1, 27), capacity=10, remaining=4)
+        url = reverse('museum-availability', kwargs={'pk': self.museum.pk})
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'from': '2026-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        days = {day['date']: day for day in response.data['days']}
+        self.assertEqual(len(days), 90)
+        self.assertFalse(days[date(2026, 1, 26)]['open'])
+        self.assertEqual(days[date(2026, 1, 27)]['remaining'], 4)
+        self.assertFalse(days[date(2026, 1, 5)]['open'])  # Monday
+
+    def test_availability_rejects_bad_window(self):
+        url = reverse('museum-availability', kwargs={'pk': self.museum.pk})
+        response = self.client.get(url, {'from': '2026-02-01', 'to': '2026-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class BulkTicketTests(APITestCase):
+    def setUp(self):
+        reset_throttles()
+        self.museums = [
+            Museum.objects.create(
+                name=f"Museum {index}", location="New Delhi",
+                indian_adult_fee=20, indian_child_fee=10, camera_fee=0, international_citizen_fee=500,
+                timings="10:00 AM – 6:00 PM", closed_on="Monday"
+            )
+            for index in range(3)
+        ]
+        self.client.force_authenticate(User.objects.create_superuser(username='operator', password='12345'))
+
+    def booking(self, museum_obj, **overrides):
+        data = {
+            "user_phone": "9999999999", "user_email": "operator@example.com", "adults": 2, "children": 1,
+            "visiting_date": "2026-01-27", "museum": museum_obj.id, "nationality": "Indian"
+        }
+        data.update(overrides)
+        return data
+
+    def test_bulk_reports_per_item_errors(self):
+        bookings = [
+            self.booking(self.museums[0]),
+            self.booking(self.museums[1], nationality="French"),
+            self.booking(self.museums[0], visiting_date="2026-01-26"),  # Monday
+            self.booking(self.museums[0], museum=999999),
+            {"user_phone": "9999999999"},
+        ]
+        response = self.client.post(reverse('bulk_create_ticket'), {"bookings": bookings}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 3))
+        results = response.data['results']
+        self.assertEqual(results[0]['total_amount'], 50)
+        self.assertEqual(results[1]['total_amount'], 1500)
+        self.assertEqual([result.get('status') for result in results[2:]], [400, 404, 400])
+
+        ticket = Ticket.objects.get(ticket_id=results[0]['ticket_id'])
+        self.assertEqual(ticket.stripe_payment_intent_id, f"/payment/{ticket.ticket_id}/")
+        self.assertEqual(Ticket.objects.count(), 2)
+
+    def test_bulk_rejects_items_that_do_not_fit(self):
+        bookings = [
+            self.booking(self.museums[0]),
+            self.booking(self.museums[0], user_phone="9" * 16),
+            self.booking(self.museums[0], user_email=["operator@example.com"]),
+            self.booking(self.museums[0], nationality=5),
+        ]
+        response = self.client.post(reverse('bulk_create_ticket'), {"bookings": bookings}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result.get('status') for result in response.data['results'][1:]], [400, 400, 400])
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_bulk_creates_payment_intents(self):
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        with StubStripe() as stub, self.settings(STRIPE_SECRET_KEY='sk_test_stub', STRIPE_API_BASE=stub.api_base):
+            response = self.client.post(
+                reverse('bulk_create_ticket'), [self.booking(self.museums[0]), self.booking(self.museums[1])],
+                format='json',
+            )
+        self.assertEqual(response.data['created'], 2)
+        self.assertTrue(all(result['client_secret'] for result in response.data['results']))
+        intent_ids = set(Ticket.objects.values_list('stripe_payment_intent_id', flat=True))
+        self.assertEqual(intent_ids, {result['payment_intent_id'] for result in response.data['results']})
+        self.assertTrue(all(intent_id.startswith('pi_') for intent_id in intent_ids))
+
+    def test_bulk_partially_fills_scarce_day(self):
+        DailyCapacity.objects.create(museum=self.museums[0], visiting_date=date(2026, 1, 27), capacity=7, remaining=7)
+        bookings = [self.booking(self.museums[0]) for _ in range(3)]
+        response = self.client.post(reverse('bulk_create_ticket'), bookings, format='json')
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['results'][2]['status'], status.HTTP_409_CONFLICT)
+        self.assertEqual(DailyCapacity.objects.get(museum=self.museums[0]).remaining, 1)
+
+    def test_bulk_query_count_is_independent_of_batch_size(self):
+        for museum in self.museums:
+            DailyCapacity.objects.create(museum=museum, visiting_date=date(2026, 1, 27), capacity=1000, remaining=1000)
+            DailySales.objects.create(museum=museum, visiting_date=date(2026, 1, 27), payment_status='pending')
+        bookings = [self.booking(self.museums[index % 3], user_phone=f'98{index:08d}') for index in range(60)]
+        # museum lookup + one ledger UPDATE per museum and day + one INSERT +
+        # one sales rollup UPDATE per museum and day, wrapped in a savepoint
+        # pair for the transaction
+        with self.assertNumQueries(10):
+            response = self.client.post(reverse('bulk_create_ticket'), {"bookings": bookings}, format='json')
+        self.assertEqual(response.data['created'], 60)
+        self.assertEqual(Ticket.objects.count(), 60)
+
+class CatalogueCacheTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.museum = Museum.objects.create(
+            name="State Museum", location="Narhi, Hazratganj, Lucknow",
+            indian_adult_fee=5, indian_child_fee=2, camera_fee=20, international_citizen_fee=50,
+            timings="10:30 AM – 4:30 PM", closed_on="Monday"
+        )
+        self.url = reverse('museum-list')
+
+    def test_listing_served_from_cache(self):
+        first = self.client.get(self.url, {'location': 'Lucknow'})
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, {'location': '  LUCKNOW '})
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(second.json()['results'][0]['name'], "State Museum")
+        get_cache().clear()
+        self.assertEqual(self.client.get(self.url, {'location': '  LUCKNOW '}).content, first.content)
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_save_invalidates_listing(self):
+        etag = self.client.get(self.url)['ETag']
+        self.museum.timings = "10:00 AM – 5:00 PM"
+        self.museum.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['timings'], "10:00 AM – 5:00 PM")
+
+    def test_listing_built_across_a_save_is_not_kept(self):
+        filtered_data = MuseumViewSet.filtered_data
+
+        def saved_meanwhile(view, *args, **kwargs):
+            data = filtered_data(view, *args, **kwargs)
+            Museum.objects.filter(pk=self.museum.pk).update(timings="10:00 AM – 5:00 PM")
+            invalidate_catalogue()
+            return data
+
+        with patch.object(MuseumViewSet, 'filtered_data', saved_meanwhile):
+            self.assertEqual(self.client.get(self.url).json()['results'][0]['timings'], "10:30 AM – 4:30 PM")
+        self.assertEqual(self.client.get(self.url).json()['results'][0]['timings'], "10:00 AM – 5:00 PM")
+
+    def test_delete_invalidates_listing(self):
+        self.client.get(self.url)
+        self.museum.delete()
+        self.assertEqual(self.client.get(self.url).json()['results'], [])
+
+class MuseumSearchTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        reset_index()
+        for name, location in [
+            ("Regional Science City", "Lucknow"),
+            ("State Museum", "Narhi, Hazratganj, Lucknow"),
+            ("Nehru Science Centre", "Nehru Science Centre, Mumbai"),
+            ("Regional Science Centre", "Jaipur"),
+            ("Shillong Science Centre", "Shillong"),
+        ]:
+            Museum.objects.create(
+                name=name, location=location, indian_adult_fee=0, indian_child_fee=0, camera_fee=0,
+                international_citizen_fee=0, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+            )
+        self.url = reverse('museum-list')
+
+    def test_index_tolerates_typos_and_reordering(self):
+        index = SearchIndex()
+        index.add(1, "Regional Science City", "Lucknow")
+        index.add(2, "Regional Science Centre", "Jaipur")
+        self.assertEqual(index.search("lucknow sceince")[0][0], 1)
+        self.assertEqual(index.search("centre science jaipr")[0][0], 2)
+        index.remove(2)
+        self.assertEqual([doc_id for doc_id, _ in index.search("jaipur")], [])
+
+    def test_search_ranks_best_match_first(self):
+        response = self.client.get(self.url, {'q': 'science centre lucknow'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0]['name'], "Regional Science City")
+
+    def test_index_follows_model_signals(self):
+        self.client.get(self.url, {'q': 'lucknow'})
+        museum = Museum.objects.get(name="Regional Science Centre")
+        museum.location = "Lucknow"
+        museum.save()
+        names = [row['name'] for row in self.client.get(self.url, {'q': 'lucknow'}).json()['results']]
+        self.assertIn("Regional Science Centre", names)
+        museum.delete()
+        names = [row['name'] for row in self.client.get(self.url, {'q': 'lucknow'}).json()['results']]
+        self.assertNotIn("Regional Science Centre", names)
+
+    def test_index_follows_shared_version(self):
+        self.assertEqual(search_museums('jaipur')[0], Museum.objects.get(location="Jaipur").pk)
+        # Loaded by another process: no signals, only the version moves
+        Museum.objects.filter(location="Jaipur").update(location="Bhopal")
+        invalidate_catalogue()
+        self.assertEqual(search_museums('jaipur'), [])
+
+    def test_index_catches_up_from_change_log(self):
+        search_museums('jaipur')
+        jaipur = Museum.objects.get(location="Jaipur")
+        shillong = Museum.objects.get(location="Shillong")
+        # Saved and deleted by another process, which logs the ids
+        Museum.objects.filter(pk=jaipur.pk).update(location="Bhopal")
+        Museum.objects.filter(pk=shillong.pk)._raw_delete('default')
+        invalidate_catalogue([jaipur.pk])
+        invalidate_catalogue([shillong.pk])
+        # Only the logged museums are read again, not the whole table
+        with self.assertNumQueries(1):
+            self.assertEqual(search_museums('jaipur'), [])
+        self.assertEqual(search_museums('bhopal'), [jaipur.pk])
+        self.assertEqual(search_museums('shillong'), [])
+
+class ListingPaginationTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        for index in range(5):
+            Museum.objects.create(
+                name=f"Museum {index}", location="Lucknow", indian_adult_fee=0, indian_child_fee=0, camera_fee=0,
+                international_citizen_fee=0, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+            )
+        museum = Museum.objects.first()
+        for day in range(3):
+            Event.objects.create(museum=museum, name=f"Event {day}", date=f"2026-02-0{3 - day}T10:00:00Z", description="Talk")
+
+    def test_museums_are_cursor_paginated(self):
+        url = reverse('museum-list')
+        first = self.client.get(url, {'page_size': 2}).json()
+        self.assertEqual([row['name'] for row in first['results']], ["Museum 0", "Museum 1"])
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        self.assertEqual([row['name'] for row in second['results']], ["Museum 2", "Museum 3"])
+
+    def test_sparse_fieldset_fetches_only_requested_columns(self):
+        url = reverse('museum-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'id,name,timings'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'name', 'timings'})
+        self.assertNotIn('closed_on', queries[0]['sql'])
+
+    def test_unknown_field_rejected(self):
+        response = self.client.get(reverse('museum-list'), {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_events_are_paginated_by_date(self):
+        museum = Museum.objects.first()
+        url = reverse('museum-events-list', kwargs={'museum_pk': museum.pk})
+        response = self.client.get(url, {'fields': 'name', 'page_size': 2, 'from': '2026-01-01'})
+        self.assertEqual(response.data['results'], [{'name': "Event 2"}, {'name': "Event 1"}])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_sparse_events_fetch_ordering_columns(self):
+        museum = Museum.objects.first()
+        url = reverse('museum-events-list', kwargs={'museum_pk': museum.pk})
+        # One query for the page; no deferred `date` loaded per row for the cursor
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'fields': 'name', 'page_size': 2, 'from': '2026-01-01'})
+        self.assertIsNotNone(response.data['next'])
+
+    def test_cached_listing_links_follow_host(self):
+        url = reverse('museum-list')
+        with self.settings(ALLOWED_HOSTS=['a.example.com', 'b.example.com']):
+            first = self.client.get(url, {'page_size': 2}, HTTP_HOST='a.example.com').json()
+            second = self.client.get(url, {'page_size': 2}, HTTP_HOST='b.example.com').json()
+        self.assertTrue(first['next'].startswith('http://a.example.com/'))
+        self.assertTrue(second['next'].startswith('http://b.example.com/'))
+
+class MuseumEventTests(APITestCase):
+    def setUp(self):
+        self.museum, self.other = [
+            Museum.objects.create(
+                name=name, location="New Delhi", indian_adult_fee=0, indian_child_fee=0, camera_fee=0,
+                international_citizen_fee=0, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+            )
+            for name in ("National Museum India", "National Agricultural Science Museum")
+        ]
+        Event.objects.create(museum=self.museum, name="Past", date="2020-01-01T10:00:00Z", description="")
+        Event.objects.create(museum=self.museum, name="Spring", date="2099-03-01T10:00:00Z", description="")
+        Event.objects.create(museum=self.museum, name="Summer", date="2099-06-01T10:00:00Z", description="")
+        Event.objects.create(museum=self.other, name="Elsewhere", date="2099-03-01T10:00:00Z", description="")
+        self.url = reverse('museum-events-list', kwargs={'museum_pk': self.museum.pk})
+
+    def names(self, response):
+        return [event['name'] for event in response.data['results']]
+
+    def test_lists_only_upcoming_events_of_museum(self):
+        self.assertEqual(self.names(self.client.get(self.url)), ["Spring", "Summer"])
+
+    def test_date_range(self):
+        response = self.client.get(self.url, {'from': '2020-01-01', 'to': '2099-03-01'})
+        self.assertEqual(self.names(response), ["Past", "Spring"])
+        response = self.client.get(self.url, {'to': 'soon'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_range_uses_composite_index(self):
+        queryset = Event.objects.filter(museum=self.museum, date__gte="2099-01-01T00:00:00Z").order_by('date', 'pk')
+        self.assertIn('event_museum_date_idx', queryset.explain())
+
+    def test_create_assigns_museum_from_url(self):
+        self.client.force_authenticate(User.objects.create_superuser(username='curator', password='12345'))
+        response = self.client.post(self.url, {
+            "name": "Night at the Museum", "date": "2099-07-01T18:00:00Z", "description": "Late opening",
+            "museum": self.other.pk
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Event.objects.get(name="Night at the Museum").museum, self.museum)
+
+    def test_non_numeric_museum_is_not_found(self):
+        url = reverse('museum-events-list', kwargs={'museum_pk': 'abc'})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(User.objects.create_superuser(username='curator', password='12345'))
+        response = self.client.post(url, {"name": "Talk", "date": "2099-07-01T18:00:00Z", "description": ""}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class TransactionIdMigrationTests(TransactionTestCase):
+    before = [('darshan_doot', '0003_event_museum')]
+
+    def tearDown(self):
+        call_command('migrate', 'darshan_doot', verbosity=0)
+
+    def test_duplicate_and_blank_ids_cleared_before_constraint(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        OldMuseum, OldTicket = apps.get_model('darshan_doot', 'Museum'), apps.get_model('darshan_doot', 'Ticket')
+        museum = OldMuseum.objects.create(
+            name="Museum", location="Lucknow", indian_adult_fee=0, indian_child_fee=0, camera_fee=0,
+            international_citizen_fee=0, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+        ids = ['txn_1', 'txn_1', '', '', 'txn_2']
+        for transaction_id in ids:
+            OldTicket.objects.create(
+                user_phone="9999999999", user_email="visitor@example.com", museum=museum, visiting_date="2026-01-27",
+                adults=1, children=0, total_amount=0, payment_status='paid', nationality="Indian",
+                transaction_id=transaction_id,
+            )
+
+        call_command('migrate', 'darshan_doot', verbosity=0)
+        self.assertEqual(
+            sorted(Ticket.objects.values_list('transaction_id', flat=True), key=str),
+            [None, None, None, 'txn_1', 'txn_2'],
+        )
+
+class TicketQueryPlanTests(TestCase):
+    """
+    Seeds the Ticket table and fails if any hot lookup used by the views or
+    the admin is planned as a full table scan. Runs on 20k tickets by
+    default; set QUERY_PLAN_TICKETS=1000000 for a full-size check.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        count = int(os.getenv('QUERY_PLAN_TICKETS', 20000))
+        museums = [
+            Museum.objects.create(
+                name=f"Museum {index}", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+                camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+            )
+            for index in range(20)
+        ]
+        statuses = ['pending', 'paid', 'paid', 'paid', 'cancelled', 'refunded']
+        start = date(2026, 1, 1)
+        batch = []
+        for index in range(count):
+            payment_status = statuses[index % len(statuses)]
+            batch.append(Ticket(
+                user_phone=f"9{index % 100000:09d}",
+                user_email="visitor@example.com",
+                museum=museums[index % len(museums)],
+                visiting_date=start + timedelta(days=index % 365),
+                payment_status=payment_status,
+                adults=2,
+                children=1,
+                total_amount=50,
+                verification_code="ABC123" if payment_status == 'paid' else None,
+                transaction_id=f"txn_{index}" if payment_status != 'pending' else None,
+                nationality="Indian",
+            ))
+            if len(batch) == 5000:
+                Ticket.objects.bulk_create(batch)
+                batch = []
+        Ticket.objects.bulk_create(batch)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.museum = museums[3]
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertNotIn(f'SCAN {Ticket._meta.db_table}', plan, plan)
+
+    def test_hot_queries_use_indexes(self):
+        ticket_admin = admin.site._registry[Ticket]
+        hot_queries = {
+            'verify': Ticket.objects.filter(ticket_id=uuid.uuid4(), verification_code="ABC123"),
+            'payment_verify': Ticket.objects.filter(ticket_id=uuid.uuid4()),
+            'admin search by phone': ticket_admin.get_search_results(None, Ticket.objects.all(), "9000000042")[0],
+            'admin search by ticket': ticket_admin.get_search_results(None, Ticket.objects.all(), str(uuid.uuid4()))[0],
+            'transaction lookup': Ticket.objects.filter(transaction_id="txn_42"),
+            'admin status filter': Ticket.objects.filter(payment_status='pending'),
+            'admin museum + status filter': Ticket.objects.filter(museum=self.museum, payment_status='paid'),
+            'date hierarchy': Ticket.objects.filter(visiting_date__gte=date(2026, 3, 1), visiting_date__lt=date(2026, 4, 1)),
+            'museum day status': Ticket.objects.filter(
+                museum=self.museum, visiting_date=date(2026, 1, 27), payment_status='paid'
+            ),
+        }
+        for name, queryset in hot_queries.items():
+            with self.subTest(name):
+                self.assertUsesIndex(queryset.order_by())
+
+class GateVerificationTests(APITestCase):
+    def setUp(self):
+        self.museum, self.other = [
+            Museum.objects.create(
+                name=name, location="New Delhi", indian_adult_fee=20, indian_child_fee=10, camera_fee=0,
+                international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+            )
+            for name in ("National Museum India", "National Agricultural Science Museum")
+        ]
+        self.day = date(2026, 1, 27)
+        self.paid, self.pending = [
+            Ticket.objects.create(
+                user_phone="9999999999", user_email="visitor@example.com", museum=self.museum,
+                visiting_date=self.day, payment_status=payment_status, adults=2, children=1,
+                total_amount=50, nationality="Indian"
+            )
+            for payment_status in ('paid', 'pending')
+        ]
+        self.client.force_authenticate(User.objects.create_superuser(username='gate', password='12345'))
+
+    def snapshot(self):
+        url = reverse('gate_snapshot', kwargs={'museum_id': self.museum.pk})
+        response = self.client.get(url, {'date': self.day.isoformat()})
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        return GateSnapshot(response.content, gate_key(self.museum.pk))
+
+    def test_token_round_trip(self):
+        token = sign_ticket(self.paid)
+        self.assertLess(len(token), 64)
+        fields = read_token(token)
+        self.assertEqual(fields['ticket_id'], self.paid.ticket_id)
+        self.assertEqual((fields['museum_id'], fields['visiting_date']), (self.museum.pk, self.day))
+        self.assertEqual((fields['adults'], fields['children']), (2, 1))
+
+    def test_forged_token_rejected(self):
+        token = sign_ticket(self.paid)
+        forged = token[:20] + ('A' if token[20] != 'A' else 'B') + token[21:]
+        with self.assertRaises(BadSignature):
+            read_token(forged)
+        with self.assertRaises(BadSignature):
+            read_token(token, key=gate_key(self.other.pk))
+
+    def test_snapshot_admits_paid_tickets_once(self):
+        snapshot = self.snapshot()
+        self.assertEqual(len(snapshot), 1)
+        self.assertIsNotNone(snapshot.admit(sign_ticket(self.paid)))
+        self.assertIsNone(snapshot.admit(sign_ticket(self.paid)))
+        self.assertIsNone(snapshot.admit(sign_ticket(self.pending)))
+
+    def test_member_codes_admit_one_member_each(self):
+        token = sign_ticket(self.paid)
+        snapshot = self.snapshot()
+        self.assertEqual(snapshot.admit(member_code(token, 1))['member'], 1)
+        self.assertIsNone(snapshot.admit(member_code(token, 1)))
+        self.assertIsNone(snapshot.admit(member_code(token, 4)))
+        self.assertIsNone(snapshot.admit(token + '~x'))
+        # Once members started entering separately the group code is spent
+        self.assertIsNone(snapshot.admit(token))
+        self.assertIsNotNone(snapshot.admit(member_code(token, 3)))
+
+    def test_tampered_snapshot_rejected(self):
+        url = reverse('gate_snapshot', kwargs={'museum_id': self.museum.pk})
+        data = bytearray(self.client.get(url, {'date': self.day.isoformat()}).content)
+        data[-20] ^= 1
+        with self.assertRaises(BadSignature):
+            GateSnapshot(bytes(data), gate_key(self.museum.pk))
+
+    def test_checkins_sync_in_one_batch(self):
+        url = reverse('gate_checkins', kwargs={'museum_id': self.museum.pk})
+        ticket_ids = [str(self.paid.ticket_id), str(self.pending.ticket_id)]
+        response = self.client.post(url, {'ticket_ids': ticket_ids}, format='json')
+        self.assertEqual(response.data, {'checked_in': 1, 'rejected': 1})
+        self.paid.refresh_from_db()
+        self.assertIsNotNone(self.paid.checked_in_at)
+        # A used ticket drops out of the next snapshot and can't be synced twice
+        self.assertEqual(len(self.snapshot()), 0)
+        response = self.client.post(url, {'ticket_ids': ticket_ids[:1]}, format='json')
+        self.assertEqual(response.data['checked_in'], 0)
+
+    def test_checkins_reject_bad_timestamp(self):
+        url = reverse('gate_checkins', kwargs={'museum_id': self.museum.pk})
+        for checked_in_at in ('soon', '2026-13-45T10:00:00', 5):
+            response = self.client.post(
+                url, {'ticket_ids': [str(self.paid.ticket_id)], 'checked_in_at': checked_in_at}, format='json',
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, checked_in_at)
+        self.paid.refresh_from_db()
+        self.assertIsNone(self.paid.checked_in_at)
+
+    def test_gate_endpoints_are_staff_only(self):
+        self.client.force_authenticate(None)
+        url = reverse('gate_snapshot', kwargs={'museum_id': self.museum.pk})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test', STRIPE_WEBHOOK_WORKER='command')
+class StripeWebhookTests(APITestCase):
+    def setUp(self):
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+        self.day = date(2026, 1, 27)
+        DailyCapacity.objects.create(museum=self.museum, visiting_date=self.day, capacity=10, remaining=7)
+        self.ticket = Ticket.objects.create(
+            user_phone="9999999999", user_email="visitor@example.com", museum=self.museum,
+            visiting_date=self.day, payment_status='pending', adults=2, children=1,
+            total_amount=50, nationality="Indian"
+        )
+        self.url = reverse('stripe_webhook')
+
+    def deliver(self, event, secret='whsec_test'):
+        body, signature = signed_event(event, secret)
+        return self.client.post(self.url, body, content_type='application/json', HTTP_STRIPE_SIGNATURE=signature)
+
+    def test_redelivered_event_is_stored_once(self):
+        event = make_event('payment_intent.succeeded', self.ticket.ticket_id)
+        for _ in range(3):
+            self.assertEqual(self.deliver(event).status_code, status.HTTP_200_OK)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(process_pending_events(), 1)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.payment_status, 'paid')
+
+    def test_out_of_order_events_coalesce_to_final_status(self):
+        # The refund is delivered before the payment it reverses
+        self.deliver(make_event('charge.refunded', self.ticket.ticket_id, created=2000))
+        self.deliver(make_event('payment_intent.succeeded', self.ticket.ticket_id, created=1000))
+        self.assertEqual(process_pending_events(), 2)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.payment_status, 'refunded')
+        self.assertEqual(DailyCapacity.objects.get(museum=self.museum).remaining, 10)
+        # A late success can't move the refunded ticket back to paid
+        self.deliver(make_event('payment_intent.succeeded', self.ticket.ticket_id))
+        process_pending_events()
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.payment_status, 'refunded')
+
+    def test_payment_for_expired_ticket_is_flagged(self):
+        Ticket.objects.filter(pk=self.ticket.pk).update(booking_date=timezone.now() - timedelta(hours=2))
+        with self.settings(PENDING_TICKET_TTL_MINUTES=30):
+            self.assertEqual(expire_pending(), 1)
+        self.deliver(make_event('payment_intent.succeeded', self.ticket.ticket_id))
+        with self.assertLogs('darshan_doot.webhooks', 'ERROR') as logs:
+            self.assertEqual(process_pending_events(), 1)
+        self.assertIn(str(self.ticket.ticket_id), logs.output[0])
+
+    def test_unknown_ticket_is_acknowledged(self):
+        response = self.deliver(make_event('payment_intent.succeeded', uuid.uuid4()))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(process_pending_events(), 1)
+        self.assertFalse(StripeEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_failed_drain_is_logged_and_retried(self):
+        worker = WebhookWorker()
+        with patch('darshan_doot.webhooks.process_pending_events', side_effect=OperationalError('gone away')), \
+                patch('darshan_doot.webhooks.time.sleep') as sleep, patch.object(worker, 'wake') as wake, \
+                self.assertLogs('darshan_doot.webhooks', 'ERROR'):
+            worker._drain()
+            worker._drain()
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1, 2])
+        self.assertEqual(wake.call_count, 2)
+        # A drain that gets through resets the back-off
+        with patch('darshan_doot.webhooks.process_pending_events', return_value=0), patch.object(worker, 'wake') as wake:
+            worker._drain()
+        self.assertEqual((worker.failures, wake.call_count), (0, 0))
+
+    def test_bad_signature_rejected(self):
+        event = make_event('payment_intent.succeeded', self.ticket.ticket_id)
+        self.assertEqual(self.deliver(event, secret='whsec_other').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, json.dumps(event), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+
+
+class TicketStateTests(APITestCase):
+    def setUp(self):
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+        self.day = date(2026, 1, 27)
+        DailyCapacity.objects.create(museum=self.museum, visiting_date=self.day, capacity=10, remaining=7)
+        self.ticket = Ticket.objects.create(
+            user_phone="9999999999", user_email="visitor@example.com", museum=self.museum,
+            visiting_date=self.day, payment_status='pending', adults=2, children=1,
+            total_amount=50, nationality="Indian"
+        )
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='12345'))
+
+    def payment_verify(self, transaction_id):
+        url = reverse('payment_verify', kwargs={'ticket_id': self.ticket.ticket_id})
+        return self.client.post(url, {'transaction_id': transaction_id}, format='json')
+
+    def test_transition_is_one_conditional_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(transition(self.ticket.ticket_id, 'paid', transaction_id='txn_1'))
+        ticket_update = f'UPDATE "{Ticket._meta.db_table}"'
+        sql = queries[0]['sql']
+        self.assertTrue(sql.startswith(ticket_update))
+        self.assertNotIn('user_email', sql)
+        # The rest adjust the rollups for the rows the UPDATE moved
+        self.assertFalse(any(query['sql'].startswith(ticket_update) for query in queries[1:]))
+        # Already paid: the guard on the current status stops a second payment
+        self.assertFalse(transition(self.ticket.ticket_id, 'paid', transaction_id='txn_2'))
+        self.assertFalse(transition(self.ticket.ticket_id, 'cancelled'))
+        self.assertFalse(transition(uuid.uuid4(), 'paid'))
+
+    def test_payment_verify_retry_is_idempotent(self):
+        first = self.payment_verify('txn_1')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        retry = self.payment_verify('txn_1')
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data['verification_code'], first.data['verification_code'])
+        self.assertEqual(self.payment_verify('txn_2').status_code, status.HTTP_409_CONFLICT)
+
+    def test_payment_verify_completes_ticket_paid_by_webhook(self):
+        self.assertTrue(transition(self.ticket.ticket_id, 'paid'))
+        first = self.payment_verify('txn_1')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertTrue(first.data['verification_code'])
+        self.ticket.refresh_from_db()
+        self.assertEqual((self.ticket.transaction_id, self.ticket.verification_code), ('txn_1', first.data['verification_code']))
+        self.assertEqual(self.payment_verify('txn_1').data['verification_code'], first.data['verification_code'])
+        self.assertEqual(self.payment_verify('txn_2').status_code, status.HTTP_409_CONFLICT)
+
+    def test_payment_verify_after_refund_conflicts(self):
+        self.assertTrue(transition(self.ticket.ticket_id, 'refunded'))
+        self.assertEqual(self.payment_verify('txn_1').status_code, status.HTTP_409_CONFLICT)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.payment_status, 'refunded')
+        self.assertIsNone(self.ticket.transaction_id)
+
+    def test_visitor_cancellation_releases_seats_once(self):
+        url = reverse('ticket_detail', kwargs={'ticket_id': self.ticket.ticket_id})
+        response = self.client.put(url, {'payment_status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(DailyCapacity.objects.get(museum=self.museum).remaining, 10)
+        response = self.client.put(url, {'payment_status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        response = self.client.put(url, {'payment_status': 'paid'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.delete(url)
+        self.assertEqual(DailyCapacity.objects.get(museum=self.museum).remaining, 10)
+
+
+class DailySalesTests(APITestCase):
+    def setUp(self):
+        self.museum, self.other = [
+            Museum.objects.create(
+                name=name, location="New Delhi", indian_adult_fee=20, indian_child_fee=10, camera_fee=0,
+                international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+            )
+            for name in ("National Museum India", "National Agricultural Science Museum")
+        ]
+        self.day = date(2026, 1, 27)
+        self.tickets = [
+            Ticket.objects.create(
+                user_phone="9999999999", user_email="visitor@example.com", museum=museum,
+                visiting_date=self.day + timedelta(days=offset), payment_status='pending', adults=2, children=index,
+                total_amount=40 + 10 * index, nationality="Indian"
+            )
+            for index, (museum, offset) in enumerate([
+                (self.museum, 0), (self.museum, 0), (self.museum, 1), (self.other, 0), (self.other, 0),
+            ])
+        ]
+
+    def rollups(self):
+        return sorted(DailySales.objects.filter(tickets__gt=0).values_list(
+            'museum_id', 'visiting_date', 'payment_status', 'tickets', 'persons', 'revenue'
+        ))
+
+    def test_rollups_follow_ticket_changes(self):
+        transition(self.tickets[0].ticket_id, 'paid', transaction_id='txn_0')
+        transition(self.tickets[1].ticket_id, 'paid', transaction_id='txn_1')
+        transition(self.tickets[1].ticket_id, 'refunded')
+        transition(self.tickets[3].ticket_id, 'cancelled')
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='12345'))
+        self.client.delete(reverse('ticket_detail', kwargs={'ticket_id': self.tickets[4].ticket_id}))
+        incremental = self.rollups()
+        self.assertIn((self.museum.pk, self.day, 'paid', 1, 2, 40), incremental)
+        # Rebuilding from the tickets gives the same totals
+        call_command('backfill_sales', stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_backfill_limits_to_museum_and_dates(self):
+        DailySales.objects.all().delete()
+        self.assertEqual(rebuild_sales(museum_id=self.museum.pk, start=self.day, end=self.day), 1)
+        self.assertEqual(self.rollups(), [(self.museum.pk, self.day, 'pending', 2, 5, 90)])
+
+    def test_backfill_aggregates_inside_its_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            rebuild_sales(museum_id=self.museum.pk)
+        statements = [query['sql'] for query in queries.captured_queries]
+        opened = next(index for index, sql in enumerate(statements) if sql.startswith('SAVEPOINT'))
+        aggregated = next(index for index, sql in enumerate(statements) if 'FROM "darshan_doot_ticket"' in sql)
+        self.assertLess(opened, aggregated)
+
+    def test_admin_summary_is_one_query(self):
+        ticket_admin = admin.site._registry[Ticket]
+        request = RequestFactory().get('/', {'museum__id__exact': self.museum.pk, 'visiting_date__year': 2026})
+        with self.assertNumQueries(1):
+            summary = ticket_admin.sales_summary(request, Ticket.objects.all())
+        self.assertEqual(summary, {'total_sales': 150, 'total_tickets': 3, 'total_persons': 9})
+        # A search can't be answered from the rollups but is still one query
+        request = RequestFactory().get('/', {'q': '9999999999'})
+        with self.assertNumQueries(1):
+            summary = ticket_admin.sales_summary(request, Ticket.objects.all())
+        self.assertEqual(summary['total_tickets'], 5)
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.museum, self.other = [
+            Museum.objects.create(
+                name=name, location="New Delhi", indian_adult_fee=20, indian_child_fee=10, camera_fee=0,
+                international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+            )
+            for name in ("National Museum India", "National Agricultural Science Museum")
+        ]
+        self.day = date(2026, 1, 27)
+        Ticket.objects.bulk_create(
+            Ticket(
+                user_phone="9999999999", user_email="visitor@example.com", museum=museum,
+                visiting_date=self.day + timedelta(days=index % 4), payment_status='paid', adults=2, children=1,
+                total_amount=50, nationality="Indian"
+            )
+            for index in range(25)
+            for museum in (self.museum, self.other)
+        )
+        rebuild_sales()
+        self.client.force_authenticate(User.objects.create_superuser(username='analyst', password='12345'))
+
+    def test_keyset_batches_cover_every_row_once(self):
+        rows = list(export_rows('tickets', museum_id=self.museum.pk, batch_size=7))
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(len({row[0] for row in rows}), 25)
+        self.assertEqual([row[2] for row in rows], sorted(row[2] for row in rows))
+        # One query per batch, whatever the total
+        with self.assertNumQueries(4):
+            self.assertEqual(len(list(export_rows('tickets', museum_id=self.museum.pk, batch_size=7))), 25)
+
+    def test_one_museum_is_exported_in_index_order(self):
+        for dataset in ('tickets', 'archived-tickets'):
+            plan = export_queryset(dataset, museum_id=self.museum.pk, start=self.day).explain()
+            self.assertNotIn('ORDER BY', plan, plan)
+
+    def test_streamed_csv_filtered_by_date(self):
+        url = reverse('export', kwargs={'dataset': 'tickets'})
+        response = self.client.get(url, {'museum': self.museum.pk, 'from': '2026-01-28', 'to': '2026-01-29'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['ticket_id', 'museum_id', 'visiting_date'])
+        self.assertEqual(len(lines) - 1, 12)
+        self.assertTrue(all(',2026-01-28,' in line or ',2026-01-29,' in line for line in lines[1:]))
+
+    def test_gzipped_ndjson_sales(self):
+        url = reverse('export', kwargs={'dataset': 'sales'})
+        response = self.client.get(url, {'output': 'ndjson'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(sum(row['tickets'] for row in rows), 50)
+        self.assertEqual(rows[0]['visiting_date'], '2026-01-27')
+
+    def test_gzip_follows_q_values(self):
+        for header, expected in [
+            ('gzip, deflate', True), ('gzip;q=0', False), ('deflate, gzip; q=0.0', False), ('gzip;q=0.5', True),
+            ('*', True), ('*;q=0.1, gzip;q=0', False), ('br', False), ('', False), ('gzip;q=bad', False),
+        ]:
+            self.assertEqual(accepts_gzip(header), expected, header)
+        url = reverse('export', kwargs={'dataset': 'sales'})
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='identity, gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_command_writes_gzip_file(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'tickets.csv.gz')
+        call_command('export_tickets', output=path, gzip=True, batch_size=10, stderr=StringIO())
+        with gzip.open(path, 'rt') as export:
+            self.assertEqual(len(export.read().splitlines()), 51)
+
+    def test_export_is_staff_only(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(reverse('export', kwargs={'dataset': 'tickets'}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class MuseumLoaderTests(APITestCase):
+    csv_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'museum.csv')
+
+    def load(self, text):
+        return load_museums(read_csv(StringIO(text)))
+
+    def test_loads_repository_catalogue(self):
+        out = StringIO()
+        call_command('load_museums', self.csv_path, stdout=out, stderr=StringIO())
+        self.assertIn('14 created, 0 updated, 0 unchanged, 0 invalid', out.getvalue())
+        museum = Museum.objects.get(name="National Museum India")
+        self.assertEqual((museum.indian_adult_fee, museum.international_citizen_fee), (20, 500))
+        self.assertEqual(museum.timings, "10:00 AM – 6:00 PM")
+
+    def test_unchanged_reload_writes_nothing(self):
+        call_command('load_museums', self.csv_path, stdout=StringIO(), stderr=StringIO())
+        with CaptureQueriesContext(connection) as queries:
+            call_command('load_museums', self.csv_path, stdout=StringIO(), stderr=StringIO())
+        statements = [query['sql'].split()[0].upper() for query in queries]
+        self.assertEqual(statements.count('SELECT'), 1)
+        self.assertFalse({'INSERT', 'UPDATE', 'DELETE'} & set(statements))
+
+    def test_upsert_normalizes_and_reports_invalid_rows(self):
+        self.load('1,"National Museum India","Janpath, New Delhi",20,0,1,0,500,"10:00 AM – 6:00 PM",NA\n')
+        counts, errors = self.load(
+            'name,location,indian_adult_fee,indian_child_fee,free_for_students,camera_fee,international_citizen_fee,timings,closed_on\n'
+            '" National  Museum India","Janpath, New Delhi",25,0,yes,0,500,"10 am - 6 pm",n/a\n'
+            'Salar Jung Museum,Hyderabad,20,10,0,50,500,"10:00 AM to 5:00 PM",Friday\n'
+            'Broken Museum,Nowhere,twenty,0,0,0,0,"10:00 AM – 5:00 PM",NA\n'
+            'Night Museum,Nowhere,0,0,0,0,0,"6:00 PM – 9:00 AM",NA\n'
+        )
+        self.assertEqual(counts, {'created': 1, 'updated': 1, 'unchanged': 0})
+        self.assertEqual([line for line, _ in errors], [4, 5])
+        museum = Museum.objects.get(name="National Museum India")
+        self.assertEqual(museum.indian_adult_fee, 25)
+        self.assertEqual((museum.timings, museum.closed_on), ("10:00 AM – 6:00 PM", "NA"))
+        self.assertEqual(Museum.objects.count(), 2)
+
+
+class QuoteTests(APITestCase):
+    def setUp(self):
+        reset_throttles()
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            free_for_students=True, camera_fee=50, international_citizen_fee=500,
+            timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+        self.other = Museum.objects.create(
+            name="Salar Jung Museum", location="Hyderabad", indian_adult_fee=30, indian_child_fee=15,
+            camera_fee=0, international_citizen_fee=300, timings="10:00 AM – 5:00 PM", closed_on="Friday"
+        )
+
+    def quote(self, quotes):
+        return self.client.post(reverse('quote'), {'quotes': quotes}, format='json')
+
+    def test_prices_an_itinerary_in_one_query(self):
+        itinerary = [
+            {'museum': self.museum.pk, 'adults': 2, 'children': 1, 'nationality': 'Indian',
+             'cameras': 1, 'students': 1, 'visiting_date': '2026-01-26'},
+            {'museum': self.other.pk, 'adults': 1, 'children': 1, 'nationality': 'French',
+             'visiting_date': '2026-01-27'},
+            {'museum': 999999, 'adults': 1, 'children': 0, 'nationality': 'Indian'},
+            {'museum': self.other.pk, 'adults': 0, 'children': 0, 'nationality': 'Indian'},
+        ]
+        with self.assertNumQueries(1):
+            response = self.quote(itinerary)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first, second, missing, empty = response.data['results']
+        # 2 x 20 + 10 - 20 for the student + 50 for the camera
+        self.assertEqual((first['total'], first['student_discount'], first['open']), (80, 20, False))
+        self.assertEqual((second['total'], second['open']), (600, True))
+        self.assertEqual((missing['status'], empty['status']), (404, 400))
+        self.assertEqual(response.data['total'], 680)
+        self.assertEqual(Ticket.objects.count(), 0)
+
+    def test_booking_charges_camera_and_students(self):
+        self.client.force_authenticate(User.objects.create_superuser(username='admin', password='12345'))
+        response = self.client.post(reverse('create_ticket'), {
+            'user_phone': '9999999999', 'user_email': 'visitor@example.com', 'adults': 2, 'children': 0,
+            'visiting_date': '2026-01-27', 'museum': self.museum.pk, 'nationality': 'Indian',
+            'cameras': 1, 'students': 2,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_amount'], 50)
+
+    def test_nationality_must_be_text(self):
+        response = self.quote([
+            {'museum': self.museum.pk, 'adults': 1, 'children': 0, 'nationality': 5},
+            {'museum': self.museum.pk, 'adults': 1, 'children': 0, 'nationality': 'India'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        invalid, india = response.data['results']
+        self.assertEqual(invalid['status'], 400)
+        # Only the exact 'Indian' the bot sends gets the resident price, as before
+        self.assertEqual(india['total'], 500)
+
+    def test_party_must_fit_gate_token(self):
+        response = self.quote([
+            {'museum': self.museum.pk, 'adults': 300, 'children': 0, 'nationality': 'Indian'},
+            {'museum': self.museum.pk, 'adults': 1, 'children': 0, 'nationality': 'Indian', 'visiting_date': '1999-12-31'},
+            {'museum': self.museum.pk, 'adults': 255, 'children': 255, 'nationality': 'Indian'},
+        ])
+        self.assertEqual([result.get('status') for result in response.data['results']], [400, 400, None])
+
+
+class TicketReaperTests(APITestCase):
+    def setUp(self):
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+        self.today = timezone.localdate()
+        self.upcoming = self.today + timedelta(days=7)
+        DailyCapacity.objects.create(museum=self.museum, visiting_date=self.upcoming, capacity=100, remaining=100)
+
+    def ticket(self, payment_status='pending', visiting_date=None, booked_minutes_ago=0):
+        visiting_date = visiting_date or self.upcoming
+        ticket = Ticket.objects.create(
+            user_phone="9999999999", user_email="visitor@example.com", museum=self.museum,
+            visiting_date=visiting_date, payment_status=payment_status, adults=2, children=1,
+            total_amount=50, nationality="Indian"
+        )
+        if visiting_date == self.upcoming:
+            reserve_seats(self.museum.pk, visiting_date, 3)
+        Ticket.objects.filter(pk=ticket.pk).update(
+            booking_date=timezone.now() - timedelta(minutes=booked_minutes_ago)
+        )
+        return ticket
+
+    def test_expires_stale_pending_tickets_in_batches(self):
+        stale = [self.ticket(booked_minutes_ago=60 + index) for index in range(5)]
+        fresh = self.ticket(booked_minutes_ago=5)
+        paid = self.ticket(payment_status='paid', booked_minutes_ago=120)
+        with self.settings(PENDING_TICKET_TTL_MINUTES=30):
+            self.assertEqual(expire_pending(batch_size=2), 5)
+        self.assertEqual(set(Ticket.objects.values_list('pk', flat=True)), {fresh.pk, paid.pk})
+        archived = TicketArchive.objects.filter(pk__in=[ticket.pk for ticket in stale])
+        self.assertEqual(set(archived.values_list('payment_status', flat=True)), {'expired'})
+        self.assertEqual(DailyCapacity.objects.get(museum=self.museum).remaining, 94)
+        pending = DailySales.objects.get(museum=self.museum, visiting_date=self.upcoming, payment_status='pending')
+        self.assertEqual(pending.tickets, 1)
+
+    def test_cancels_intents_and_keeps_tickets_paid_meanwhile(self):
+        unpaid, paid_meanwhile, cancelled_before, without_intent = [
+            self.ticket(booked_minutes_ago=60) for _ in range(4)
+        ]
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        with StubStripe() as stub, self.settings(
+            STRIPE_SECRET_KEY='sk_test_stub', STRIPE_API_BASE=stub.api_base, PENDING_TICKET_TTL_MINUTES=30,
+        ):
+            intents = {}
+            for ticket in (unpaid, paid_meanwhile, cancelled_before):
+                intents[ticket.pk] = get_gateway().create_intent(ticket).id
+                Ticket.objects.filter(pk=ticket.pk).update(stripe_payment_intent_id=intents[ticket.pk])
+            stub.intents[f'ticket-{paid_meanwhile.ticket_id}']['status'] = 'succeeded'
+            # Cancelled by an earlier run whose idempotency key has since expired
+            stub.intents[f'ticket-{cancelled_before.ticket_id}']['status'] = 'canceled'
+            self.assertEqual(expire_pending(batch_size=2), 3)
+            statuses = {intent['id']: intent['status'] for intent in stub.intents.values()}
+        self.assertEqual(statuses[intents[unpaid.pk]], 'canceled')
+        # Left for the webhook, which will mark it paid
+        self.assertEqual(list(Ticket.objects.values_list('pk', flat=True)), [paid_meanwhile.pk])
+
+    def test_archives_past_visits_and_keeps_their_sales(self):
+        past = self.ticket(payment_status='paid', visiting_date=self.today - timedelta(days=3))
+        recent = self.ticket(payment_status='paid', visiting_date=self.today - timedelta(days=1))
+        with self.settings(TICKET_ARCHIVE_AFTER_DAYS=1):
+            call_command('reap_tickets', '--skip-expire', stdout=StringIO())
+        self.assertFalse(Ticket.objects.filter(pk=past.pk).exists())
+        self.assertTrue(Ticket.objects.filter(pk=recent.pk).exists())
+        self.assertEqual(TicketArchive.objects.get().payment_status, 'paid')
+        before = sorted(DailySales.objects.values_list('visiting_date', 'payment_status', 'tickets'))
+        rebuild_sales()
+        self.assertEqual(sorted(DailySales.objects.values_list('visiting_date', 'payment_status', 'tickets')), before)
+
+
+@override_settings(TICKET_RENDER_WORKERS=0)
+class AsyncBookingTests(TransactionTestCase):
+    def setUp(self):
+        reset_throttles()
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+        User.objects.create_superuser(username='bot', password='12345')
+        self.auth = 'Basic ' + base64.b64encode(b'bot:12345').decode()
+        self.booking = {
+            "user_phone": "9999999999", "user_email": "visitor@example.com", "adults": 2, "children": 1,
+            "visiting_date": "2026-01-27", "museum": self.museum.id, "nationality": "Indian"
+        }
+
+    async def post(self, name, data, **kwargs):
+        return await self.async_client.post(
+            reverse(name, kwargs=kwargs), json.dumps(data), content_type='application/json',
+            headers={'Authorization': self.auth},
+        )
+
+    async def test_book_and_pay_asynchronously(self):
+        response = await self.post('async_create_ticket', self.booking)
+        self.assertEqual(response.status_code, 201)
+        ticket_id = response.json()['ticket_id']
+        self.assertEqual(response.json()['total_amount'], 50)
+
+        response = await self.post('async_payment_verify', {'transaction_id': 'txn_1'}, ticket_id=ticket_id)
+        self.assertEqual(response.status_code, 200)
+        paid = response.json()
+        self.assertEqual(paid['payment_status'], 'paid')
+        self.assertEqual(read_token(paid['gate_token'])['ticket_id'], uuid.UUID(ticket_id))
+
+        response = await self.post(
+            'async_verify_ticket', {'verification_code': paid['verification_code']}, ticket_id=ticket_id,
+        )
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(reverse('async_payment', kwargs={'ticket_id': ticket_id}))
+        self.assertContains(response, "National Museum India")
+
+    async def test_sold_out_and_missing_tickets(self):
+        await DailyCapacity.objects.acreate(museum=self.museum, visiting_date=date(2026, 1, 27), capacity=2, remaining=2)
+        response = await self.post('async_create_ticket', self.booking)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(await Ticket.objects.acount(), 0)
+        response = await self.post('async_payment_verify', {'transaction_id': 'txn_1'}, ticket_id=uuid.uuid4())
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse('async_payment', kwargs={'ticket_id': uuid.uuid4()}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_verify_needs_a_code(self):
+        response = await self.post('async_create_ticket', self.booking)
+        ticket_id = response.json()['ticket_id']
+        for body in ({}, {'verification_code': ''}, {'verification_code': None}, {'verification_code': 5}):
+            response = await self.post('async_verify_ticket', body, ticket_id=ticket_id)
+            self.assertEqual(response.status_code, 400, body)
+
+    async def test_stripe_calls_keep_off_the_database_pool(self):
+        threads = []
+
+        def request_intent(ticket):
+            threads.append(threading.current_thread().name)
+
+        with patch('darshan_doot.async_views.request_intent', request_intent):
+            response = await self.post('async_create_ticket', self.booking)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(threads[0].startswith('darshan-doot-http'), threads)
+
+    async def test_requires_add_ticket_permission(self):
+        self.auth = 'Basic ' + base64.b64encode(b'bot:wrong').decode()
+        response = await self.post('async_create_ticket', self.booking)
+        self.assertEqual(response.status_code, 403)
+
+
+class PaymentGatewayTests(APITestCase):
+    def setUp(self):
+        reset_throttles()
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+        self.client.force_authenticate(User.objects.create_superuser(username='bot', password='12345'))
+        self.ticket_data = {
+            "user_phone": "9999999999", "user_email": "visitor@example.com", "adults": 2, "children": 1,
+            "visiting_date": "2026-01-27", "museum": self.museum.id, "nationality": "Indian",
+        }
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+
+    def stripe_settings(self, stub, **overrides):
+        return override_settings(
+            STRIPE_SECRET_KEY='sk_test_stub', STRIPE_API_BASE=stub.api_base,
+            **{'STRIPE_TIMEOUT': 2, 'STRIPE_BREAKER_THRESHOLD': 3, **overrides},
+        )
+
+    def test_booking_creates_payment_intent_for_ticket(self):
+        with StubStripe() as stub, self.stripe_settings(stub):
+            response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            ticket = Ticket.objects.get()
+            intent = get_gateway().create_intent(ticket)
+            self.assertEqual(stub.requests, 2)
+            # Both calls went over one pooled connection
+            self.assertEqual(len(stub.connections), 1)
+        # The retry got the same intent back, carrying the ticket id for webhooks
+        self.assertEqual(ticket.stripe_payment_intent_id, intent.id)
+        self.assertTrue(intent.id.startswith('pi_'))
+        self.assertEqual(response.data['payment_intent_id'], intent.id)
+        self.assertEqual(response.data['client_secret'], intent.client_secret)
+        # Clients still get the payment page to send the visitor
+        self.assertEqual(response.data['stripe_payment_intent'], f"/payment/{ticket.ticket_id}/")
+        self.assertEqual(response.data['payment_url'], f"/payment/{ticket.ticket_id}/")
+        self.assertEqual(intent.metadata['ticket_id'], str(ticket.ticket_id))
+        self.assertEqual(intent.amount, 5000)
+
+    def test_breaker_stops_calling_failing_stripe(self):
+        with StubStripe(fail_with=500) as stub, self.stripe_settings(stub):
+            for _ in range(5):
+                response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+                # Bookings still go through with the payment page as fallback
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                self.assertNotIn('client_secret', response.data)
+            self.assertEqual(stub.requests, 3)
+            self.assertTrue(get_gateway().breaker.is_open)
+        ticket = Ticket.objects.first()
+        self.assertEqual(ticket.stripe_payment_intent_id, f"/payment/{ticket.ticket_id}/")
+
+    def test_slow_stripe_times_out(self):
+        ticket = Ticket(
+            ticket_id=uuid.uuid4(), museum=self.museum, visiting_date=date(2026, 1, 27), total_amount=50,
+        )
+        with StubStripe(latency=1) as stub, self.stripe_settings(stub, STRIPE_TIMEOUT=0.1):
+            started = timezone.now()
+            with self.assertRaises(PaymentGatewayUnavailable):
+                get_gateway().create_intent(ticket)
+            self.assertLess(timezone.now() - started, timedelta(seconds=1))
+
+    def test_breaker_half_opens_after_reset(self):
+        now = [0]
+        breaker = CircuitBreaker(threshold=2, reset_after=30, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        now[0] = 31
+        # One trial call at a time; its failure reopens the breaker
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        now[0] = 62
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.is_open)
+
+
+class ThrottleTests(APITestCase):
+    def setUp(self):
+        reset_throttles()
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+        self.client.force_authenticate(User.objects.create_superuser(username='bot', password='12345'))
+        self.ticket_data = {
+            "user_phone": "9999999999", "user_email": "visitor@example.com", "adults": 1, "children": 0,
+            "visiting_date": "2026-01-27", "museum": self.museum.id, "nationality": "Indian",
+        }
+
+    @override_settings(THROTTLE_RATES={'booking_phone': '2/day'})
+    def test_booking_limit_per_phone(self):
+        for _ in range(2):
+            response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # The same number written differently is the same phone
+        self.ticket_data['user_phone'] = '+91 99999 99999'
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(int(response['Retry-After']), 43200)
+        self.ticket_data['user_phone'] = '8888888888'
+        response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Ticket.objects.count(), 3)
+
+    @override_settings(THROTTLE_RATES={'booking_phone': '2/day', 'booking_ip': '2/day'})
+    def test_bulk_bookings_count_against_each_phone(self):
+        response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        other = {**self.ticket_data, 'user_phone': '8888888888'}
+        response = self.client.post(
+            reverse('bulk_create_ticket'), [self.ticket_data, self.ticket_data, other], format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [result.get('status') for result in response.data['results']],
+            [None, status.HTTP_429_TOO_MANY_REQUESTS, None],
+        )
+        self.assertEqual(Ticket.objects.filter(user_phone='9999999999').count(), 2)
+        # The batch took one of the client IP's tokens, however many it held
+        response = self.client.post(reverse('bulk_create_ticket'), [other], format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_client_ip_ignores_forwarded_for_without_proxies(self):
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='10.0.0.1, 10.0.0.2', REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(client_ip(request), '10.0.0.3')
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            self.assertEqual(client_ip(request), '10.0.0.2')
+        # Unset, DRF would take the whole header as the address
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': None}):
+            self.assertEqual(client_ip(request), '10.0.0.3')
+
+    @override_settings(THROTTLE_RATES={'verify_ticket': '3/hour'})
+    def test_verification_attempts_per_ticket(self):
+        ticket, other = [
+            Ticket.objects.create(
+                user_phone="9999999999", user_email="visitor@example.com", museum=self.museum,
+                visiting_date=date(2026, 1, 27), payment_status='paid', adults=1, children=0,
+                total_amount=20, nationality="Indian", verification_code=code,
+            )
+            for code in ('ABC123', 'XYZ789')
+        ]
+        for guess in ('AAAAAA', 'BBBBBB', 'CCCCCC'):
+            response = self.client.post(
+                reverse('verify_ticket', args=[ticket.ticket_id]), {'verification_code': guess}, format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        # Out of attempts: even the right code is refused, for this ticket only
+        response = self.client.post(
+            reverse('verify_ticket', args=[ticket.ticket_id]), {'verification_code': 'ABC123'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.post(
+            reverse('verify_ticket', args=[other.ticket_id]), {'verification_code': 'XYZ789'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_pending_ticket_needs_a_code(self):
+        ticket = Ticket.objects.create(
+            user_phone="9999999999", user_email="visitor@example.com", museum=self.museum,
+            visiting_date=date(2026, 1, 27), payment_status='pending', adults=1, children=0,
+            total_amount=20, nationality="Indian",
+        )
+        url = reverse('verify_ticket', args=[ticket.ticket_id])
+        for body in ({}, {'verification_code': ''}, {'verification_code': None}):
+            response = self.client.post(url, body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_rates_read_like_drf(self):
+        self.assertEqual(parse_rate('120/minute'), (120, 2.0))
+        self.assertEqual(parse_rate('120/min'), parse_rate('120/m'))
+        self.assertEqual(parse_rate('5/hour'), (5, 5 / 3600))
+        with self.assertRaises(ImproperlyConfigured):
+            parse_rate('5/fortnight')
+        # A bad rate is reported at startup
+        with override_settings(THROTTLE_RATES={'booking_ip': 'many/min'}):
+            self.assertEqual([error.id for error in check_rates()], ['darshan_doot.E001'])
+        self.assertEqual(check_rates(), [])
+
+    def test_bucket_refills_over_time(self):
+        store = LocalBucketStore(shards=2, shard_size=2)
+        # Two tokens, refilled at one a second
+        self.assertEqual(store.take('a', 2, 1, now=0), 0)
+        self.assertEqual(store.take('a', 2, 1, now=0), 0)
+        self.assertEqual(store.take('a', 2, 1, now=0.25), 0.75)
+        self.assertEqual(store.take('a', 2, 1, now=1), 0)
+        self.assertEqual(store.take('a', 2, 1, now=1), 1)
+        # Idle buckets beyond the shard size are dropped and come back full
+        for key in ('b', 'c', 'd', 'e'):
+            store.take(key, 2, 1, now=1)
+        self.assertLessEqual(sum(len(buckets) for buckets, _ in store.shards), 4)
+
+
+class TicketQRTests(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(TICKET_ARTIFACT_DIR=directory.name, TICKET_RENDER_WORKERS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.directory = directory.name
+        reset_throttles()
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+        self.ticket = Ticket.objects.create(
+            user_phone="9999999999", user_email="visitor@example.com", museum=self.museum,
+            visiting_date=date(2026, 1, 27), payment_status='pending', adults=2, children=1,
+            total_amount=50, nationality="Indian"
+        )
+        self.client.force_authenticate(User.objects.create_superuser(username='bot', password='12345'))
+
+    def rendered_files(self):
+        return sum(len(files) for _, _, files in os.walk(self.directory))
+
+    def test_paid_ticket_serves_group_and_member_codes(self):
+        response = self.client.post(
+            reverse('payment_verify', args=[self.ticket.ticket_id]), {'transaction_id': 'txn_1'}, format='json'
+        )
+        code = urlencode({'code': response.data['verification_code']})
+        self.assertEqual(response.data['qr_code'], f"{reverse('ticket_qr', args=[self.ticket.ticket_id])}?{code}")
+        self.assertEqual(len(response.data['member_qr_codes']), 3)
+
+        self.client.force_authenticate(None)
+        with patch('darshan_doot.artifacts.render_png', wraps=artifacts.render_png) as render:
+            for url in [response.data['qr_code']] + response.data['member_qr_codes']:
+                download = self.client.get(url)
+                self.assertEqual(download.status_code, status.HTTP_200_OK)
+                self.assertEqual(download['Content-Type'], 'image/png')
+                self.assertTrue(b''.join(download.streaming_content).startswith(b'\x89PNG'))
+            self.assertEqual(render.call_count, 4)
+            # Downloading again, or resending, reads the cached file
+            again = self.client.get(response.data['qr_code'])
+            self.assertEqual(render.call_count, 4)
+        self.assertIn('immutable', again['Cache-Control'])
+        cached = self.client.get(response.data['qr_code'], HTTP_IF_NONE_MATCH=again['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(
+            self.client.get(reverse('ticket_member_qr', args=[self.ticket.ticket_id, 4])).status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    def test_anonymous_download_needs_the_verification_code(self):
+        Ticket.objects.filter(pk=self.ticket.pk).update(payment_status='paid', verification_code='ABC123')
+        url = reverse('ticket_qr', args=[self.ticket.ticket_id])
+        # Staff may download without it
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(url, {'code': 'ZZZ999'}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(url, {'code': 'ABC123'}).status_code, status.HTTP_200_OK)
+        # Guesses are limited per ticket, whoever makes them
+        with self.settings(THROTTLE_RATES={**settings.THROTTLE_RATES, 'qr_ticket': '3/hour'}):
+            reset_throttles()
+            for _ in range(3):
+                self.client.get(url, {'code': 'ZZZ999'})
+            self.assertEqual(
+                self.client.get(url, {'code': 'ABC123'}).status_code, status.HTTP_429_TOO_MANY_REQUESTS
+            )
+
+    def test_unpaid_ticket_has_no_code(self):
+        response = self.client.get(reverse('ticket_qr', args=[self.ticket.ticket_id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.rendered_files(), 0)
+
+    def test_render_command_prerenders_in_parallel(self):
+        Ticket.objects.filter(pk=self.ticket.pk).update(payment_status='paid')
+        out = StringIO()
+        call_command('render_tickets', date='2026-01-27', workers=2, chunk_size=2, stdout=out)
+        self.assertIn('Rendered 4 QR codes for 1 paid tickets', out.getvalue())
+        self.assertEqual(self.rendered_files(), len(ticket_codes(self.ticket)))
+        out = StringIO()
+        call_command('render_tickets', date='2026-01-27', stdout=out)
+        self.assertIn('Rendered 0 QR codes', out.getvalue())
+
+
+class PaymentPageTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+        self.ticket = Ticket.objects.create(
+            user_phone="9999999999", user_email="visitor@example.com", museum=self.museum,
+            visiting_date=date(2026, 1, 27), payment_status='pending', adults=2, children=1,
+            total_amount=50, nationality="Indian"
+        )
+        self.url = reverse('payment', args=[self.ticket.ticket_id])
+
+    def test_page_is_one_query_and_rendered_once(self):
+        with patch('darshan_doot.pages.render_to_string', wraps=pages.render_to_string) as render:
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertContains(response, "National Museum India")
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(self.url).content, response.content)
+            self.assertEqual(render.call_count, 1)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        # Reloads with the validators get an empty 304
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        cached = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_status_change_invalidates_page(self):
+        status_url = reverse('payment_status', args=[self.ticket.ticket_id])
+        response = self.client.get(self.url)
+        # A pending page polls for its status
+        self.assertContains(response, status_url)
+        self.assertTrue(transition(self.ticket.ticket_id, 'paid'))
+        fresh = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(fresh['ETag'], response['ETag'])
+
+    def test_status_endpoint(self):
+        url = reverse('payment_status', args=[self.ticket.ticket_id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json(), {'ticket_id': str(self.ticket.ticket_id), 'payment_status': 'pending'})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        transition(self.ticket.ticket_id, 'paid')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.json()['payment_status'], 'paid')
+
+    def test_missing_ticket(self):
+        missing = uuid.uuid4()
+        for url in (reverse('payment', args=[missing]), reverse('payment_status', args=[missing])):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(response.json(), {'error': 'Ticket not found.'})
+
+
+class ReplicaRouterTests(APITestCase):
+    """
+    A second SQLite database stands in for a replica that hasn't caught up:
+    rows written to the primary are missing from it.
+    """
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings['replica'] = connections.configure_settings({
+            'default': {},
+            'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.directory.name, 'replica.sqlite3')},
+        })['replica']
+        call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.directory.cleanup()
+
+    def setUp(self):
+        reset_throttles()
+        get_cache().clear()
+        override = override_settings(DATABASE_REPLICAS=['replica'])
+        override.enable()
+        self.addCleanup(override.disable)
+
+        fields = dict(
+            location="New Delhi", indian_adult_fee=20, indian_child_fee=10, camera_fee=0,
+            international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday",
+        )
+        self.museum = Museum.objects.create(name="National Museum India", **fields)
+        Museum.objects.using('replica').create(pk=self.museum.pk, name="Replica Copy", **fields)
+        self.client.force_authenticate(User.objects.create_superuser(username='bot', password='12345'))
+        self.ticket_data = {
+            "user_phone": "9999999999", "user_email": "visitor@example.com", "adults": 1, "children": 0,
+            "visiting_date": "2026-01-27", "museum": self.museum.id, "nationality": "Indian",
+        }
+
+    def test_catalogue_reads_from_replica(self):
+        response = self.client.get(reverse('museum-detail', args=[self.museum.pk]))
+        self.assertEqual(response.json()['name'], "Replica Copy")
+        with replica_reads():
+            self.assertEqual(Museum.objects.get().name, "Replica Copy")
+            # A write pins the rest of the block to the primary
+            Museum.objects.filter(pk=self.museum.pk).update(closed_on="NA")
+            self.assertEqual(Museum.objects.get().name, "National Museum India")
+        # Bookings read and write on the primary
+        response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+        self.assertEqual(response.data['museum_name'], "National Museum India")
+
+    def test_catalogue_caches_are_filled_from_the_primary(self):
+        reset_index()
+        self.addCleanup(reset_index)
+        # The save moves the catalogue version before the replica has it
+        self.museum.closed_on = "Tuesday"
+        self.museum.save()
+        self.client.force_authenticate(None)
+        response = self.client.get(reverse('museum-list'))
+        self.assertEqual([museum['name'] for museum in response.json()['results']], ["National Museum India"])
+        with replica_reads():
+            self.assertEqual(search_museums('national'), [self.museum.pk])
+            self.assertEqual(search_museums('replica'), [])
+            museum = Museum.objects.get(pk=self.museum.pk)
+            self.assertEqual(museum.closed_on, "Monday")
+            self.assertFalse(get_calendar(museum).is_open(date(2026, 1, 27)))
+
+    def test_client_reads_its_own_writes(self):
+        response = self.client.post(reverse('create_ticket'), self.ticket_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('db_primary', response.cookies)
+        url = reverse('payment', args=[response.data['ticket_id']])
+        # The booking client is pinned to the primary and sees its ticket...
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        # ...and so does the visitor it sent the link to, without the cookie:
+        # the replica doesn't have the ticket yet, so the primary is asked
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_payment_views_read_past_a_lagging_replica(self):
+        fields = dict(
+            user_phone="9999999999", user_email="visitor@example.com", visiting_date=date(2026, 1, 27),
+            adults=1, children=0, total_amount=20, nationality="Indian",
+        )
+        ticket = Ticket.objects.create(museum=self.museum, payment_status='paid', **fields)
+        Ticket.objects.using('replica').create(
+            ticket_id=ticket.ticket_id, museum_id=self.museum.pk, payment_status='pending',
+            booking_date=ticket.booking_date, **fields,
+        )
+        self.client.force_authenticate(None)
+        # The replica still shows the payment pending; the primary has it paid
+        response = self.client.get(reverse('payment_status', args=[ticket.ticket_id]))
+        self.assertEqual(response.json()['payment_status'], 'paid')
+        response = self.client.get(reverse('payment', args=[ticket.ticket_id]))
+        self.assertContains(response, "National Museum India")
+        # Once the replica has caught up it serves the page on its own
+        Ticket.objects.using('replica').filter(ticket_id=ticket.ticket_id).update(payment_status='paid')
+        with CaptureQueriesContext(connections['default']) as primary:
+            response = self.client.get(reverse('payment', args=[ticket.ticket_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(primary), 0)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        reset_metrics()
+        reset_throttles()
+        get_cache().clear()
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="Monday"
+        )
+
+    def test_metrics_are_staff_only(self):
+        self.assertIn(self.client.get(reverse('metrics')).status_code, (401, 403))
+        self.client.force_authenticate(User.objects.create_user(username='visitor', password='12345'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(reverse('metrics_traces')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_requests_are_counted_per_route(self):
+        for _ in range(2):
+            self.client.get(reverse('museum-list'))
+        self.client.get('/no-such-page/')
+        self.client.force_authenticate(User.objects.create_superuser(username='ops', password='12345'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('darshan_doot_http_requests_total{route="museum-list",method="GET",status="200"} 2', body)
+        self.assertIn('darshan_doot_http_requests_total{route="<unmatched>",method="GET",status="404"} 1', body)
+        self.assertIn('darshan_doot_http_request_duration_seconds_count{route="museum-list"} 2', body)
+        # The second listing came from the catalogue cache without a query
+        self.assertIn('darshan_doot_db_queries_per_request_bucket{route="museum-list",le="0"} 1', body)
+        self.assertIn('darshan_doot_db_queries_per_request_sum{route="museum-list"} 1', body)
+        self.assertIn('darshan_doot_http_response_size_bytes_count{route="museum-list"} 2', body)
+
+    def test_slow_requests_are_traced(self):
+        with override_settings(METRICS_SLOW_REQUEST_SECONDS=0, METRICS_TRACE_SAMPLE_RATE=1):
+            self.client.get(reverse('museum-list'))
+        self.client.force_authenticate(User.objects.create_superuser(username='ops', password='12345'))
+        trace = self.client.get(reverse('metrics_traces')).json()[0]
+        self.assertEqual(trace['route'], 'museum-list')
+        self.assertEqual(trace['status'], 200)
+        self.assertGreater(trace['queries'], 0)
+        self.assertLessEqual(len(trace['slowest_queries']), 3)
+        self.assertIn('darshan_doot_museum', trace['slowest_queries'][0]['sql'])
+
+    def test_stripe_calls_are_timed(self):
+        self.client.force_authenticate(User.objects.create_superuser(username='bot', password='12345'))
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        ticket_data = {
+            "user_phone": "9999999999", "user_email": "visitor@example.com", "adults": 1, "children": 0,
+            "visiting_date": "2026-01-27", "museum": self.museum.id, "nationality": "Indian",
+        }
+        with StubStripe() as stub, override_settings(STRIPE_SECRET_KEY='sk_test_stub', STRIPE_API_BASE=stub.api_base):
+            response = self.client.post(reverse('create_ticket'), ticket_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn(
+            'darshan_doot_stripe_request_duration_seconds_count{endpoint="/v1/payment_intents",outcome="ok"} 1', body
+        )
+
+    def test_histograms_sum_across_threads(self):
+        registry = Registry()
+        registry.observe('http_request_duration_seconds', (('route', 'a'),), 0.02)
+        thread = threading.Thread(target=registry.observe, args=('http_request_duration_seconds', (('route', 'a'),), 20))
+        thread.start()
+        thread.join()
+        body = render(registry.collect())
+        self.assertIn('darshan_doot_http_request_duration_seconds_bucket{route="a",le="0.01"} 0', body)
+        self.assertIn('darshan_doot_http_request_duration_seconds_bucket{route="a",le="0.025"} 1', body)
+        self.assertIn('darshan_doot_http_request_duration_seconds_bucket{route="a",le="+Inf"} 2', body)
+        self.assertIn('darshan_doot_http_request_duration_seconds_sum{route="a"} 20.02', body)
+
+
+    def test_ended_threads_shards_are_retired(self):
+        registry = Registry()
+        for _ in range(20):
+            thread = threading.Thread(target=registry.inc, args=('http_requests_total', (('route', 'a'),)))
+            thread.start()
+            thread.join()
+        registry.inc('http_requests_total', (('route', 'a'),))
+        # Only this thread's shard is left; the others' counts live on
+        self.assertEqual(len(registry.shards), 1)
+        self.assertEqual(registry.collect(), {('http_requests_total', (('route', 'a'),)): 21})
+
+class LoadTestTests(TransactionTestCase):
+    def setUp(self):
+        reset_metrics()
+        reset_throttles()
+        reset_index()
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        self.museum = Museum.objects.create(
+            name="National Museum India", location="New Delhi", indian_adult_fee=20, indian_child_fee=10,
+            camera_fee=0, international_citizen_fee=500, timings="10:00 AM – 5:00 PM", closed_on="NA"
+        )
+        self.headers = {'Authorization': 'Basic ' + base64.b64encode(b'bot:12345').decode()}
+
+    def test_journeys_run_end_to_end(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with StubStripe() as stub, loadtest.bench_settings(stub, loadtest.WEBHOOK_SECRET, directory.name):
+            User.objects.create_superuser(username='bot', password='12345')
+            for handler in loadtest.HANDLERS:
+                reset_metrics()
+                result = loadtest.run(
+                    handler, 2, 1, [(self.museum.id, self.museum.name)], loadtest.WEBHOOK_SECRET, self.headers,
+                )
+                self.assertEqual(result['completed'], 2)
+                self.assertEqual(list(result['steps']), list(loadtest.STEPS))
+                self.assertEqual([step['failures'] for step in result['steps'].values()], [0] * len(loadtest.STEPS))
+                self.assertEqual(result['steps']['payment_page']['queries'], 1)
+                self.assertEqual(result['webhook_drain']['events'], 2)
+            self.assertEqual(stub.requests, 4)
+        self.assertEqual(Ticket.objects.filter(payment_status='paid').count(), 4)
+
+    def test_compare_flags_regressions(self):
+        def run(rps, p95, queries):
+            return {'handler': 'wsgi', 'concurrency': 8, 'steps': {'book': {'rps': rps, 'p95_ms': p95, 'queries': queries}}}
+
+        baseline = {'runs': [run(100, 50, 7)]}
+        self.assertEqual(loadtest.compare(baseline, [run(90, 55, 7.2)], tolerance=0.2), [])
+        self.assertEqual(loadtest.compare(baseline, [run(70, 80, 9)], tolerance=0.2), [
+            'wsgi@8 book: 70 req/s, was 100',
+            'wsgi@8 book: p95 80.0ms, was 50.0ms',
+            'wsgi@8 book: 9 queries per request, was 7',
+        ])
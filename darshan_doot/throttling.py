@@ -0,0 +1,247 @@
+"""
+Token-bucket rate limits for the booking and verification endpoints.
+
+Each scope in THROTTLE_RATES, e.g. 'verify_ticket': '5/hour', gives every
+key (a phone number, client IP or ticket id) a bucket holding up to N
+tokens that refills at N per period. A request takes a token or is
+refused with the time until one is available. A bucket is two numbers
+updated in place, so a check is O(1) and never touches the database.
+
+Buckets live in process, in a sharded dict, unless REDIS_URL is set; then
+they live in Redis and are shared by every web process.
+"""
+
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# By first letter, as DRF reads them: 's', 'sec', 'min', 'minute', 'hour'...
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+SHARD_COUNT = 64
+# Buckets kept per shard; the least recently used go first, and a dropped
+# bucket comes back full, which only ever errs on the side of the client
+SHARD_SIZE = 10000
+
+
+def parse_rate(rate):
+    """
+    Turn 'N/period' into `(capacity, tokens per second)`; None means no limit.
+    Raises ImproperlyConfigured for anything else.
+    """
+    if rate is None:
+        return None
+    count, _, period = rate.partition('/')
+    try:
+        return int(count), int(count) / PERIODS[period[:1]]
+    except (KeyError, ValueError):
+        raise ImproperlyConfigured(
+            f"Rate {rate!r} is not 'N/period' with a period of s(ec), m(in), h(our) or d(ay)."
+        ) from None
+
+
+def check_rates(app_configs=None, **kwargs):
+    """
+    System check for THROTTLE_RATES, so a bad rate stops the server at
+    startup rather than failing every request it limits.
+    """
+    errors = []
+    for scope, rate in settings.THROTTLE_RATES.items():
+        try:
+            parse_rate(rate)
+        except ImproperlyConfigured as e:
+            errors.append(checks.Error(f"THROTTLE_RATES[{scope!r}]: {e}", id='darshan_doot.E001'))
+    return errors
+
+
+def _refill(tokens, updated_at, now, capacity, per_second):
+    return min(capacity, tokens + max(0.0, now - updated_at) * per_second)
+
+
+class LocalBucketStore:
+    """
+    Buckets in process memory, spread over locked shards so concurrent
+    requests for different keys rarely wait on each other.
+    """
+
+    def __init__(self, shards=SHARD_COUNT, shard_size=SHARD_SIZE):
+        self.shards = [(OrderedDict(), threading.Lock()) for _ in range(shards)]
+        self.shard_size = shard_size
+
+    def take(self, key, capacity, per_second, now):
+        """
+        Take a token from `key`'s bucket. Returns 0 when one was taken, else
+        the seconds until one will be available.
+        """
+        buckets, lock = self.shards[zlib.crc32(key.encode()) % len(self.shards)]
+        with lock:
+            tokens, updated_at = buckets.pop(key, (capacity, now))
+            tokens = _refill(tokens, updated_at, now, capacity, per_second)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / per_second
+            buckets[key] = (tokens - 1 if not wait else tokens, now)
+            if len(buckets) > self.shard_size:
+                buckets.popitem(last=False)
+        return wait
+
+
+# Same arithmetic as LocalBucketStore.take, run atomically inside Redis
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * per_second)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / per_second end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / per_second) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBucketStore:
+    """
+    Buckets in Redis (or anything speaking its protocol and Lua), shared by
+    every process. Needs the redis package.
+    """
+
+    def __init__(self, url, prefix='darshan_doot:throttle:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TAKE_SCRIPT)
+        self.prefix = prefix
+
+    def take(self, key, capacity, per_second, now):
+        return float(self.script(keys=[self.prefix + key], args=[capacity, per_second, now]))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = RedisBucketStore(settings.REDIS_URL) if settings.REDIS_URL else LocalBucketStore()
+    return _store
+
+
+def reset_throttles():
+    global _store
+    with _store_lock:
+        _store = None
+
+
+def throttle(scope, key):
+    """
+    Count a request against `key` in `scope`. Returns 0 when it may go
+    ahead, else the seconds the client should wait.
+    """
+    rate = parse_rate(settings.THROTTLE_RATES.get(scope))
+    if rate is None or not key:
+        return 0.0
+    return get_store().take(f'{scope}:{key}', *rate, time.time())
+
+
+def phone_key(phone):
+    # "+91 99999 99999" and "9999999999" are the same phone
+    return ''.join(char for char in str(phone or '') if char.isdigit())[-10:]
+
+
+def client_ip(request):
+    """
+    The client's address: REMOTE_ADDR, or with NUM_PROXIES proxies in front
+    the address the nearest of them saw in X-Forwarded-For. Left unset, DRF
+    would trust the whole header, which a client can write anything into.
+    """
+    if api_settings.NUM_PROXIES is None:
+        return request.META.get('REMOTE_ADDR')
+    return BaseThrottle().get_ident(request)
+
+
+def booking_keys(request, data):
+    return [('booking_ip', client_ip(request)), ('booking_phone', phone_key(data.get('user_phone')))]
+
+
+def verify_keys(request, ticket_id):
+    return [('verify_ip', client_ip(request)), ('verify_ticket', str(ticket_id))]
+
+
+def check(keys):
+    """
+    Count a request against every `(scope, key)` in `keys`. Returns 0 when
+    it may go ahead, else the longest wait among the limits it hit.
+    """
+    return max((throttle(scope, key) for scope, key in keys), default=0.0)
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    DRF throttle over the token buckets; subclasses say which keys a
+    request is counted against.
+    """
+
+    def get_keys(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        self.wait_time = check(self.get_keys(request, view))
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
+
+
+class BookingThrottle(BucketThrottle):
+    """
+    Bookings per client IP and per phone number; the phone limit is
+    TICKET_BOOKING_LIMIT a day.
+    """
+
+    def get_keys(self, request, view):
+        data = request.data if isinstance(request.data, dict) else {}
+        return booking_keys(request, data)
+
+
+class BulkBookingThrottle(BucketThrottle):
+    """
+    A batch of bookings counts once against the client IP; each booking in
+    it still takes a token from its phone number's bucket, in the view.
+    """
+
+    def get_keys(self, request, view):
+        return [('booking_ip', client_ip(request))]
+
+
+class QRThrottle(BucketThrottle):
+    """
+    Anonymous QR downloads, which are let in by the ticket's verification
+    code, per client IP and per ticket, so the code can't be guessed there
+    either. Staff who may view tickets aren't limited.
+    """
+
+    def get_keys(self, request, view):
+        if request.user.has_perm('darshan_doot.view_ticket'):
+            return []
+        return [('verify_ip', client_ip(request)), ('qr_ticket', str(view.kwargs.get('ticket_id')))]
+
+
+class VerifyThrottle(BucketThrottle):
+    """
+    Verification attempts per client IP and per ticket, so a ticket's
+    six-character code can't be guessed by brute force.
+    """
+
+    def get_keys(self, request, view):
+        return verify_keys(request, view.kwargs.get('ticket_id'))
@@ -4,7 +4,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework.documentation import include_docs_urls
 from rest_framework_nested import routers
-from .views import MuseumViewSet, TicketViewSet, EventViewSet, PaymentView
+from . import async_views
+from .views import MuseumViewSet, TicketViewSet, EventViewSet, ExportViewSet, GateViewSet, MetricsViewSet, QuoteViewSet, PaymentStatusView, PaymentView, stripe_webhook
 
 router = DefaultRouter()
 router.register(r'museums', MuseumViewSet)
@@ -15,11 +16,27 @@ museums_router.register(r'events', EventViewSet, basename='museum-events')
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include_docs_urls(title='Darshan Doot API', permission_classes=[IsAuthenticated])),
+    path('quote/', QuoteViewSet.as_view({'post': 'create'}), name='quote'),
     path('ticket/', TicketViewSet.as_view({'post': 'create'}), name='create_ticket'),
+    path('ticket/bulk/', TicketViewSet.as_view({'post': 'bulk'}), name='bulk_create_ticket'),
     path('ticket/<uuid:ticket_id>/', TicketViewSet.as_view({'put': 'update', 'delete': 'delete'}), name='ticket_detail'),
+    path('ticket/<uuid:ticket_id>/qr/', TicketViewSet.as_view({'get': 'qr'}), name='ticket_qr'),
+    path('ticket/<uuid:ticket_id>/qr/<int:member>/', TicketViewSet.as_view({'get': 'qr'}), name='ticket_member_qr'),
     path('ticket/verify/<uuid:ticket_id>/', TicketViewSet.as_view({'post': 'verify'}), name='verify_ticket'),
     path('ticket/payment-verify/<uuid:ticket_id>/', TicketViewSet.as_view({'post': 'payment_verify'}), name='payment_verify'),
     path('payment/<uuid:ticket_id>/', PaymentView, name='payment'),
+    path('payment/<uuid:ticket_id>/status/', PaymentStatusView, name='payment_status'),
+    path('stripe/webhook/', stripe_webhook, name='stripe_webhook'),
+    path('gate/<int:museum_id>/snapshot/', GateViewSet.as_view({'get': 'snapshot'}), name='gate_snapshot'),
+    path('gate/<int:museum_id>/checkins/', GateViewSet.as_view({'post': 'checkins'}), name='gate_checkins'),
+    path('export/<slug:dataset>/', ExportViewSet.as_view({'get': 'download'}), name='export'),
+    path('metrics/', MetricsViewSet.as_view({'get': 'metrics'}), name='metrics'),
+    path('metrics/traces/', MetricsViewSet.as_view({'get': 'traces'}), name='metrics_traces'),
+    # Async (ASGI) versions of the busiest chatbot endpoints
+    path('async/ticket/', async_views.create_ticket, name='async_create_ticket'),
+    path('async/ticket/verify/<uuid:ticket_id>/', async_views.verify_ticket, name='async_verify_ticket'),
+    path('async/ticket/payment-verify/<uuid:ticket_id>/', async_views.payment_verify, name='async_payment_verify'),
+    path('async/payment/<uuid:ticket_id>/', async_views.payment_page, name='async_payment'),
     path('', include(router.urls)),
     path('', include(museums_router.urls)),
 ]
\ No newline at end of file
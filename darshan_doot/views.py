@@ -1,23 +1,82 @@
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from django.utils import timezone
-from .models import Event, Museum, Ticket
+from django.utils.dateparse import parse_datetime
+from .models import DailyCapacity, Event, Museum, Ticket
+from .bookings import (
+    QUOTE_FIELDS, BookingError, book_ticket, booking_response, check_open, confirm_payment, new_ticket,
+    parse_booking, parse_party, payment_response, start_payment,
+)
+from .capacity import reserve_many, release_seats
+from .catalogue import catalogue_version, get_listing, normalize, set_listing
+from .artifacts import get_code, ticket_codes
+from .closures import get_calendar
+from .exports import EXPORT_FORMATS, EXPORTS, accepts_gzip, export_stream
+from .gate import build_snapshot, record_checkins
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, get_traces, scrape
+from .pages import payment_page, payment_ticket, status_response
+from .pagination import EventKeysetPagination
+from .pricing import FeeTable
+from .routers import ReplicaReadMixin, read_alias, replica_view
+from .sales import forget_tickets, record_tickets
+from .search import search_museums
+from .states import CANCELLED, PAID, RELEASES_SEATS, transition
+from .throttling import BookingThrottle, BulkBookingThrottle, QRThrottle, VerifyThrottle, phone_key, throttle
+from .webhooks import record_event, webhook_worker
 from .serializers import MuseumSerializer, TicketSerializer, EventSerializer
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+import math
 import stripe
-import string
-import random
-from django.db import transaction
+import json
+from django.db import DEFAULT_DB_ALIAS, transaction
 from django.contrib.auth.views import LoginView
 from django.shortcuts import redirect
-from datetime import datetime
-from django.shortcuts import render
+from datetime import datetime, timedelta
+import uuid
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+AVAILABILITY_DEFAULT_DAYS = 90
+AVAILABILITY_MAX_DAYS = 366
+# Rendered QR codes are content-addressed, so a URL's image never changes
+QR_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+# Status changes a visitor may make to their own ticket
+VISITOR_TRANSITIONS = {CANCELLED}
 
-class MuseumViewSet(viewsets.ReadOnlyModelViewSet):
+class SparseFieldsMixin:
+    """
+    Lets list endpoints take a `?fields=id,name` parameter: only the named
+    fields are serialized and only their columns are fetched.
+    """
+
+    def requested_fields(self):
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return None
+        return [field.strip() for field in fields.split(',') if field.strip()]
+
+    def ordering_fields(self):
+        """
+        Return the columns the paginator orders by and reads cursors from,
+        which must be fetched whatever fields were asked for.
+        """
+        ordering = getattr(self.pagination_class, 'ordering', None) or ()
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        return [field.lstrip('-') for field in ordering if field.lstrip('-') != 'pk']
+
+    def sparse_queryset(self, queryset, fields):
+        if fields:
+            columns = self.get_serializer_class().model_field_names(fields)
+            queryset = queryset.only(*columns, *self.ordering_fields())
+        return queryset
+
+class MuseumViewSet(ReplicaReadMixin, SparseFieldsMixin, viewsets.ReadOnlyModelViewSet):
     """
     A viewset for viewing and editing museum instances.
     """
@@ -28,22 +87,118 @@ class MuseumViewSet(viewsets.ReadOnlyModelViewSet):
         """
         List all museums or filter by name and location.
         Query Parameters:
+            - q: Fuzzy search over name and location, best match first.
             - name: Filter museums by name (case-insensitive).
             - location: Filter museums by location (case-insensitive).
+            - fields: Comma-separated fields to return, e.g. `id,name,timings`.
+            - cursor, page_size: Keyset pagination controls.
         Returns:
-            A list of museums matching the filters.
+            A page of museums matching the filters, with `next`/`previous`
+            cursor links. Search results are a single ranked page. JSON
+            responses are served from the catalogue cache and carry an ETag;
+            a matching If-None-Match header gets a 304 with no body.
         """
-        name = request.query_params.get('name', None)
-        location = request.query_params.get('location', None)
-        queryset = self.get_queryset()
+        filters = {
+            'q': request.query_params.get('q', None),
+            'name': request.query_params.get('name', None),
+            'location': request.query_params.get('location', None),
+            'fields': request.query_params.get('fields', None),
+            'cursor': request.query_params.get('cursor', None),
+            'page_size': request.query_params.get('page_size', None),
+        }
+        try:
+            fields = self.requested_fields()
+            queryset = self.sparse_queryset(self.get_queryset(), fields)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.accepted_renderer.format != 'json':
+            return Response(self.filtered_data(queryset, **filters))
 
+        # The body carries absolute cursor links, so the origin is part of the key
+        origin = request.build_absolute_uri('/')
+        version = catalogue_version()
+        entry = get_listing(version, origin=origin, **filters)
+        if entry is None:
+            # Stored under the new version for everyone, so built from the
+            # primary: the replica may not have the save that bumped it yet
+            body = JSONRenderer().render(self.filtered_data(queryset.using(DEFAULT_DB_ALIAS), **filters))
+            entry = set_listing(version, body, origin=origin, **filters)
+        etag, body = entry
+
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    def filtered_data(self, queryset, q, name, location, fields, **page):
+        fields = self.requested_fields()
+        # Filter on the values the cache key is built from, so every
+        # spelling that shares an entry gets the same results
+        name, location = normalize(name), normalize(location)
         if name:
             queryset = queryset.filter(name__icontains=name)
         if location:
             queryset = queryset.filter(location__icontains=location)
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        if q:
+            ranking = search_museums(q)
+            museums = queryset.in_bulk(ranking)
+            results = [museums[museum_id] for museum_id in ranking if museum_id in museums]
+            serializer = self.get_serializer(results, many=True, fields=fields)
+            return {'next': None, 'previous': None, 'results': serializer.data}
+
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True, fields=fields)
+        return self.get_paginated_response(serializer.data).data
+
+    @action(detail=True, methods=['get'])
+    def availability(self, request, pk=None):
+        """
+        List the open dates and remaining seats of a museum over a window.
+        Query Parameters:
+            - from: First date (YYYY-MM-DD), defaults to today.
+            - to: Last date (YYYY-MM-DD), defaults to 90 days from `from`.
+        Returns:
+            The museum timings and one entry per date in the window.
+        """
+        museum = self.get_object()
+        try:
+            start = request.query_params.get('from')
+            start = datetime.strptime(start, '%Y-%m-%d').date() if start else timezone.localdate()
+            end = request.query_params.get('to')
+            end = datetime.strptime(end, '%Y-%m-%d').date() if end else start + timedelta(days=AVAILABILITY_DEFAULT_DAYS - 1)
+        except ValueError:
+            return Response({'error': 'Dates must be in YYYY-MM-DD format.'}, status=status.HTTP_400_BAD_REQUEST)
+        if end < start:
+            return Response({'error': '`to` must not be before `from`.'}, status=status.HTTP_400_BAD_REQUEST)
+        if (end - start).days >= AVAILABILITY_MAX_DAYS:
+            return Response({'error': f'Window cannot exceed {AVAILABILITY_MAX_DAYS} days.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        calendar = get_calendar(museum)
+        remaining = dict(
+            DailyCapacity.objects.filter(museum=museum, visiting_date__range=(start, end))
+            .values_list('visiting_date', 'remaining')
+        )
+        default_remaining = settings.MUSEUM_DAILY_CAPACITY
+        days = []
+        for offset, is_open in enumerate(calendar.open_days(start, end)):
+            day = start + timedelta(days=offset)
+            days.append({
+                'date': day,
+                'open': is_open,
+                'remaining': remaining.get(day, default_remaining) if is_open else 0,
+            })
+        return Response({
+            'museum': museum.id,
+            'opening': calendar.opening,
+            'closing': calendar.closing,
+            'from': start,
+            'to': end,
+            'days': days,
+        })
 
 class TicketViewSet(viewsets.ModelViewSet):
     """
@@ -51,6 +206,12 @@ class TicketViewSet(viewsets.ModelViewSet):
     """
     queryset = Ticket.objects.all()
     serializer_class = TicketSerializer
+    action_throttles = {
+        'create': [BookingThrottle], 'bulk': [BulkBookingThrottle], 'qr': [QRThrottle], 'verify': [VerifyThrottle],
+    }
+
+    def get_throttles(self):
+        return [throttle() for throttle in self.action_throttles.get(self.action, [])]
 
     def create(self, request):
         """
@@ -63,82 +224,129 @@ class TicketViewSet(viewsets.ModelViewSet):
             - visiting_date: Date of the visit.
             - museum_id: ID of the museum.
             - nationality: User's nationality.
+            - cameras: Optional number of cameras.
+            - students: Optional number of students in the party.
+        Returns:
+            The ticket details, with the payment page to send the visitor
+            as `payment_url` (and, as before, `stripe_payment_intent`). When
+            Stripe is configured, also the PaymentIntent's
+            `payment_intent_id` and `client_secret`.
         """
-        required_fields = ['user_phone', 'user_email', 'adults', 'children', 'visiting_date', 'museum', 'nationality']
-        
-        # Check for missing required fields
-        for field in required_fields:
-            if field not in request.data:
-                return Response({'error': f'Missing required field: {field}'}, status=status.HTTP_400_BAD_REQUEST)
-
-        user_phone = request.data['user_phone']
-        user_email = request.data['user_email']
-        adults = request.data['adults']
-        children = request.data['children']
-        visiting_date = request.data['visiting_date']
-        museum_id = request.data['museum']
-        nationality = request.data['nationality']
-
-        # Check if the museum is open on the visiting date
-        museum = Museum.objects.filter(id=museum_id).first()  # Use museum_id to fetch the museum
+        try:
+            booking = parse_booking(request.data)
+        except BookingError as e:
+            return Response({'error': e.message}, status=e.status_code)
+
+        museum = Museum.objects.filter(id=booking['museum_id']).first()
         if not museum:
             return Response({'error': 'Museum not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Check if the visiting date is a holiday
-        visiting_date_obj = datetime.strptime(visiting_date, '%Y-%m-%d').date()
-        if visiting_date_obj.weekday() in [5, 6]:  # Saturday=5, Sunday=6
-            return Response({'error': 'Museum is closed on weekends.'}, status=status.HTTP_400_BAD_REQUEST)
+        # Check the visiting date against the museum's closure calendar
+        try:
+            check_open(museum, booking['visiting_date'])
+        except BookingError as e:
+            return Response({'error': e.message}, status=e.status_code)
 
-        # Calculate total amount based on nationality
-        if nationality.lower() == 'indian':
-            total_amount = (museum.indian_adult_fee * adults) + (museum.indian_child_fee * children)
-        else:
-            total_amount = (museum.international_citizen_fee * adults) + (museum.international_citizen_fee * children)
-
-        # Create the ticket
-        ticket = Ticket(
-            user_phone=user_phone,
-            user_email=user_email,
-            museum=museum,
-            visiting_date=visiting_date_obj,
-            adults=adults,
-            children=children,
-            total_amount=total_amount,
-            payment_status='pending',
-            booking_date=timezone.now(),
-            nationality=nationality
-        )
+        ticket = new_ticket(museum, booking)
+        try:
+            book_ticket(ticket)
+        except BookingError as e:
+            return Response({'error': e.message}, status=e.status_code)
+
+        # Outside the booking transaction, so no row lock waits on Stripe
+        intent = start_payment(ticket)
+        return Response(booking_response(ticket, museum, intent), status=status.HTTP_201_CREATED)
+
+    def bulk(self, request):
+        """
+        Create tickets for a batch of bookings in one transaction.
+        Request Body:
+            - bookings: A list of booking objects with the same fields as `create`.
+        Returns:
+            One result per booking, in order. Accepted bookings carry the
+            ticket details, rejected ones an `error` and `status`; a bad
+            booking does not stop the rest of the batch. Each booking counts
+            against its phone number's daily limit, as through `create`.
+        """
+        bookings = request.data.get('bookings') if isinstance(request.data, dict) else request.data
+        if not isinstance(bookings, list) or not bookings:
+            return Response({'error': 'bookings must be a non-empty list.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(bookings) > settings.BULK_TICKET_LIMIT:
+            return Response({'error': f'At most {settings.BULK_TICKET_LIMIT} bookings per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = [None] * len(bookings)
+        parsed = []
+        for index, data in enumerate(bookings):
+            try:
+                booking = parse_booking(data)
+            except BookingError as e:
+                results[index] = {'error': e.message, 'status': e.status_code}
+                continue
+            wait = throttle('booking_phone', phone_key(booking['user_phone']))
+            if wait:
+                results[index] = {
+                    'error': f'Booking limit reached for this phone number. Try again in {math.ceil(wait)} seconds.',
+                    'status': status.HTTP_429_TOO_MANY_REQUESTS,
+                }
+                continue
+            parsed.append((index, booking))
+
+        museums = Museum.objects.in_bulk({booking['museum_id'] for _, booking in parsed})
+        tickets = {}
+        for index, booking in parsed:
+            museum = museums.get(booking['museum_id'])
+            try:
+                if museum is None:
+                    raise BookingError('Museum not found.', status_code=404)
+                check_open(museum, booking['visiting_date'])
+            except BookingError as e:
+                results[index] = {'error': e.message, 'status': e.status_code}
+                continue
+            tickets[index] = new_ticket(museum, booking)
 
         with transaction.atomic():
-            ticket.save()
-
-        # Generate Stripe payment intent URL
-        ticket.stripe_payment_intent_id = f"/payment/{ticket.ticket_id}/"
-        ticket.save()
-
-        response_data = {
-            'ticket_id': ticket.ticket_id,
-            'user_phone': user_phone,
-            'user_email': user_email,
-            'adults': adults,
-            'children': children,
-            'visiting_date': visiting_date,
-            'museum_name': museum.name,
-            'total_amount': total_amount,
-            'stripe_payment_intent': ticket.stripe_payment_intent_id
-        }
-        return Response(response_data, status=status.HTTP_201_CREATED)
+            reserved = reserve_many(
+                (index, ticket.museum_id, ticket.visiting_date, ticket.adults + ticket.children)
+                for index, ticket in tickets.items()
+            )
+            booked = Ticket.objects.bulk_create([ticket for index, ticket in tickets.items() if index in reserved])
+            # bulk_create sends no post_save signals
+            record_tickets(booked)
+
+        # Outside the booking transaction, so no row lock waits on Stripe
+        for index, ticket in tickets.items():
+            if index in reserved:
+                results[index] = booking_response(ticket, ticket.museum, start_payment(ticket))
+            else:
+                results[index] = {'error': 'Museum is fully booked on this date.', 'status': status.HTTP_409_CONFLICT}
+
+        created = len(reserved)
+        return Response({
+            'created': created,
+            'failed': len(bookings) - created,
+            'results': results,
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
 
     def update(self, request, ticket_id):
         """
-        Update a ticket.
+        Update a ticket's status. Visitors may only cancel a booking that
+        hasn't been paid for yet; its seats go back on sale.
+        Request Body:
+            - payment_status: 'cancelled'.
         """
-        try:
-            ticket = Ticket.objects.get(ticket_id=ticket_id)
-            ticket.save()
-            return Response({'status': 'success'}, status=status.HTTP_200_OK)
-        except Ticket.DoesNotExist:
+        target = request.data.get('payment_status')
+        if target is None:
+            if Ticket.objects.filter(ticket_id=ticket_id).exists():
+                return Response({'status': 'success'}, status=status.HTTP_200_OK)
             return Response({'status': 'not found'}, status=status.HTTP_404_NOT_FOUND)
+        if target not in VISITOR_TRANSITIONS:
+            return Response({'error': 'Invalid payment status.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if transition(ticket_id, target):
+            return Response({'status': 'success', 'payment_status': target}, status=status.HTTP_200_OK)
+        if Ticket.objects.filter(ticket_id=ticket_id).exists():
+            return Response({'error': f'Ticket can no longer be {target}.'}, status=status.HTTP_409_CONFLICT)
+        return Response({'status': 'not found'}, status=status.HTTP_404_NOT_FOUND)
 
     def delete(self, request, ticket_id):
         """
@@ -146,16 +354,55 @@ class TicketViewSet(viewsets.ModelViewSet):
         """
         try:
             ticket = Ticket.objects.get(ticket_id=ticket_id)
-            ticket.delete()
+            with transaction.atomic():
+                # Cancelled and refunded tickets already gave their seats back
+                if ticket.payment_status not in RELEASES_SEATS:
+                    release_seats(ticket.museum_id, ticket.visiting_date, ticket.adults + ticket.children)
+                forget_tickets([ticket])
+                ticket.delete()
             return Response({'status': 'success'}, status=status.HTTP_204_NO_CONTENT)
         except Ticket.DoesNotExist:
             return Response({'status': 'not found'}, status=status.HTTP_404_NOT_FOUND)
 
+    def qr(self, request, ticket_id, member=None):
+        """
+        Download a paid ticket's QR code as PNG: the group code, or with
+        `member` the code of that member of the party. Images come from the
+        rendered-code cache and never change, so clients may keep them.
+        Query Parameters:
+            - code: The ticket's verification code, which the links sent
+              after payment carry. Only staff who may view tickets can
+              leave it out.
+        """
+        tickets = Ticket.objects.filter(ticket_id=ticket_id, payment_status=PAID)
+        if not request.user.has_perm('darshan_doot.view_ticket'):
+            # The code is all that stands between the gate token and anyone
+            # who has seen the ticket id, e.g. in its payment page link
+            code = request.query_params.get('code')
+            tickets = tickets.filter(verification_code=code) if code else tickets.none()
+        ticket = tickets.only('ticket_id', 'museum_id', 'visiting_date', 'adults', 'children').first()
+        payload = dict(ticket_codes(ticket)).get(member) if ticket else None
+        if payload is None:
+            return Response({'error': 'Ticket not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        key, path = get_code(payload)
+        etag = f'"{key}"'
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(path, 'rb'), content_type='image/png')
+        response['ETag'] = etag
+        response['Cache-Control'] = QR_CACHE_CONTROL
+        return response
+
     def verify(self, request, ticket_id):
         """
         Verify a ticket using ticket_id and verification_code.
         """
         verification_code = request.data.get('verification_code')
+        # A missing code would match the NULL code of an unpaid ticket
+        if not verification_code or not isinstance(verification_code, str):
+            return Response({'error': 'verification_code is required.'}, status=status.HTTP_400_BAD_REQUEST)
         try:
             ticket = Ticket.objects.get(ticket_id=ticket_id, verification_code=verification_code)
             return Response({'status': 'success'}, status=status.HTTP_200_OK)
@@ -173,46 +420,238 @@ class TicketViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Transaction ID is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # Fetch the ticket using the ticket_id
-            ticket = Ticket.objects.get(ticket_id=ticket_id)
-            # Update the payment status and verification code
-            ticket.payment_status = 'paid'
-            characters = string.ascii_uppercase + string.digits
-            verification_code = ''.join(random.choice(characters) for _ in range(6))
-            ticket.verification_code = verification_code
-            ticket.transaction_id = transaction_id
-            ticket.save()
-            return Response({
-                'ticket_id': ticket.ticket_id,
-                'verification_code': ticket.verification_code,
-                'payment_status': ticket.payment_status,
-                'amount': ticket.total_amount,
-                'adults': ticket.adults,
-                'children': ticket.children
-            }, status=status.HTTP_200_OK)
-        except Ticket.DoesNotExist:
+            ticket = confirm_payment(ticket_id, transaction_id)
+        except BookingError as e:
+            return Response({'error': e.message}, status=e.status_code)
+        if ticket is None:
             return Response({'status': 'not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(payment_response(ticket), status=status.HTTP_200_OK)
 
-class EventViewSet(viewsets.ModelViewSet):
+class QuoteViewSet(viewsets.ViewSet):
     """
-    A viewset for managing event instances.
+    Price visits without booking them.
+    """
+    permission_classes = [AllowAny]
+
+    def create(self, request):
+        """
+        Quote a batch of visits, e.g. a multi-museum itinerary, in one call.
+        Request Body:
+            - quotes: A list of objects with `museum`, `adults`, `children`,
+              `nationality` and optionally `visiting_date`, `cameras` and
+              `students`.
+        Returns:
+            One result per request, in order, with the price breakdown and,
+            when a date is given, whether the museum is open that day; and
+            the itinerary total over the priced requests.
+        """
+        quotes = request.data.get('quotes') if isinstance(request.data, dict) else request.data
+        if not isinstance(quotes, list) or not quotes:
+            return Response({'error': 'quotes must be a non-empty list.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(quotes) > settings.BULK_TICKET_LIMIT:
+            return Response({'error': f'At most {settings.BULK_TICKET_LIMIT} quotes per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        parsed = []
+        results = [None] * len(quotes)
+        for index, data in enumerate(quotes):
+            try:
+                parsed.append((index, parse_party(data, required=QUOTE_FIELDS)))
+            except BookingError as e:
+                results[index] = {'error': e.message, 'status': e.status_code}
+
+        fees = FeeTable.load(party['museum_id'] for _, party in parsed)
+        total = 0
+        for index, party in parsed:
+            museum_id = party['museum_id']
+            if museum_id not in fees:
+                results[index] = {'error': 'Museum not found.', 'status': status.HTTP_404_NOT_FOUND}
+                continue
+            price = fees.price(
+                museum_id, party['nationality'], party['adults'], party['children'], party['cameras'], party['students'],
+            )
+            total += price['total']
+            result = {'museum': museum_id, 'museum_name': fees.museums[museum_id].name, **price}
+            if party['visiting_date'] is not None:
+                result['visiting_date'] = party['visiting_date']
+                result['open'] = get_calendar(fees.museums[museum_id]).is_open(party['visiting_date'])
+            results[index] = result
+
+        return Response({'total': total, 'results': results}, status=status.HTTP_200_OK)
+
+class GateViewSet(viewsets.ViewSet):
+    """
+    Staff-only endpoints used by gate devices to verify tickets offline.
+    """
+    permission_classes = [IsAdminUser]
+
+    def snapshot(self, request, museum_id):
+        """
+        Download the signed binary snapshot of valid ticket ids for a day.
+        Query Parameters:
+            - date: Visiting date (YYYY-MM-DD), defaults to today.
+        """
+        day = request.query_params.get('date')
+        try:
+            day = datetime.strptime(day, '%Y-%m-%d').date() if day else timezone.localdate()
+        except ValueError:
+            return Response({'error': 'date must be in YYYY-MM-DD format.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not Museum.objects.filter(pk=museum_id).exists():
+            return Response({'error': 'Museum not found.'}, status=status.HTTP_404_NOT_FOUND)
+        response = HttpResponse(build_snapshot(museum_id, day), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="gate-{museum_id}-{day.isoformat()}.bin"'
+        return response
+
+    def checkins(self, request, museum_id):
+        """
+        Sync a batch of check-ins recorded offline by a gate device.
+        Request Body:
+            - ticket_ids: List of ticket ids admitted at the gate.
+            - checked_in_at: When the batch was recorded, defaults to now.
+        Returns:
+            How many tickets were newly checked in and how many were
+            unknown, unpaid or already used.
+        """
+        ticket_ids = request.data.get('ticket_ids')
+        if not isinstance(ticket_ids, list):
+            return Response({'error': 'ticket_ids must be a list.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ticket_ids = {uuid.UUID(str(ticket_id)) for ticket_id in ticket_ids}
+        except ValueError:
+            return Response({'error': 'ticket_ids must be UUIDs.'}, status=status.HTTP_400_BAD_REQUEST)
+        checked_in_at = request.data.get('checked_in_at')
+        if checked_in_at:
+            try:
+                checked_in_at = parse_datetime(checked_in_at)
+            except (TypeError, ValueError):
+                checked_in_at = None
+            if checked_in_at is None:
+                return Response({'error': 'checked_in_at must be an ISO 8601 datetime.'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            checked_in_at = timezone.now()
+        checked_in = record_checkins(museum_id, ticket_ids, checked_in_at)
+        return Response({'checked_in': checked_in, 'rejected': len(ticket_ids) - checked_in}, status=status.HTTP_200_OK)
+
+class ExportViewSet(ReplicaReadMixin, viewsets.ViewSet):
+    """
+    Staff-only streaming exports of tickets and daily sales for analytics.
+    """
+    permission_classes = [IsAdminUser]
+
+    def download(self, request, dataset):
+        """
+        Stream a dataset ('tickets', 'archived-tickets' or 'sales') as CSV or NDJSON.
+        Query Parameters:
+            - museum: Museum id, defaults to all museums.
+            - from: First visiting date (YYYY-MM-DD).
+            - to: Last visiting date (YYYY-MM-DD).
+            - output: 'csv' (default) or 'ndjson'.
+        The body is gzipped on the fly when the client accepts it.
+        """
+        if dataset not in EXPORTS:
+            return Response({'error': 'Unknown export.'}, status=status.HTTP_404_NOT_FOUND)
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response({'error': f'output must be one of {", ".join(EXPORT_FORMATS)}.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start = request.query_params.get('from')
+            start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+            end = request.query_params.get('to')
+            end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+        except ValueError:
+            return Response({'error': 'Dates must be in YYYY-MM-DD format.'}, status=status.HTTP_400_BAD_REQUEST)
+        museum_id = request.query_params.get('museum')
+        if museum_id is not None and not museum_id.isdigit():
+            return Response({'error': 'museum must be a museum id.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        compress = accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        response = StreamingHttpResponse(
+            export_stream(
+                dataset, output=output, compress=compress,
+                museum_id=int(museum_id) if museum_id else None, start=start, end=end, using=read_alias(),
+            ),
+            content_type='text/csv' if output == 'csv' else 'application/x-ndjson',
+        )
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        response['Content-Disposition'] = f'attachment; filename="{dataset}.{output}"'
+        return response
+
+class MetricsViewSet(viewsets.ViewSet):
+    """
+    Staff-only request metrics for this process, for Prometheus to scrape.
+    """
+    permission_classes = [IsAdminUser]
+
+    def metrics(self, request):
+        """
+        Counters and histograms in the Prometheus text format.
+        """
+        return HttpResponse(scrape(), content_type=METRICS_CONTENT_TYPE)
+
+    def traces(self, request):
+        """
+        The most recent sampled slow-request traces, newest first.
+        """
+        return Response(list(reversed(get_traces())), status=status.HTTP_200_OK)
+
+class EventViewSet(ReplicaReadMixin, SparseFieldsMixin, viewsets.ModelViewSet):
+    """
+    A viewset for managing the events of a museum.
     """
     queryset = Event.objects.all()
     serializer_class = EventSerializer
+    pagination_class = EventKeysetPagination
 
-    def list(self, request):
+    def museum_id(self):
+        try:
+            return int(self.kwargs['museum_pk'])
+        except ValueError:
+            raise Http404('Museum not found.')
+
+    def get_queryset(self):
+        return super().get_queryset().filter(museum_id=self.museum_id())
+
+    def list(self, request, museum_pk=None):
         """
-        List all events.
+        List a museum's events, earliest first.
+        Query Parameters:
+            - from: First date (YYYY-MM-DD), defaults to now so only upcoming events are listed.
+            - to: Last date (YYYY-MM-DD), inclusive.
+            - fields: Comma-separated fields to return, e.g. `id,name,date`.
+            - cursor, page_size: Keyset pagination controls.
         Returns:
-            A list of all events.
+            A page of events with `next`/`previous` cursor links.
         """
         queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        try:
+            start = request.query_params.get('from')
+            end = request.query_params.get('to')
+            # Compare the raw datetime column against day boundaries so the
+            # (museum, date) index serves the range.
+            if start:
+                queryset = queryset.filter(date__gte=self.day_start(start))
+            else:
+                queryset = queryset.filter(date__gte=timezone.now())
+            if end:
+                queryset = queryset.filter(date__lt=self.day_start(end) + timedelta(days=1))
+            queryset = self.sparse_queryset(queryset, self.requested_fields())
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True, fields=self.requested_fields())
+        return self.get_paginated_response(serializer.data)
 
-    def create(self, request):
+    def day_start(self, value):
+        try:
+            day = datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError('Dates must be in YYYY-MM-DD format.')
+        return timezone.make_aware(day)
+
+    def create(self, request, museum_pk=None):
         """
-        Create a new event.
+        Create a new event for the museum in the URL.
         Request Body:
             - name: The name of the event.
             - date: The date and time of the event.
@@ -220,9 +659,12 @@ class EventViewSet(viewsets.ModelViewSet):
         Returns:
             The created event data.
         """
+        museum_id = self.museum_id()
+        if not Museum.objects.filter(pk=museum_id).exists():
+            return Response({'error': 'Museum not found.'}, status=status.HTTP_404_NOT_FOUND)
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            serializer.save(museum_id=museum_id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -230,18 +672,22 @@ class EventViewSet(viewsets.ModelViewSet):
 def stripe_webhook(request):
     """
     Handle Stripe webhook events.
-    This function processes events sent by Stripe, such as payment confirmations and cancellations.
+    The signature is verified and the event is stored under its unique
+    Stripe id, then Stripe gets its 200 straight away; a background worker
+    applies the payment status changes. Redelivered events are ignored.
     Returns:
-        HTTP response indicating the status of the event handling.
+        HTTP response indicating whether the event was accepted.
     """
     payload = request.body
-    sig_header = request.META['HTTP_STRIPE_SIGNATURE']
-    event = None
+    sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
+    if not sig_header:
+        return HttpResponse(status=400)
 
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
+        event = json.loads(payload)
     except ValueError as e:
         # Invalid payload
         return HttpResponse(status=400)
@@ -249,47 +695,27 @@ def stripe_webhook(request):
         # Invalid signature
         return HttpResponse(status=400)
 
-    # Handle the event
-    if event.type == 'payment_intent.succeeded':
-        payment_intent = event.data.object
-        ticket_id = payment_intent.metadata.get('ticket_id')
-        if ticket_id:
-            ticket = Ticket.objects.get(ticket_id=ticket_id)
-            ticket.payment_status = 'paid'
-            ticket.save()
-    elif event.type == 'payment_intent.canceled':
-        payment_intent = event.data.object
-        ticket_id = payment_intent.metadata.get('ticket_id')
-        if ticket_id:
-            ticket = Ticket.objects.get(ticket_id=ticket_id)
-            ticket.payment_status = 'cancelled'
-            ticket.save()
-    elif event.type == 'charge.refunded':
-        charge = event.data.object
-        ticket_id = charge.metadata.get('ticket_id')
-        if ticket_id:
-            ticket = Ticket.objects.get(ticket_id=ticket_id)
-            ticket.payment_status = 'refunded'
-            ticket.save()
+    if record_event(event) and settings.STRIPE_WEBHOOK_WORKER == 'thread':
+        transaction.on_commit(webhook_worker.wake)
 
     return HttpResponse(status=200)
 
+@replica_view
 def PaymentView(request, ticket_id):
     """
-    Render the payment details for a specific ticket.
+    Render the payment details for a specific ticket. Reloads revalidate
+    against the page's ETag and Last-Modified and usually get a 304.
     """
-    try:
-        ticket = Ticket.objects.get(ticket_id=ticket_id)
-        context = {
-            'museum_name': ticket.museum.name,
-            'visiting_date': ticket.visiting_date,
-            'total_amount': ticket.total_amount,
-            'adults': ticket.adults,
-            'children': ticket.children,
-            'ticket_id': ticket.ticket_id,
-            'payment_status': ticket.payment_status,
-        }
-        return render(request, 'payment_details.html', context)
-    except Ticket.DoesNotExist:
-        return Response({'error': 'Ticket not found.'}, status=status.HTTP_404_NOT_FOUND)
+    ticket = payment_ticket(ticket_id)
+    if ticket is None:
+        return JsonResponse({'error': 'Ticket not found.'}, status=status.HTTP_404_NOT_FOUND)
+    return payment_page(request, ticket)
+
+
+@replica_view
+def PaymentStatusView(request, ticket_id):
+    """
+    The ticket's payment status as JSON, for the payment page to poll.
+    """
+    return status_response(request, ticket_id)
     
\ No newline at end of file
@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from .models import StripeEvent, TicketArchive
+from .reaper import EXPIRED
+from .states import CANCELLED, PAID, REFUNDED, transition_many
+
+logger = logging.getLogger(__name__)
+
+# Stripe event type -> ticket payment status it moves the ticket to
+HANDLED_EVENTS = {
+    'payment_intent.succeeded': PAID,
+    'payment_intent.canceled': CANCELLED,
+    'charge.refunded': REFUNDED,
+}
+# When one batch holds several events for a ticket, the most final one wins
+PRECEDENCE = {PAID: 0, CANCELLED: 1, REFUNDED: 2}
+
+EVENT_BATCH_SIZE = 500
+# A failed drain is retried after this many seconds, doubling up to the cap
+DRAIN_RETRY_SECONDS = 1
+DRAIN_RETRY_MAX_SECONDS = 60
+
+
+def record_event(event):
+    """
+    Store a verified Stripe event for the worker. Returns True when there is
+    new work to do; events Stripe already delivered are ignored, so retries
+    are no-ops.
+    """
+    payment = event.get('data', {}).get('object', {})
+    try:
+        ticket_id = uuid.UUID(str((payment.get('metadata') or {}).get('ticket_id')))
+    except ValueError:
+        ticket_id = None
+    handled = event['type'] in HANDLED_EVENTS and ticket_id is not None
+    try:
+        with transaction.atomic():
+            StripeEvent.objects.create(
+                event_id=event['id'],
+                event_type=event['type'],
+                ticket_id=ticket_id,
+                stripe_created=datetime.fromtimestamp(event.get('created', 0), tz=dt_timezone.utc),
+                payload=event,
+                # Events we don't act on are stored for the record only
+                processed_at=None if handled else timezone.now(),
+            )
+    except IntegrityError:
+        return False
+    return handled
+
+
+def flag_late_payments(ticket_ids):
+    """
+    Log the tickets among `ticket_ids` that were paid for after the reaper
+    expired them. It cancels their intents first, so this only happens when
+    a payment went through while the cancellation was in flight; they need
+    refunding by hand.
+    """
+    late = TicketArchive.objects.filter(ticket_id__in=ticket_ids, payment_status=EXPIRED)
+    for ticket_id in late.values_list('ticket_id', flat=True):
+        logger.error('Ticket %s was paid for after it expired and needs a refund.', ticket_id)
+
+
+def process_pending_events(batch_size=EVENT_BATCH_SIZE):
+    """
+    Apply one batch of unprocessed events and return how many were consumed.
+    Events for the same ticket are coalesced to their most final status and
+    applied through the ticket state machine, so a late or replayed event
+    can't move a ticket backwards.
+    """
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by('stripe_created', 'id')
+            .only('id', 'event_type', 'ticket_id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        final = {}
+        for event in events:
+            target = HANDLED_EVENTS.get(event.event_type)
+            if target is None or event.ticket_id is None:
+                continue
+            current = final.get(event.ticket_id)
+            if current is None or PRECEDENCE[target] >= PRECEDENCE[current]:
+                final[event.ticket_id] = target
+
+        by_status = {}
+        for ticket_id, target in final.items():
+            by_status.setdefault(target, []).append(ticket_id)
+        for target, ticket_ids in by_status.items():
+            moved = transition_many(ticket_ids, target)
+            if target == PAID and moved < len(ticket_ids):
+                flag_late_payments(ticket_ids)
+
+        StripeEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=timezone.now())
+    return len(events)
+
+
+class WebhookWorker:
+    """
+    Drains the StripeEvent queue on a single background thread. `wake` is
+    cheap and may be called for every webhook; wakes that arrive while a
+    drain is already queued are folded into it.
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.scheduled = False
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def wake(self):
+        with self.lock:
+            if self.scheduled:
+                return
+            self.scheduled = True
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stripe-webhooks')
+        self.executor.submit(self._drain)
+
+    def _drain(self):
+        with self.lock:
+            self.scheduled = False
+        try:
+            while process_pending_events():
+                pass
+            self.failures = 0
+        except Exception:
+            # Nobody reads the executor's future, so log here; the events
+            # stay queued and are retried after a growing pause
+            self.failures += 1
+            logger.exception("Draining Stripe events failed (%d in a row).", self.failures)
+        finally:
+            close_old_connections()
+        if self.failures:
+            time.sleep(min(DRAIN_RETRY_SECONDS * 2 ** (self.failures - 1), DRAIN_RETRY_MAX_SECONDS))
+            self.wake()
+
+
+webhook_worker = WebhookWorker()